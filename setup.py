@@ -498,7 +498,7 @@ class TestCommand(TestBaseCommand):
         '''
         Finds all the tests modules in tests/, and runs them.
         '''
-        excludes = ["test_urls.py", "test_inject.py"]
+        excludes = ["test_urls.py", "test_inject.py", "test_xmlbench.py"]
         testfiles = self._find_tests_in_dir("tests", excludes)
 
         # Put clitest at the end, since it takes the longest
@@ -548,6 +548,15 @@ class TestURLFetch(TestBaseCommand):
         TestBaseCommand.run(self)
 
 
+class TestXMLBench(TestBaseCommand):
+    description = "Benchmark the XML backends on tests/xmlparse-xml"
+
+    def run(self):
+        self._testfiles = ["tests.test_xmlbench"]
+        self._force_verbose = True
+        TestBaseCommand.run(self)
+
+
 class TestInitrdInject(TestBaseCommand):
     description = "Test initrd inject with real kernels, fetched from URLs"
 
@@ -672,6 +681,7 @@ distutils.core.setup(
         'test_ui': TestUI,
         'test_urls': TestURLFetch,
         'test_initrd_inject': TestInitrdInject,
+        'test_xmlbench': TestXMLBench,
     },
 
     distclass=VMMDistribution,
@@ -16,12 +16,15 @@
 # MA 02110-1301 USA.
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from tests import utils
 
 from virtinst import Capabilities
 from virtinst import DomainCapabilities
+from virtinst.conncache import ConnectionCache
 
 
 conn = utils.open_testdriver()
@@ -83,6 +86,15 @@ class TestCapabilities(unittest.TestCase):
         self.assertEqual(len(cells[0].cpus), 8)
         self.assertEqual(cells[0].cpus[3].id, '3')
 
+    def testCapsHugepages(self):
+        host = self._buildCaps("kvm-ppc64le.xml").host
+        self.assertEqual([p.size for p in host.cpu.pages],
+                         [64, 16384, 16777216])
+        cell = host.topology.cells[0]
+        self.assertEqual(cell.id, 0)
+        self.assertEqual([(p.size, p.count) for p in cell.pages],
+                         [(64, 1048576), (16384, 0), (16777216, 0)])
+
 
     ####################################
     # Test getCPUModel output handling #
@@ -132,5 +144,65 @@ class TestCapabilities(unittest.TestCase):
             ["rom", "pflash"])
 
 
+    ########################
+    # conncache.py testing #
+    ########################
+
+    def testConnectionCache(self):
+        cachedir = tempfile.mkdtemp()
+        try:
+            cache = ConnectionCache(conn, cachedir)
+            self.assertEqual(cache.get_caps_xml(), None)
+            cache.set_caps_xml("<capabilities/>")
+            cache.set_domcaps_xml("/usr/bin/foo", "x86_64", None, "kvm",
+                                  "<domainCapabilities/>")
+            cache.set_support("SUPPORT_CONN_STREAM", True)
+
+            # Nothing hits the disk until flush()
+            self.assertFalse(os.path.exists(cache.get_path()))
+            cache.flush()
+
+            # A fresh cache object reads back what was written
+            cache = ConnectionCache(conn, cachedir)
+            self.assertEqual(cache.get_caps_xml(), "<capabilities/>")
+            self.assertEqual(cache.get_domcaps_xml("/usr/bin/foo",
+                "x86_64", None, "kvm"), "<domainCapabilities/>")
+            self.assertEqual(cache.get_domcaps_xml("/usr/bin/foo",
+                "i686", None, "kvm"), None)
+            self.assertEqual(cache.get_support("SUPPORT_CONN_STREAM"), True)
+
+            # Expired data is dropped
+            origage = ConnectionCache.MAX_AGE
+            try:
+                ConnectionCache.MAX_AGE = -1
+                cache = ConnectionCache(conn, cachedir)
+                self.assertEqual(cache.get_caps_xml(), None)
+            finally:
+                ConnectionCache.MAX_AGE = origage
+
+            # Installing a new emulator next to a cached one drops the caps
+            emudir = os.path.join(cachedir, "bin")
+            os.mkdir(emudir)
+            cache.set_caps_xml("<capabilities><emulator>%s</emulator>"
+                "</capabilities>" % os.path.join(emudir, "qemu-kvm"))
+            cache.flush()
+            self.assertTrue(ConnectionCache(conn, cachedir).get_caps_xml())
+            os.utime(emudir, (0, 0))
+            self.assertEqual(ConnectionCache(conn, cachedir).get_caps_xml(),
+                             None)
+
+            # Corrupt files are ignored
+            open(cache.get_path(), "w").write("{foo")
+            cache = ConnectionCache(conn, cachedir)
+            self.assertEqual(cache.get_support("SUPPORT_CONN_STREAM"), None)
+
+            cache.set_caps_xml("<capabilities/>")
+            cache.flush()
+            cache.invalidate()
+            self.assertFalse(os.path.exists(cache.get_path()))
+        finally:
+            shutil.rmtree(cachedir)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -609,11 +609,27 @@ c.add_valid("--cpu somemodel")  # Simple --cpu
 c.add_valid("--security label=foobar.label,relabel=yes")  # --security implicit static
 c.add_valid("--security label=foobar.label,a1,z2,b3,type=static,relabel=no")  # static with commas 1
 c.add_valid("--security label=foobar.label,a1,z2,b3")  # --security static with commas 2
+c.add_valid("--iothreads 2 --cputune iothreadpin0.iothread=1,iothreadpin0.cpuset=1-3")  # iothreads with pinning
+c.add_valid("--cputune emulatorpin.cpuset=0-1")  # emulator pinning
+c.add_valid("--vcpus 4 --cpu host,placement=auto-numa")  # automatic NUMA placement
+c.add_valid("--vcpus 4 --cpu placement=auto-numa --cputune vcpupin0.vcpu=0,vcpupin0.cpuset=1")  # auto-numa keeps explicit vcpupin
+c.add_valid("--iothreads iothreadid0.id=1,iothreadid1.id=5")  # explicit iothread IDs
+c.add_valid("--vcpus 4 --tune throughput")  # throughput tuning profile
+c.add_valid("--vcpus 4 --tune latency --memballoon virtio")  # latency profile, explicit balloon wins
+c.add_valid("--tune profile=density")  # density tuning profile
+c.add_valid("--vcpus 4 --tune profile=throughput,dry")  # only print the profile diff
 c.add_compare("--cpuset auto --vcpus 2", "cpuset-auto")  # --cpuset=auto actually works
 c.add_invalid("--vcpus 32 --cpuset=969-1000")  # Bogus cpuset
 c.add_invalid("--vcpus 32 --cpuset=autofoo")  # Bogus cpuset
 c.add_invalid("--clock foo_tickpolicy=merge")  # Unknown timer
 c.add_invalid("--security foobar")  # Busted --security
+c.add_invalid("--iothreads 2,assign=foo")  # Unknown iothread assignment
+c.add_invalid("--cpu placement=foo")  # Unknown cpu placement
+c.add_invalid("--tune profile=foo")  # Unknown tuning profile
+c.add_invalid("--tune dry")  # dry without a tuning profile
+
+c = vinst.add_category("cpuram-numa", "--connect %(URI-KVM-PPC64LE)s --noautoconsole --import --disk none --graphics none --controller usb,model=none --network none")
+c.add_compare("--vcpus 4 --cpu placement=auto-numa --numatune 16-17", "cpu-auto-numa")  # auto-numa picks a single host cell from the nodeset and pins to it
 
 
 
@@ -642,6 +658,7 @@ c.add_valid("--disk pool=default,size=.00001")  # Building 'default' pool
 c.add_valid("--disk %(AUTOMANAGEIMG)s,size=.1")  # autocreate the pool
 c.add_valid("--disk %(NEWIMG1)s,sparse=true,size=100000000 --check disk_size=off")  # Don't warn about fully allocated file exceeding disk space
 c.add_valid("--disk %(EXISTIMG1)s,snapshot_policy=no")  # Disable snasphot for disk
+c.add_valid("--iothreads 1 --disk %(EXISTIMG1)s,bus=virtio,iothread=1")  # Explicit disk iothread
 c.add_invalid("--file %(NEWIMG1)s --file-size 100000 --nonsparse")  # Nonexisting file, size too big
 c.add_invalid("--file %(NEWIMG1)s --file-size 100000")  # Huge file, sparse, but no prompting
 c.add_invalid("--file %(NEWIMG1)s")  # Nonexisting file, no size
@@ -663,6 +680,9 @@ c.add_invalid("--disk source_pool=rbd-ceph,source_volume=vol1")  # Collision wit
 c.add_invalid("--disk source_pool=default-pool,source_volume=idontexist")  # trying to lookup non-existent volume, hit specific error code
 c.add_invalid("--disk size=1 --security model=foo,type=bar")  # Libvirt will error on the invalid security params, which should trigger the code path to clean up the disk images we created.
 
+c = vinst.add_category("storage-kvm", "--connect %(URI-KVM)s --noautoconsole --import --graphics none --controller usb,model=none --network none", compare_check=support.SUPPORT_CONN_IOTHREADS)
+c.add_compare("--iothreads 2,assign=auto --disk %(EXISTIMG1)s,bus=virtio --disk %(EXISTIMG2)s,bus=virtio --disk %(EXISTIMG1)s,bus=scsi --controller scsi,model=virtio-scsi", "iothreads-assign-auto")  # Spread disks and virtio-scsi across iothreads
+
 
 ################
 # Panic device #
@@ -680,6 +700,15 @@ c = vinst.add_category("panic", "--connect %(URI-KVM-S390X)s --noautoconsole --i
 c.add_compare("--panic default", "panic-s390x-default")
 
 
+#####################
+# Disk I/O defaults #
+#####################
+
+c = vinst.add_category("disk-io-profile", "--connect %(URI-KVM)s --noautoconsole --import --graphics none --controller usb,model=none --network none")
+c.add_compare("--disk %(BLOCKVOL)s", "disk-io-profile-block")  # plain block device, cache=none,io=native
+c.add_compare("--disk /dev/disk-pool/diskvol1 --check path_in_use=off", "disk-io-profile-thin-block", compare_check=support.SUPPORT_CONN_DISK_DETECT_ZEROES)  # thin LVM volume also gets unmap
+
+
 ################################################
 # Invalid devices that hit virtinst code paths #
 ################################################
@@ -696,6 +725,7 @@ c.add_invalid("--serial unix")  # Unix with no path
 c.add_invalid("--serial null,path=/tmp/foo")  # Path where it doesn't belong
 c.add_invalid("--channel pty,target_type=guestfwd")  # --channel guestfwd without target_address
 c.add_invalid("--boot uefi")  # URI doesn't support UEFI bits
+c.add_invalid("--network default,tuning=foo")  # Unknown network tuning
 c.add_invalid("--connect %(URI-KVM)s --boot uefi,arch=ppc64")  # unsupported arch for UEFI
 
 
@@ -745,6 +775,12 @@ c.add_compare("", "noargs-fail", auto_printarg=False)  # No arguments
 c.add_valid("--panic help --disk=?")  # Make sure introspection doesn't blow up
 c.add_invalid("--hvm --nodisks --pxe foobar")  # Positional arguments error
 c.add_invalid("--nodisks --pxe --name test")  # Colliding name
+c.add_valid("--pxe --disk size=.0001 --count 3 --parallel 2")  # Bulk creation, default disk paths from the guest names
+c.add_valid("--pxe --disk %(MANAGEDNEW1)s,size=.0000001 --count 2")  # Bulk creation, explicit new disk path gets numbered
+c.add_valid("--pxe --nodisks --count 2 --dry-run")  # Bulk creation dry run
+c.add_invalid("--pxe --disk %(EXISTIMG1)s --count 2")  # Writable disk shared by all guests
+c.add_invalid("--pxe --nodisks --count 2 --network default,mac=22:11:11:11:11:11")  # Fixed MAC with --count
+c.add_invalid("--pxe --nodisks --count 0")  # Bogus --count
 
 
 
@@ -812,11 +848,18 @@ c.add_compare("--machine q35 --cdrom %(EXISTIMG2)s --disk %(EXISTIMG1)s", "q35-d
 c.add_compare("--disk size=20 --os-variant solaris10", "solaris10-defaults")  # test solaris OS defaults
 c.add_compare("--connect %(URI-KVM-REMOTE)s --import --disk %(EXISTIMG1)s --os-variant fedora21 --pm suspend_to_disk=yes", "f21-kvm-remote")
 
+c.add_valid("--disk none --pxe --os-variant fedora20 --vcpus 4 --network default,tuning=auto")  # vhost + multiqueue for virtio NICs
+c.add_valid("--disk none --pxe --vcpus 4 --network default,model=virtio,driver_queues=2,tuning=auto")  # explicit queues win over tuning=auto
 c.add_valid("--connect %(URI-KVM-NODOMCAPS)s --arch aarch64 --nodisks --pxe")  # attempt to default to aarch64 UEFI, but it fails, but should only print warnings
 c.add_invalid("--disk none --boot network --machine foobar")  # Unknown machine type
 c.add_invalid("--nodisks --boot network --arch mips --virt-type kvm")  # Invalid domain type for arch
 c.add_invalid("--nodisks --boot network --paravirt --arch mips")  # Invalid arch/virt combo
 
+c = vinst.add_category("kvm-tuning", "--connect %(URI-KVM)s --noautoconsole --import --disk none --graphics none --controller usb,model=none")
+c.add_compare("--vcpus 4 --network default,model=virtio,tuning=auto", "network-tuning-auto")  # vhost and one queue per vCPU
+c.add_compare("--network none --tune density", "tune-density")  # density profile, host independent
+c.add_compare("--network none --tune density,dry", "tune-density-dry")  # only print the profile diff
+
 c = vinst.add_category("kvm-q35", "--connect %(URI-KVM-Q35)s --noautoconsole", compare_check=support.SUPPORT_CONN_VMPORT)
 c.add_compare("--boot uefi --disk none", "boot-uefi")
 
@@ -912,8 +955,11 @@ c.add_invalid("test-for-virtxml --add-device --host-device 0x0781:0x5151 --updat
 c.add_invalid("test-for-virtxml --remove-device --host-device 1 --update")  # test driver doesn't support detachdevice...
 c.add_invalid("test-for-virtxml --edit --graphics password=foo --update")  # test driver doesn't support updatdevice...
 c.add_invalid("--build-xml --memory 10,maxmemory=20")  # building XML for option that doesn't support it
+c.add_invalid("test --edit --tune foo")  # Unknown tuning profile
+c.add_valid("test --edit --tune latency,dry")  # print the tuning profile diff only
 c.add_compare("test --print-xml --edit --vcpus 7", "print-xml")  # test --print-xml
 c.add_compare("--edit --cpu host-passthrough", "stdin-edit", input_file=(xmldir + "/virtxml-stdin-edit.xml"))  # stdin test
+c.add_compare("--edit --tune density,dry", "tune-density-dry", input_file=(xmldir + "/virtxml-stdin-edit.xml"))  # tuning profile diff against stdin XML
 c.add_compare("--build-xml --cpu pentium3,+x2apic", "build-cpu")
 c.add_compare("--build-xml --tpm /dev/tpm", "build-tpm")
 c.add_compare("--build-xml --blkiotune weight=100,device_path=/dev/sdf,device_weight=200", "build-blkiotune")
@@ -1025,6 +1071,15 @@ c.add_invalid("-o test-many-devices --auto-clone")  # VM is running, but --clone
 c.add_invalid("-o test-clone-simple -n newvm --file %(EXISTIMG1)s --clone-running")  # Should complain about overwriting existing file
 
 
+c.add_valid("-o test-clone-simple --count 3 --clone-running")  # Batch clone with generated names
+c.add_valid("-o test-clone-simple --count 3 --name-template web-%%d --parallel 2 --clone-running")  # Batch clone with name template
+c.add_valid("--original-xml %(CLONE_STORAGE_XML)s --count 2 --linked")  # Batch of linked clones
+c.add_valid("-o test --count 2 --print-xml")  # Batch clone XML only
+c.add_invalid("-o test-clone-simple --count 2 --name newvm --clone-running")  # --name with --count
+c.add_invalid("-o test-clone-simple --count 2 --name-template web --clone-running")  # Template without %%d
+c.add_invalid("-o test --name-template web-%%d --auto-clone")  # --name-template without --count
+
+
 c = vclon.add_category("general", "-n clonetest")
 c.add_valid("-o test --auto-clone")  # Auto flag, no storage
 c.add_valid("-o test --file %(NEWCLONEIMG1)s --file %(NEWCLONEIMG2)s")  # Nodisk, but with spurious files passed
@@ -1034,6 +1089,7 @@ c.add_valid("--original-xml %(CLONE_DISK_XML)s --file virt-install --file %(EXIS
 c.add_valid("--original-xml %(CLONE_DISK_XML)s --file %(NEWCLONEIMG1)s --file %(NEWCLONEIMG2)s --file %(NEWCLONEIMG3)s --force-copy=hdc")  # XML w/ disks, force copy a readonly target
 c.add_valid("--original-xml %(CLONE_DISK_XML)s --file %(NEWCLONEIMG1)s --file %(NEWCLONEIMG2)s --force-copy=fda")  # XML w/ disks, force copy a target with no media
 c.add_valid("--original-xml %(CLONE_STORAGE_XML)s --file %(MANAGEDNEW1)s")  # XML w/ managed storage, specify managed path
+c.add_valid("--original-xml %(CLONE_STORAGE_XML)s --file %(MANAGEDNEW1)s --linked")  # linked clone, qcow2 overlay on managed storage
 c.add_valid("--original-xml %(CLONE_NOEXIST_XML)s --file %(EXISTIMG1)s --preserve")  # XML w/ managed storage, specify managed path across pools# Libvirt test driver doesn't support cloning across pools# XML w/ non-existent storage, with --preserve
 c.add_valid("-o test -n test-clone --auto-clone --replace")  # Overwriting existing VM
 c.add_invalid("-o test foobar")  # Positional arguments error
@@ -1045,6 +1101,8 @@ c.add_invalid("--original-xml %(CLONE_DISK_XML)s --file virt-install --file %(EX
 c.add_invalid("--original-xml %(CLONE_DISK_XML)s --file %(NEWCLONEIMG1)s --file %(NEWCLONEIMG2)s --force-copy=hdc")  # XML w/ disks, force copy but not enough disks passed
 c.add_invalid("--original-xml %(CLONE_STORAGE_XML)s --file /tmp/clonevol")  # XML w/ managed storage, specify unmanaged path (should fail)
 c.add_invalid("--original-xml %(CLONE_NOEXIST_XML)s --file %(EXISTIMG1)s")  # XML w/ non-existent storage, WITHOUT --preserve
+c.add_invalid("--original-xml %(CLONE_STORAGE_XML)s --file %(MANAGEDNEW1)s --linked --preserve-data")  # linked clone needs new storage
+c.add_invalid("-o test-clone-simple --auto-clone --linked --clone-running")  # linked clone needs the original shutoff, even with --clone-running
 
 
 
@@ -55,7 +55,7 @@ class TestClone(unittest.TestCase):
 
     def _clone_helper(self, filebase, disks=None, force_list=None,
                       skip_list=None, compare=True, conn=None,
-                      clone_disks_file=None):
+                      clone_disks_file=None, linked=False):
         """Helper for comparing clone input/output from 2 xml files"""
         infile = os.path.join(clonexml_dir, filebase + "-in.xml")
         in_content = utils.read_file(infile)
@@ -68,6 +68,7 @@ class TestClone(unittest.TestCase):
             cloneobj.force_target = force
         for skip in skip_list or []:
             cloneobj.skip_target = skip
+        cloneobj.linked = linked
 
         cloneobj = self._default_clone_values(cloneobj, disks)
 
@@ -170,6 +171,19 @@ class TestClone(unittest.TestCase):
                                   None, "/tmp/clone2.img"],
                            skip_list=["hda", "fdb"])
 
+    def testCloneStorageLinked(self):
+        base = "linked"
+        self._clone_helper(base, ["%s/new1.img" % POOL1,
+                                  "%s/new2.img" % POOL1],
+                           linked=True)
+
+    def testCloneLinkedUnmanaged(self):
+        # Overlays can only be created as new pool volumes
+        self.assertRaises((ValueError, RuntimeError),
+                          self._clone_helper, "linked",
+                          disks=["/tmp/clone1.img", "/tmp/clone2.img"],
+                          linked=True, compare=False)
+
     def testCloneFullPool(self):
         base = "fullpool"
         try:
@@ -251,6 +251,20 @@ class TestNodeDev(unittest.TestCase):
         self.assertEqual(dev.drm_pretty_name(conn),
                          "0000:00:02:0 Intel Corporation HD Graphics 530 (render)")
 
+    def testSniffDeviceType(self):
+        # The raw XML capability type sniffing used by NodeDevice.parse
+        # must agree with a full parse for every test driver device
+        from virtinst import nodedev
+        for name in conn.listDevices(None, 0):
+            xml = conn.nodeDeviceLookupByName(name).XMLDesc(0)
+            tmpdev = NodeDevice(conn, parsexml=xml,
+                                allow_node_instantiate=True)
+            self.assertEqual(nodedev._sniffDeviceType(xml),
+                             tmpdev.device_type)
+
+        self.assertEqual(nodedev._sniffDeviceType(unknown_xml), "frobtype")
+        self.assertEqual(nodedev._sniffDeviceType("<device/>"), None)
+
     def testUnknownDevice(self):
         vals = {"name": "foodevice", "parent": "computer",
                 "device_type": "frobtype"}
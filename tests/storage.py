@@ -20,6 +20,7 @@ import os
 import unittest
 
 from virtinst import StoragePool, StorageVolume
+from virtinst import diskbackend
 
 from tests import utils
 
@@ -223,5 +224,31 @@ class TestStorage(unittest.TestCase):
                                                  host=host)
         self.assertTrue(len(lst) == 0)
 
+    def testPathResolver(self):
+        # Remote connection, so the snapshot isn't checked against
+        # the local filesystem
+        conn = utils.open_test_remote()
+        resolver = conn.get_storage_path_resolver()
+
+        vol, pool = resolver.lookup_vol("/dev/default-pool/default-vol")
+        self.assertEqual(vol.name(), "default-vol")
+        self.assertEqual(pool.name(), "default-pool")
+        self.assertEqual(resolver.lookup_pool("/dev/default-pool/").name(),
+                         "default-pool")
+        self.assertEqual(resolver.lookup_vol("/dev/default-pool/idontexist"),
+                         (None, None))
+        self.assertEqual(resolver.lookup_pool("/idontexist"), None)
+
+        # Checking a new disk path doesn't throw the snapshot away
+        snapshot = resolver._get_snapshot()
+        vol, pool = diskbackend.check_if_path_managed(conn,
+            "/dev/default-pool/newvol.img")
+        self.assertEqual((vol, pool.name()), (None, "default-pool"))
+        self.assertTrue(resolver._get_snapshot() is snapshot)
+
+        resolver.invalidate()
+        vol, pool = resolver.lookup_vol("/dev/default-pool/default-vol")
+        self.assertEqual(vol.name(), "default-vol")
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,131 @@
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import glob
+import os
+import time
+import unittest
+
+import virtinst
+from virtinst import xmlbuilder
+
+from tests import utils
+
+# Benchmark of the virtinst XML backends. Not part of the regular test
+# suite, run it with: python setup.py test_xmlbench
+#
+# Every file in tests/xmlparse-xml is parsed, altered, and serialized
+# ITERATIONS times with each installed backend. The output of all
+# backends is also compared, since they are expected to be identical.
+
+ITERATIONS = int(os.environ.get("VIRTINST_XMLBENCH_ITERATIONS", 20))
+
+conn = utils.open_testdriver()
+
+_root_classes = {
+    "domain": virtinst.Guest,
+    "domainsnapshot": virtinst.DomainSnapshot,
+    "interface": virtinst.Interface,
+    "network": virtinst.Network,
+    "pool": virtinst.StoragePool,
+    "volume": virtinst.StorageVolume,
+}
+
+
+def _load_corpus():
+    ret = []
+    for path in sorted(glob.glob("tests/xmlparse-xml/*.xml")):
+        xml = open(path).read()
+        rootname = xml.split("<", 1)[1].split()[0].strip(">")
+        ret.append((_root_classes[rootname], xml))
+    return ret
+
+
+def _mutate(obj):
+    # Only guests are altered: the other objects validate name
+    # changes against libvirt, which would skew the numbers
+    if not isinstance(obj, virtinst.Guest):
+        return
+    obj.name = obj.name + "-bench"
+    obj.description = "benchmark <&> run"
+    obj.features.acpi = not obj.features.acpi
+    for dev in obj.get_all_devices()[:1]:
+        obj.remove_device(dev)
+        obj.add_device(dev)
+    obj.add_device(virtinst.VirtualWatchdog(obj.conn))
+
+
+def _run_backend(backend, corpus):
+    xmlbuilder.set_xml_backend(backend)
+    times = {"parse": 0.0, "mutate": 0.0, "serialize": 0.0}
+    output = []
+
+    for ignore in range(ITERATIONS):
+        output = []
+        for cls, xml in corpus:
+            start = time.time()
+            obj = cls(conn, parsexml=xml)
+            times["parse"] += time.time() - start
+
+            start = time.time()
+            _mutate(obj)
+            times["mutate"] += time.time() - start
+
+            start = time.time()
+            output.append(obj.get_xml_config())
+            times["serialize"] += time.time() - start
+
+    return times, output
+
+
+class TestXMLBench(unittest.TestCase):
+    def testBackends(self):
+        backends = []
+        for name in ["libxml2", "lxml"]:
+            try:
+                xmlbuilder.set_xml_backend(name)
+            except RuntimeError:
+                print("%s is not installed, skipping" % name)
+                continue
+            backends.append(name)
+
+        corpus = _load_corpus()
+        results = {}
+        try:
+            for backend in backends:
+                results[backend] = _run_backend(backend, corpus)
+        finally:
+            xmlbuilder.set_xml_backend()
+
+        count = len(corpus) * ITERATIONS
+        print("\n%d documents, %d iterations" % (len(corpus), ITERATIONS))
+        print("%-10s %12s %12s %12s" %
+              ("backend", "parse/s", "mutate/s", "serialize/s"))
+        for backend in backends:
+            times = results[backend][0]
+            print("%-10s %12.1f %12.1f %12.1f" % (backend,
+                count / times["parse"], count / times["mutate"],
+                count / times["serialize"]))
+
+        outputs = [results[backend][1] for backend in backends]
+        for output in outputs[1:]:
+            for idx, xml in enumerate(output):
+                self.assertEqual(outputs[0][idx], xml)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -185,6 +185,27 @@ class TestXMLMisc(unittest.TestCase):
             virtinst.DomainNumatune.cpuset_str_to_tuple,
             conn, "16")
 
+    def testCpusetList(self):
+        # cpuset string <-> pCPU list helpers used by auto-numa placement
+        from virtinst.domainnumatune import cpuset_to_list, list_to_cpuset
+
+        self.assertEqual(cpuset_to_list("0-3,6"), [0, 1, 2, 3, 6])
+        self.assertEqual(cpuset_to_list("0-5,^2,^4"), [0, 1, 3, 5])
+        self.assertEqual(cpuset_to_list("^1,0-2,"), [0, 2])
+        self.assertEqual(cpuset_to_list("3,1,3"), [1, 3])
+        self.assertEqual(cpuset_to_list(""), [])
+        self.assertEqual(cpuset_to_list(None), [])
+
+        self.assertEqual(list_to_cpuset([6, 0, 1, 2, 3]), "0-3,6")
+        self.assertEqual(list_to_cpuset([1, 3, 5]), "1,3,5")
+        self.assertEqual(list_to_cpuset([4, 4, 5]), "4-5")
+        self.assertEqual(list_to_cpuset([]), "")
+
+        for cpuset in ["0", "0-3", "1,3-5,8", "80-119,160-199"]:
+            self.assertEqual(list_to_cpuset(cpuset_to_list(cpuset)), cpuset)
+        self.assertEqual(list_to_cpuset(cpuset_to_list("0-7,^3")),
+                         "0-2,4-7")
+
     def testDiskNumbers(self):
         # Various testing our target generation
         self.assertEqual("a", VirtualDisk.num_to_target(1))
@@ -222,6 +243,50 @@ class TestXMLMisc(unittest.TestCase):
             disk.generate_target(["sda", "sdg", "sdi"], 0))
         self.assertEqual("sdh", disk.generate_target(["sda", "sdg"], 1))
 
+    def testGenerateName(self):
+        # With existing_names, candidates are checked locally and the
+        # collision callback only verifies the chosen name
+        calls = []
+        created = []
+
+        def cb(name):
+            calls.append(name)
+            return name in created
+
+        existing = ["web-%d" % i for i in range(1, 200)]
+        name = virtinst.util.generate_name("web", cb, lib_collision=False,
+            force_num=True, existing_names=existing)
+        self.assertEqual(name, "web-200")
+        self.assertEqual(calls, ["web-200"])
+
+        # Names created after the list was fetched are still caught
+        calls = []
+        created = ["web-200"]
+        name = virtinst.util.generate_name("web", cb, lib_collision=False,
+            force_num=True, collidelist=["web-201"], existing_names=existing)
+        self.assertEqual(name, "web-202")
+        self.assertEqual(calls, ["web-200", "web-202"])
+
+    def testDiskMountFstype(self):
+        # /proc/mounts parsing used to pick the disk I/O profile
+        from virtinst import devicedisk
+        mounts = ("/dev/sda1 / ext4 rw,relatime 0 0\n"
+                  "server:/export /var/lib/libvirt nfs4 rw 0 0\n"
+                  "/dev/sdb1 /var/lib/libvirt/images xfs rw 0 0\n"
+                  "//smb/share /mnt/my\\040share cifs rw 0 0\n"
+                  "bogus\n")
+
+        def _fstype(path):
+            return devicedisk._get_mount_fstype(mounts, path)
+
+        self.assertEqual(_fstype("/var/lib/libvirt/images/foo.img"), "xfs")
+        self.assertEqual(_fstype("/var/lib/libvirt/images"), "xfs")
+        self.assertEqual(_fstype("/var/lib/libvirt/foo.img"), "nfs4")
+        self.assertEqual(_fstype("/var/lib/libvirt-other/foo.img"), "ext4")
+        self.assertEqual(_fstype("/mnt/my share/foo.img"), "cifs")
+        self.assertEqual(_fstype("/mnt/my/foo.img"), "ext4")
+        self.assertEqual(devicedisk._get_mount_fstype("", "/foo"), None)
+
     def testQuickTreeinfo(self):
         # Simple sanity test to make sure detect_distro works. test-urls
         # does much more exhaustive testing but it's only run occasionally
@@ -262,6 +327,59 @@ class TestXMLMisc(unittest.TestCase):
         cpu = virtinst.CPU(_default_conn)
         self.assertEqual(cpu.vcpus_from_topology(), 1)
 
+    def testCheckHugepages(self):
+        # Host reports 16384 and 16777216 KiB huge pages on NUMA cells
+        # 0, 1, 16 and 17. Stub out the free page counts
+        freepages = {}
+
+        def _make(memory=409600):
+            conn = utils.openconn(utils.uri_kvm_ppc64le)
+            conn._support_cache[conn.SUPPORT_CONN_FREE_PAGES] = True
+            conn.getFreePages = lambda sizes, start, count: freepages
+            g = conn.caps.lookup_virtinst_guest()
+            g.memory = memory
+            g.memoryBacking.hugepages = True
+            return g
+
+        # Best single node fit, with the largest page size that divides
+        # guest memory
+        freepages = {0: {16384: 30}, 1: {16384: 26}}
+        g = _make()
+        g.check_hugepages()
+        self.assertEqual(g.memoryBacking.page_size, "16384")
+        self.assertEqual(g.memoryBacking.page_unit, "KiB")
+        self.assertEqual(g.numatune.memory_nodeset, "1")
+
+        # Nothing fits on a single node, but does spread across all of them
+        freepages = {0: {16384: 15}, 1: {16384: 15}}
+        g = _make()
+        g.check_hugepages()
+        self.assertEqual(g.memoryBacking.page_size, "16384")
+        self.assertEqual(g.numatune.memory_nodeset, None)
+
+        # Fixed nodeset without enough pages
+        g = _make()
+        g.numatune.memory_nodeset = "16-17"
+        self.assertRaises(ValueError, g.check_hugepages)
+
+        # Unsupported page size
+        g = _make()
+        g.memoryBacking.page_size = 2
+        g.memoryBacking.page_unit = "M"
+        self.assertRaises(ValueError, g.check_hugepages)
+
+        # Guest memory isn't a multiple of the page size
+        g = _make(memory=409600 + 4)
+        g.memoryBacking.page_size = 16384
+        self.assertRaises(ValueError, g.check_hugepages)
+
+        # No free page info from libvirt, nothing is changed
+        g = _make()
+        g.conn._support_cache[g.conn.SUPPORT_CONN_FREE_PAGES] = False
+        g.check_hugepages()
+        self.assertEqual(g.memoryBacking.page_size, None)
+        self.assertEqual(g.numatune.memory_nodeset, None)
+
     def testAC97(self):
         # Test setting ac97 version given various version combos
         def has_ac97(conn):
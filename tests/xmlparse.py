@@ -20,6 +20,7 @@ import traceback
 import unittest
 
 import virtinst
+from virtinst import xmlbuilder
 
 from tests import utils
 
@@ -1368,6 +1369,67 @@ class XMLParseTest(unittest.TestCase):
         guest.cpu.clear()
         utils.diff_compare(guest.get_xml_config(), outfile)
 
+    def testCopyAndXMLCache(self):
+        # Copies share the parsed document until one of them is altered,
+        # and get_xml_config output is cached until something changes
+        infile = "tests/xmlparse-xml/change-guest-in.xml"
+        guest = virtinst.Guest(conn, parsexml=open(infile).read())
+        origxml = guest.get_xml_config()
+        self.assertTrue(guest.get_xml_config() is origxml)
+
+        guestcopy = guest.copy()
+        # Generating XML for an unaltered copy doesn't unshare it
+        self.assertEqual(guestcopy.get_xml_config(), origxml)
+        self.assertTrue(guestcopy._xmlstate.doc.xmlapi is
+                        guest._xmlstate.doc.xmlapi)
+        guestcopy.name = "copy-name"
+        guestcopy.features.acpi = False
+        guestcopy.get_devices("disk")[0].path = "/copy-path"
+        guestcopy.remove_device(guestcopy.get_devices("disk")[1])
+        copyxml = guestcopy.get_xml_config()
+        self.assertTrue("copy-name" in copyxml)
+        self.assertTrue("/copy-path" in copyxml)
+
+        self.assertEqual(guest.get_xml_config(), origxml)
+        self.assertTrue(guest.features.acpi)
+        self.assertNotEqual(guest.get_devices("disk")[0].path, "/copy-path")
+
+        guest.description = "cache test"
+        self.assertTrue("cache test" in guest.get_xml_config())
+        guest.add_device(virtinst.VirtualAudio(conn,
+            parsexml="""<sound model='pcspk'/>"""))
+        self.assertTrue("pcspk" in guest.get_xml_config())
+        self.assertFalse("pcspk" in guestcopy.get_xml_config())
+
+    def testNamespaceChildXML(self):
+        # Child objects don't redeclare namespaces set on the domain
+        xml = ("<domain type='test' "
+               "xmlns:qemu='http://libvirt.org/schemas/domain/qemu/1.0'>\n"
+               "  <name>foo</name>\n"
+               "  <qemu:commandline>\n"
+               "    <qemu:arg value='-foo'/>\n"
+               "  </qemu:commandline>\n"
+               "</domain>\n")
+        guest = virtinst.Guest(conn, parsexml=xml)
+        self.assertTrue("xmlns:qemu" in guest.get_xml_config())
+
+        argxml = guest.xmlns_qemu.args[0].get_xml_config()
+        self.assertTrue("<qemu:arg value=\"-foo\"/>" in argxml)
+        self.assertFalse("xmlns" in argxml)
+        self.assertFalse("xmlns" in guest.xmlns_qemu.get_xml_config())
+
+
+@unittest.skipIf(not xmlbuilder.lxml_etree, "lxml is not installed")
+class XMLParseTestLxml(XMLParseTest):
+    """
+    Run the XMLParseTest cases again using the lxml XML backend
+    """
+    def setUp(self):
+        xmlbuilder.set_xml_backend("lxml")
+
+    def tearDown(self):
+        xmlbuilder.set_xml_backend()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -863,18 +863,18 @@ class vmmAddHardware(vmmGObjectUI):
         devlist = self.widget("host-device")
         model = devlist.get_model()
         model.clear()
-        subdevs = []
+        subdevs = {}
 
         if subtype:
-            subdevs = self.conn.filter_nodedevs(subtype, subcap)
+            for subdev in self.conn.filter_nodedevs(subtype, subcap):
+                subdevs.setdefault(subdev.xmlobj.parent, []).append(subdev)
 
         devs = self.conn.filter_nodedevs(devtype, devcap)
         for dev in devs:
             prettyname = dev.xmlobj.pretty_name()
 
-            for subdev in subdevs:
-                if dev.xmlobj.name == subdev.xmlobj.parent:
-                    prettyname += " (%s)" % subdev.xmlobj.pretty_name()
+            for subdev in subdevs.get(dev.xmlobj.name, []):
+                prettyname += " (%s)" % subdev.xmlobj.pretty_name()
 
             model.append([prettyname, dev.xmlobj])
 
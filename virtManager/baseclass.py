@@ -32,6 +32,87 @@ from gi.repository import Gtk
 from . import config
 
 
+def _make_emit_key(obj, signal, args):
+    """
+    Build a hashable key identifying an idle emission, or None if
+    the args can't be compared
+    """
+    keyargs = []
+    for arg in args:
+        if isinstance(arg, dict):
+            arg = tuple(sorted(arg.items()))
+        keyargs.append(arg)
+
+    key = (id(obj), signal, tuple(keyargs))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _IdleEmitQueue(object):
+    """
+    Queue of pending vmmGObject.idle_emit signals. Identical emissions
+    for the same object that are requested before the queue is flushed
+    are merged into one, and the whole queue is flushed by a single
+    idle callback.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_keys = set()
+        self._idle_id = None
+        self._unique = 0
+
+        self.emitted = 0
+        self.merged = 0
+
+    def queue(self, obj, signal, args):
+        key = _make_emit_key(obj, signal, args)
+
+        with self._lock:
+            if key is not None and key in self._pending_keys:
+                self.merged += 1
+                return
+
+            if key is None:
+                # Unhashable args, never merge
+                self._unique += 1
+                key = ("unique", self._unique)
+            self._pending_keys.add(key)
+            self._pending.append((key, obj, signal, args))
+
+            if self._idle_id is None:
+                self._idle_id = GLib.idle_add(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._pending_keys = set()
+            self._idle_id = None
+
+        for ignore, obj, signal, args in pending:
+            self.emitted += 1
+            try:
+                obj.emit(signal, *args)
+            except Exception:
+                logging.exception("Error emitting %s for %s", signal, obj)
+        return False
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "emitted": self.emitted,
+                "merged": self.merged,
+                "pending": len(self._pending),
+            }
+
+
+_IDLE_EMIT_QUEUE = _IdleEmitQueue()
+
+
 class vmmGObject(GObject.GObject):
     _leak_check = True
 
@@ -194,13 +275,19 @@ class vmmGObject(GObject.GObject):
 
     def idle_emit(self, signal, *args):
         """
-        Safe wrapper for using 'self.emit' with GLib.idle_add
+        Safe wrapper for using 'self.emit' with GLib.idle_add. If an
+        identical emission is already pending for this object, the
+        new request is merged into it.
         """
-        def emitwrap(_s, *_a):
-            self.emit(_s, *_a)
-            return False
+        _IDLE_EMIT_QUEUE.queue(self, signal, args)
 
-        self.idle_add(emitwrap, signal, *args)
+    @staticmethod
+    def get_idle_emit_stats():
+        """
+        Return a dict with counts of signals emitted and merged by
+        idle_emit over the life of the app
+        """
+        return _IDLE_EMIT_QUEUE.get_stats()
 
 
 class vmmGObjectUI(vmmGObject):
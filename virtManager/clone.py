@@ -241,6 +241,15 @@ class vmmCloneVM(vmmGObjectUI):
         cd = self.clone_design
         self.widget("clone-orig-name").set_text(cd.original_guest)
         self.widget("clone-new-name").set_text(cd.clone_name)
+        self.widget("clone-linked").set_active(False)
+        # The original disks become read-only backing images, which
+        # a running or paused VM would keep writing to
+        linked_ok = self.orig_vm.is_shutoff()
+        self.widget("clone-linked").set_sensitive(linked_ok)
+        tooltip = None
+        if not linked_ok:
+            tooltip = _("The VM must be shut off to create a linked clone.")
+        self.widget("clone-linked").set_tooltip_text(tooltip)
 
         uiutil.set_grid_row_visible(
             self.widget("clone-dest-host"), self.conn.is_remote())
@@ -577,6 +586,7 @@ class vmmCloneVM(vmmGObjectUI):
         no_storage = not bool(len(self.target_list))
         self.widget("clone-storage-box").set_visible(not no_storage)
         self.widget("clone-no-storage-pass").set_visible(no_storage)
+        self.widget("clone-linked").set_visible(not no_storage)
 
         skip_targets = []
         new_disks = []
@@ -753,6 +763,8 @@ class vmmCloneVM(vmmGObjectUI):
 
         # Make another clone_design
         cd = self.build_new_clone_design(name)
+        cd.linked = (self.widget("clone-linked").get_visible() and
+                     self.widget("clone-linked").get_active())
 
         # Set MAC addresses
         clonemacs = []
@@ -827,7 +839,9 @@ class vmmCloneVM(vmmGObjectUI):
         title = (_("Creating virtual machine clone '%s'") %
                  self.clone_design.clone_name)
         text = title
-        if self.clone_design.clone_disks:
+        if self.clone_design.linked:
+            text = title + _(" and linked storage")
+        elif self.clone_design.clone_disks:
             text = title + _(" and selected storage (this may take a while)")
 
         progWin = vmmAsyncJob(self._async_clone, [], self._finish_cb, [],
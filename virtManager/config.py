@@ -310,6 +310,8 @@ class vmmConfig(object):
         return self.conf.get("/vmlist-fields/disk-usage")
     def is_vmlist_network_traffic_visible(self):
         return self.conf.get("/vmlist-fields/network-traffic")
+    def is_vmlist_screenshot_visible(self):
+        return self.conf.get("/vmlist-fields/screenshot")
 
     def set_vmlist_guest_cpu_usage_visible(self, state):
         self.conf.set("/vmlist-fields/cpu-usage", state)
@@ -321,6 +323,8 @@ class vmmConfig(object):
         self.conf.set("/vmlist-fields/disk-usage", state)
     def set_vmlist_network_traffic_visible(self, state):
         self.conf.set("/vmlist-fields/network-traffic", state)
+    def set_vmlist_screenshot_visible(self, state):
+        self.conf.set("/vmlist-fields/screenshot", state)
 
     def on_vmlist_guest_cpu_usage_visible_changed(self, cb):
         return self.conf.notify_add("/vmlist-fields/cpu-usage", cb)
@@ -332,6 +336,8 @@ class vmmConfig(object):
         return self.conf.notify_add("/vmlist-fields/disk-usage", cb)
     def on_vmlist_network_traffic_visible_changed(self, cb):
         return self.conf.notify_add("/vmlist-fields/network-traffic", cb)
+    def on_vmlist_screenshot_visible_changed(self, cb):
+        return self.conf.notify_add("/vmlist-fields/screenshot", cb)
 
     # Keys preferences
     def get_keys_combination(self):
@@ -20,6 +20,7 @@
 
 import logging
 import os
+import queue
 import threading
 import time
 import traceback
@@ -34,6 +35,7 @@ from virtinst import support
 from virtinst import util
 
 from . import connectauth
+from . import module_trace
 from .baseclass import vmmGObject
 from .domain import vmmDomain
 from .interface import vmmInterface
@@ -176,6 +178,216 @@ class _ObjectList(vmmGObject):
         return None
 
 
+class _NodeDevIndex(object):
+    """
+    Index of vmmNodeDevice objects by device type, capability type and
+    vendor/product ID. Kept up to date by vmmConnection as nodedevs come,
+    go, or change, so nodedev queries don't need to walk and check the
+    XML of every device on the host.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # connkey -> list of index keys the device is filed under
+        self._devkeys = {}
+        # index key -> {connkey: vmmNodeDevice}
+        self._index = {}
+        # index key -> cached query result list
+        self._query_cache = {}
+
+    @staticmethod
+    def _is_usb_root_hub(xmlobj):
+        return (("Linux Foundation" in str(xmlobj.vendor_name) or
+                 ("Linux" in str(xmlobj.vendor_name) and
+                  xmlobj.vendor_id == "0x1d6b")) and
+                ("root hub" in str(xmlobj.product_name) or
+                 ("host controller" in str(xmlobj.product_name).lower() and
+                  str(xmlobj.product_id).startswith("0x000"))))
+
+    def _build_keys(self, xmlobj):
+        keys = [("all",)]
+        devtype = xmlobj.device_type
+        if (devtype == "usb_device" and self._is_usb_root_hub(xmlobj)):
+            # Root hubs are never interesting for device assignment, so
+            # they only show up in unfiltered queries
+            return keys
+
+        keys.append(("type", devtype))
+        devcap = getattr(xmlobj, "capability_type", None)
+        if devcap:
+            keys.append(("cap", devtype, devcap))
+            keys.append(("cap", None, devcap))
+        vendor = getattr(xmlobj, "vendor_id", None)
+        product = getattr(xmlobj, "product_id", None)
+        if vendor and product:
+            keys.append(("vendorproduct", devtype, vendor, product))
+        return keys
+
+    def _remove(self, connkey):
+        for key in self._devkeys.pop(connkey, []):
+            devs = self._index.get(key)
+            if devs is None:
+                continue
+            devs.pop(connkey, None)
+            if not devs:
+                del(self._index[key])
+
+    def update(self, dev):
+        """
+        (Re)index the passed vmmNodeDevice from its current XML
+        """
+        connkey = dev.get_connkey()
+        try:
+            keys = self._build_keys(dev.get_xmlobj())
+        except libvirt.libvirtError as e:
+            # Libvirt nodedev XML fetching can be busted
+            # https://bugzilla.redhat.com/show_bug.cgi?id=1225771
+            if e.get_error_code() != libvirt.VIR_ERR_NO_NODE_DEVICE:
+                logging.debug("Error fetching nodedev XML", exc_info=True)
+            keys = []
+
+        with self._lock:
+            self._remove(connkey)
+            self._devkeys[connkey] = keys
+            for key in keys:
+                self._index.setdefault(key, {})[connkey] = dev
+            self._query_cache = {}
+
+    def remove(self, dev):
+        with self._lock:
+            self._remove(dev.get_connkey())
+            self._query_cache = {}
+
+    def _lookup(self, key):
+        with self._lock:
+            ret = self._query_cache.get(key)
+            if ret is None:
+                ret = list(self._index.get(key, {}).values())
+                self._query_cache[key] = ret
+            return ret[:]
+
+    def query(self, devtype=None, devcap=None):
+        """
+        Return the list of vmmNodeDevice matching devtype and devcap
+        """
+        if devcap:
+            return self._lookup(("cap", devtype, devcap))
+        if devtype:
+            return self._lookup(("type", devtype))
+        return self._lookup(("all",))
+
+    def count_vendor_product(self, devtype, vendor, product):
+        with self._lock:
+            return len(self._index.get(
+                ("vendorproduct", devtype, vendor, product), {}))
+
+
+class _EventRefreshQueue(object):
+    """
+    Refresh objects that libvirt sent events for, without blocking the
+    main loop on XMLDesc calls and XML parsing.
+
+    Events are queued per object: any event for an object that already
+    has a refresh pending is merged into it, and the fetch waits
+    COALESCE_MS after the first event so a burst of events collapses
+    into one fetch. Fetching happens in a worker thread, and the result
+    is applied to the object from the main loop.
+    """
+    COALESCE_MS = 100
+
+    def __init__(self, conn, objects):
+        self._conn = conn
+        self._objects = objects
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._thread = None
+
+        self.queued = 0
+        self.merged = 0
+
+    def add(self, obj):
+        with self._lock:
+            if obj in self._pending:
+                self.merged += 1
+                return
+            self.queued += 1
+            self._pending[obj] = time.time()
+            self._queue.put(obj)
+
+            if not self._thread:
+                self._thread = threading.Thread(
+                    name="Event refresh %s" % self._conn.get_uri(),
+                    target=self._worker, args=(self._queue,))
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        """
+        Drop anything pending and shut down the worker thread
+        """
+        with self._lock:
+            self._pending = {}
+            if self._thread:
+                self._queue.put(None)
+            self._queue = queue.Queue()
+            self._thread = None
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "merged": self.merged,
+                "pending": len(self._pending),
+            }
+
+    def _worker(self, workqueue):
+        # stop() swaps in a new queue, so use the one we were started for
+        while True:
+            obj = workqueue.get()
+            if obj is None:
+                return
+
+            with self._lock:
+                starttime = self._pending.get(obj)
+            if starttime is None:
+                # Queue was stopped
+                continue
+
+            # Let further events for this object pile up first
+            delay = starttime + (self.COALESCE_MS / 1000.0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Events that arrive from here on need a fresh fetch
+            with self._lock:
+                if self._pending.pop(obj, None) is None:
+                    continue
+
+            state = None
+            error = None
+            try:
+                state = obj.fetch_event_state()
+            except Exception as e:
+                error = e
+            vmmGObject.idle_add(self._apply, obj, state, error, starttime)
+
+    def _apply(self, obj, state, error, starttime):
+        conn = self._conn
+        if (conn.is_disconnected() or
+            self._objects.lookup_object(obj.__class__,
+                                        obj.get_connkey()) is not obj):
+            # Connection closed or object removed while we were fetching
+            return
+
+        if error:
+            obj.event_refresh_failed(error)
+        else:
+            obj.apply_event_state(state)
+        module_trace.record_stats(conn.get_uri(),
+            "event:%s-refresh" % obj.class_name(), starttime)
+
+
 class vmmConnection(vmmGObject):
     __gsignals__ = {
         "vm-added": (GObject.SignalFlags.RUN_FIRST, None, [str]),
@@ -231,9 +443,12 @@ class vmmConnection(vmmGObject):
         self._xml_flags = {}
 
         self._objects = _ObjectList()
+        self._nodedev_index = _NodeDevIndex()
+        self._event_refresh = _EventRefreshQueue(self, self._objects)
 
         self._stats = []
         self._hostinfo = None
+        self._node_stats_failed = set()
 
         self.add_gsettings_handle(
             self._on_config_pretty_name_changed(
@@ -655,46 +870,16 @@ class vmmConnection(vmmGObject):
     ############################
 
     def filter_nodedevs(self, devtype=None, devcap=None):
-        retdevs = []
-        for dev in self.list_nodedevs():
-            try:
-                xmlobj = dev.get_xmlobj()
-            except libvirt.libvirtError as e:
-                # Libvirt nodedev XML fetching can be busted
-                # https://bugzilla.redhat.com/show_bug.cgi?id=1225771
-                if e.get_error_code() != libvirt.VIR_ERR_NO_NODE_DEVICE:
-                    logging.debug("Error fetching nodedev XML", exc_info=True)
-                continue
-
-            if devtype and xmlobj.device_type != devtype:
-                continue
-
-            if devcap:
-                if (not hasattr(xmlobj, "capability_type") or
-                    xmlobj.capability_type != devcap):
-                    continue
-
-            if (devtype == "usb_device" and
-                (("Linux Foundation" in str(xmlobj.vendor_name) or
-                 ("Linux" in str(xmlobj.vendor_name) and
-                  xmlobj.vendor_id == "0x1d6b")) and
-                 ("root hub" in str(xmlobj.product_name) or
-                  ("host controller" in str(xmlobj.product_name).lower() and
-                   str(xmlobj.product_id).startswith("0x000"))))):
-                continue
-
-            retdevs.append(dev)
-
-        return retdevs
+        """
+        Return the list of vmmNodeDevice matching devtype and devcap.
+        Results come from an index that's updated by nodedev
+        add/remove/update handling, so no XML is fetched here.
+        """
+        return self._nodedev_index.query(devtype, devcap)
 
     def get_nodedev_count(self, devtype, vendor, product):
-        count = 0
-        devs = self.filter_nodedevs(devtype)
-
-        for dev in devs:
-            if (vendor == dev.xmlobj.vendor_id and
-                product == dev.xmlobj.product_id):
-                count += 1
+        count = self._nodedev_index.count_vendor_product(
+            devtype, vendor, product)
 
         logging.debug("There are %d node devices with "
                       "vendorId: %s, productId: %s",
@@ -702,6 +887,9 @@ class vmmConnection(vmmGObject):
 
         return count
 
+    def _nodedev_changed_cb(self, dev):
+        self._nodedev_index.update(dev)
+
 
     ###################################
     # Libvirt object creation methods #
@@ -777,7 +965,7 @@ class vmmConnection(vmmGObject):
         if not obj:
             return
 
-        self.idle_add(obj.recache_from_event_loop)
+        self._event_refresh.add(obj)
 
     def _domain_lifecycle_event(self, conn, domain, event, reason, userdata):
         ignore = conn
@@ -789,7 +977,7 @@ class vmmConnection(vmmGObject):
         obj = self.get_vm(name)
 
         if obj:
-            self.idle_add(obj.recache_from_event_loop)
+            self._event_refresh.add(obj)
         else:
             self.schedule_priority_tick(pollvm=True, force=True)
 
@@ -803,7 +991,7 @@ class vmmConnection(vmmGObject):
         obj = self.get_net(name)
 
         if obj:
-            self.idle_add(obj.recache_from_event_loop)
+            self._event_refresh.add(obj)
         else:
             self.schedule_priority_tick(pollnet=True, force=True)
 
@@ -815,11 +1003,12 @@ class vmmConnection(vmmGObject):
         name = pool.name()
         logging.debug("storage pool lifecycle event: storage=%s event=%s "
             "reason=%s", name, event, reason)
+        self._backend.get_storage_path_resolver().invalidate()
 
         obj = self.get_pool(name)
 
         if obj:
-            self.idle_add(obj.recache_from_event_loop)
+            self._event_refresh.add(obj)
         else:
             self.schedule_priority_tick(pollpool=True, force=True)
 
@@ -829,6 +1018,7 @@ class vmmConnection(vmmGObject):
 
         name = pool.name()
         logging.debug("storage pool refresh event: pool=%s", name)
+        self._backend.get_storage_path_resolver().invalidate()
 
         obj = self.get_pool(name)
 
@@ -858,7 +1048,7 @@ class vmmConnection(vmmGObject):
         obj = self.get_nodedev(name)
 
         if obj:
-            self.idle_add(obj.recache_from_event_loop)
+            self._event_refresh.add(obj)
 
     def _add_conn_events(self):
         if not self.check_support(support.SUPPORT_CONN_WORKING_XEN_EVENTS):
@@ -987,14 +1177,21 @@ class vmmConnection(vmmGObject):
             self._storage_pool_cb_ids = []
             self._node_device_cb_ids = []
 
+        self._event_refresh.stop()
+        logging.debug("event refresh stats: %s",
+            self._event_refresh.get_stats())
+
         self._backend.close()
         self._stats = []
+        self._node_stats_failed = set()
 
         if self._init_object_event:
             self._init_object_event.clear()
 
         self._objects.cleanup()
         self._objects = _ObjectList()
+        self._nodedev_index = _NodeDevIndex()
+        self._event_refresh = _EventRefreshQueue(self, self._objects)
 
         self._change_state(self._STATE_DISCONNECTED)
         self._closing = False
@@ -1166,6 +1363,7 @@ class vmmConnection(vmmGObject):
             elif class_name == "interface":
                 self.emit("interface-removed", obj.get_connkey())
             elif class_name == "nodedev":
+                self._nodedev_index.remove(obj)
                 self.emit("nodedev-removed", obj.get_connkey())
             obj.cleanup()
 
@@ -1205,6 +1403,8 @@ class vmmConnection(vmmGObject):
             elif class_name == "interface":
                 self.emit("interface-added", obj.get_connkey())
             elif class_name == "nodedev":
+                self._nodedev_index.update(obj)
+                obj.connect("state-changed", self._nodedev_changed_cb)
                 self.emit("nodedev-added", obj.get_connkey())
         finally:
             if self._init_object_event and not skip_init:
@@ -1223,6 +1423,8 @@ class vmmConnection(vmmGObject):
         keymap = dict((o.get_connkey(), o) for o in self.list_pools())
         if not dopoll or not self.is_storage_capable():
             return [], [], list(keymap.values())
+        # Without pool events this is our only hint that storage changed
+        self._backend.get_storage_path_resolver().invalidate()
         return pollhelpers.fetch_pools(self._backend, keymap,
                     (lambda obj, key: vmmStoragePool(self, obj, key)))
 
@@ -1328,14 +1530,18 @@ class vmmConnection(vmmGObject):
         if self.using_node_device_events and not force:
             pollnodedev = False
 
+        uri = self.get_uri()
+        tickstart = time.time()
         self._hostinfo = self._backend.getInfo()
 
         gone_objects, preexisting_objects = self._poll(
             initial_poll, pollvm, pollnet, pollpool, polliface, pollnodedev)
         self.idle_add(self._gone_object_signals, gone_objects)
+        module_trace.record_stats(uri, "tick:poll", tickstart)
 
         # Only tick() pre-existing objects, since new objects will be
         # initialized asynchronously and tick() would be redundant
+        objstart = time.time()
         for obj in preexisting_objects:
             try:
                 if obj.reports_stats() and stats_update:
@@ -1351,7 +1557,10 @@ class vmmConnection(vmmGObject):
                 elif obj.__class__ is vmmNodeDevice and not pollnodedev:
                     continue
 
+                start = time.time()
                 obj.tick(stats_update=stats_update)
+                module_trace.record_stats(uri,
+                    "tick:%s" % obj.__class__.__name__, start)
             except Exception as e:
                 logging.exception("Tick for %s failed", obj)
                 if (isinstance(e, libvirt.libvirtError) and
@@ -1362,11 +1571,74 @@ class vmmConnection(vmmGObject):
                     logging.debug("vm tick raised system error but "
                                   "connection doesn't seem to have dropped. "
                                   "Ignoring.")
+        module_trace.record_stats(uri, "tick:objects", objstart)
 
         if stats_update:
+            start = time.time()
             self._recalculate_stats(
                 [o for o in preexisting_objects if o.reports_stats()])
             self.idle_emit("resources-sampled")
+            module_trace.record_stats(uri, "tick:stats", start)
+
+        module_trace.record_stats(uri, "tick:total", tickstart)
+
+    def _node_stats_supported(self, feature):
+        if feature in self._node_stats_failed:
+            return False
+        return self.check_support(feature)
+
+    def _node_stats_failed_cb(self, feature, e):
+        logging.debug("Node stats call failed, falling back to summing "
+                      "guest stats: %s", e)
+        self._node_stats_failed.add(feature)
+
+    def _sample_node_cpu(self):
+        """
+        Return cumulative (busy, total) host CPU time in nanoseconds
+        across all host CPUs, or None if the driver doesn't report it
+        """
+        feature = self._backend.SUPPORT_CONN_NODE_CPU_STATS
+        if not self._node_stats_supported(feature):
+            return None
+
+        try:
+            stats = self._backend.getCPUStats(
+                libvirt.VIR_NODE_CPU_STATS_ALL_CPUS, 0)
+        except libvirt.libvirtError as e:
+            self._node_stats_failed_cb(feature, e)
+            return None
+
+        if "utilization" in stats:
+            # Some drivers only report a utilization percentage
+            return None
+        busy = stats.get("kernel", 0) + stats.get("user", 0)
+        total = busy + stats.get("idle", 0) + stats.get("iowait", 0)
+        if not total:
+            return None
+        return busy, total
+
+    def _sample_node_memory(self):
+        """
+        Return (used, total) host memory in KiB, or None if the driver
+        doesn't report it
+        """
+        feature = self._backend.SUPPORT_CONN_NODE_MEMORY_STATS
+        if not self._node_stats_supported(feature):
+            return None
+
+        try:
+            stats = self._backend.getMemoryStats(
+                libvirt.VIR_NODE_MEMORY_STATS_ALL_CELLS, 0)
+        except libvirt.libvirtError as e:
+            self._node_stats_failed_cb(feature, e)
+            return None
+
+        total = stats.get("total", 0)
+        if not total:
+            return None
+        used = (total - stats.get("free", 0) -
+                stats.get("buffers", 0) - stats.get("cached", 0))
+        return max(0, used), total
 
     def _recalculate_stats(self, vms):
         if not self._backend.is_open():
@@ -1404,13 +1676,29 @@ class vmmConnection(vmmGObject):
         pcentHostCpu = 0
         pcentMem = mem * 100.0 / self.host_memory_size()
 
+        # Prefer host wide numbers from the node APIs, which account for
+        # host overhead and don't depend on every VM being sampled. Only
+        # fall back to summing guest stats if the driver can't tell us.
+        nodecpu = self._sample_node_cpu()
+        nodemem = self._sample_node_memory()
+        if nodemem:
+            mem, memtotal = nodemem
+            pcentMem = mem * 100.0 / memtotal
+
         if len(self._stats) > 0:
-            prevTimestamp = self._stats[0]["timestamp"]
+            prevStats = self._stats[0]
+            prevTimestamp = prevStats["timestamp"]
             host_cpus = self.host_active_processor_count()
 
-            pcentHostCpu = ((cpuTime) * 100.0 /
-                            ((now - prevTimestamp) *
-                             1000.0 * 1000.0 * 1000.0 * host_cpus))
+            if nodecpu and prevStats.get("nodeCpu"):
+                busy = nodecpu[0] - prevStats["nodeCpu"][0]
+                total = nodecpu[1] - prevStats["nodeCpu"][1]
+                if total > 0:
+                    pcentHostCpu = busy * 100.0 / total
+            else:
+                pcentHostCpu = ((cpuTime) * 100.0 /
+                                ((now - prevTimestamp) *
+                                 1000.0 * 1000.0 * 1000.0 * host_cpus))
 
         pcentHostCpu = max(0.0, min(100.0, pcentHostCpu))
         pcentMem = max(0.0, min(100.0, pcentMem))
@@ -1421,6 +1709,7 @@ class vmmConnection(vmmGObject):
             "memoryPercent": pcentMem,
             "cpuTime": cpuTime,
             "cpuHostPercent": pcentHostCpu,
+            "nodeCpu": nodecpu,
             "diskRdRate": rdRate,
             "diskWrRate": wrRate,
             "netRxRate": rxRate,
@@ -56,8 +56,10 @@ from .graphwidgets import Sparkline
  EDIT_MAXVCPUS,
  EDIT_CPU,
  EDIT_TOPOLOGY,
+ EDIT_IOTHREADS,
 
  EDIT_MEM,
+ EDIT_HUGEPAGES,
 
  EDIT_AUTOSTART,
  EDIT_BOOTORDER,
@@ -74,6 +76,7 @@ from .graphwidgets import Sparkline
  EDIT_DISK_SERIAL,
  EDIT_DISK_FORMAT,
  EDIT_DISK_SGIO,
+ EDIT_DISK_IOTHREAD,
 
  EDIT_SOUND_MODEL,
 
@@ -106,7 +109,7 @@ from .graphwidgets import Sparkline
 
  EDIT_FS,
 
- EDIT_HOSTDEV_ROMBAR) = range(1, 49)
+ EDIT_HOSTDEV_ROMBAR) = range(1, 52)
 
 
 # Columns in hw list model
@@ -511,9 +514,12 @@ class vmmDetails(vmmGObjectUI):
             "on_cpu_sockets_changed": self.config_cpu_topology_changed,
             "on_cpu_threads_changed": self.config_cpu_topology_changed,
             "on_cpu_topology_enable_toggled": self.config_cpu_topology_enable,
+            "on_cpu_iothreads_changed": lambda *x: self.enable_apply(x, EDIT_IOTHREADS),
+            "on_cpu_iothreads_assign_toggled": lambda *x: self.enable_apply(x, EDIT_IOTHREADS),
 
             "on_mem_memory_changed": self.config_memory_changed,
             "on_mem_maxmem_changed": self.config_maxmem_changed,
+            "on_mem_hugepages_toggled": lambda *x: self.enable_apply(x, EDIT_HUGEPAGES),
 
 
             "on_boot_list_changed": self.config_bootdev_selected,
@@ -538,6 +544,7 @@ class vmmDetails(vmmGObjectUI):
             "on_disk_removable_changed": lambda *x: self.enable_apply(x, EDIT_DISK_REMOVABLE),
             "on_disk_cache_combo_changed": lambda *x: self.enable_apply(x, EDIT_DISK_CACHE),
             "on_disk_io_combo_changed": lambda *x: self.enable_apply(x, EDIT_DISK_IO),
+            "on_disk_iothread_changed": lambda *x: self.enable_apply(x, EDIT_DISK_IOTHREAD),
             "on_disk_bus_combo_changed": lambda *x: self.enable_apply(x, EDIT_DISK_BUS),
             "on_disk_format_changed": self.disk_format_changed,
             "on_disk_serial_changed": lambda *x: self.enable_apply(x, EDIT_DISK_SERIAL),
@@ -2012,6 +2019,12 @@ class vmmDetails(vmmGObjectUI):
                 kwargs["cores"] = None
                 kwargs["threads"] = None
 
+        if self.edited(EDIT_IOTHREADS):
+            kwargs["iothreads"] = uiutil.spin_get_helper(
+                self.widget("cpu-iothreads"))
+            kwargs["assign_iothreads"] = (
+                self.widget("cpu-iothreads-assign").get_active())
+
         return vmmAddHardware.change_config_helper(self.vm.define_cpu,
                                           kwargs, self.vm, self.err,
                                           hotplug_args=hotplug_args)
@@ -2036,6 +2049,9 @@ class vmmDetails(vmmGObjectUI):
             hotplug_args["memory"] = kwargs["memory"]
             hotplug_args["maxmem"] = kwargs["maxmem"]
 
+        if self.edited(EDIT_HUGEPAGES):
+            kwargs["hugepages"] = self.widget("mem-hugepages").get_active()
+
         return vmmAddHardware.change_config_helper(self.vm.define_memory,
                                           kwargs, self.vm, self.err,
                                           hotplug_args=hotplug_args)
@@ -2106,6 +2122,18 @@ class vmmDetails(vmmGObjectUI):
         if self.edited(EDIT_DISK_IO):
             kwargs["io"] = uiutil.get_list_selection(self.widget("disk-io"))
 
+        if self.edited(EDIT_DISK_IOTHREAD):
+            iothread = uiutil.spin_get_helper(self.widget("disk-iothread"))
+            # <iothreadids> can leave gaps in the spin button range
+            iothread_ids = self.vm.get_xmlobj().get_iothread_ids()
+            if iothread and iothread not in iothread_ids:
+                return self.err.val_err(
+                    _("IOThread %(id)d isn't defined. The VM has "
+                      "IOThreads: %(ids)s") %
+                    {"id": iothread,
+                     "ids": ", ".join([str(i) for i in iothread_ids])})
+            kwargs["iothread"] = iothread
+
         if self.edited(EDIT_DISK_FORMAT):
             kwargs["driver_type"] = self.widget("disk-format").get_text()
 
@@ -2554,6 +2582,8 @@ class vmmDetails(vmmGObjectUI):
         self.widget("cpu-vcpus").set_value(int(curvcpus))
         self.widget("cpu-maxvcpus").set_value(int(maxvcpus))
         self.widget("state-host-cpus").set_text(str(host_active_count))
+        self.widget("cpu-iothreads").set_value(self.vm.iothread_count())
+        self.widget("cpu-iothreads-assign").set_active(False)
 
         # Trigger this again to make sure maxvcpus is correct
         self.config_cpu_topology_changed()
@@ -2601,6 +2631,8 @@ class vmmDetails(vmmGObjectUI):
             ignore, upper = maxmem.get_range()
             maxmem.set_range(curmem.get_value(), upper)
 
+        self.widget("mem-hugepages").set_active(self.vm.has_hugepages())
+
     @staticmethod
     def build_disk_sgio(vm, combo):
         ignore = vm
@@ -2667,6 +2699,14 @@ class vmmDetails(vmmGObjectUI):
         uiutil.set_list_selection(self.widget("disk-cache"), cache)
         uiutil.set_list_selection(self.widget("disk-io"), io)
 
+        # Only virtio-blk disks take an iothread directly, virtio-scsi
+        # disks get one from their controller
+        iothread_ids = self.vm.get_xmlobj().get_iothread_ids()
+        uiutil.set_grid_row_visible(self.widget("disk-iothread"),
+                                    bus == "virtio" and bool(iothread_ids))
+        self.widget("disk-iothread").set_range(0, max(iothread_ids or [0]))
+        self.widget("disk-iothread").set_value(disk.driver_iothread or 0)
+
         self.widget("disk-format").set_text(driver_type)
         self.widget("disk-format-warn").hide()
 
@@ -2701,6 +2741,14 @@ class vmmDetails(vmmGObjectUI):
         else:
             self.widget("network-mac-entry").set_text(macaddr)
 
+        driver = []
+        if net.driver_name:
+            driver.append(net.driver_name)
+        if net.driver_queues:
+            driver.append(_("%d queues") % net.driver_queues)
+        self.widget("network-driver").set_text(
+            ", ".join(driver) or _("Hypervisor default"))
+
         self.netlist.set_dev(net)
 
     def refresh_input_page(self):
@@ -18,13 +18,17 @@
 # MA 02110-1301 USA.
 #
 
+import glob
+import io
 import logging
 import os
+import queue
 import time
 import threading
 
 import libvirt
 
+from gi.repository import GdkPixbuf
 from gi.repository import GObject
 
 from virtinst import DomainCapabilities
@@ -148,6 +152,67 @@ def start_job_progress_thread(vm, meter, progtext):
         t.start()
 
 
+# Seconds to hold off retrying after a failed thumbnail screenshot,
+# doubled for every further failure up to the max
+_SCREENSHOT_BACKOFF = 60
+_SCREENSHOT_BACKOFF_MAX = 60 * 60
+
+
+class _ScreenshotQueue(object):
+    """
+    Take thumbnail screenshots one at a time from a single worker
+    thread shared by every VM, so a long VM list doesn't fire off
+    a screenshot RPC for each running VM at once
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def add(self, func, *args):
+        with self._lock:
+            self._queue.put((func, args))
+            if not self._thread:
+                self._thread = threading.Thread(name="Screenshots",
+                                                target=self._worker)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except Exception:
+                logging.debug("Error running screenshot job", exc_info=True)
+
+
+_screenshot_queue = _ScreenshotQueue()
+
+
+def _scale_screenshot(mime, sdata, maxsize):
+    """
+    Decode raw screenshot data into a pixbuf that fits in a maxsize
+    square. This doesn't touch any widgets, so it's safe to call from
+    a worker thread
+    """
+    loader = GdkPixbuf.PixbufLoader.new_with_mime_type(mime)
+
+    def _size_prepared_cb(_loader, width, height):
+        # Have the loader scale while decoding, so a large console
+        # never sits in memory at full size next to the thumbnail
+        if max(width, height) <= maxsize:
+            return
+        factor = float(maxsize) / float(max(width, height))
+        _loader.set_size(max(1, int(width * factor)),
+                         max(1, int(height * factor)))
+
+    loader.connect("size-prepared", _size_prepared_cb)
+    loader.write(sdata)
+    loader.close()
+    return loader.get_pixbuf()
+
+
 class vmmInspectionData(object):
     def __init__(self):
         self.os_type = None
@@ -164,7 +229,9 @@ class vmmInspectionData(object):
 
 class vmmDomainSnapshot(vmmLibvirtObject):
     """
-    Class wrapping a virDomainSnapshot object
+    Class wrapping a virDomainSnapshot object. The snapshot XML isn't
+    fetched until something asks for it, so building the list of
+    snapshots for a VM only costs the single listAllSnapshots call.
     """
     def __init__(self, conn, backend):
         vmmLibvirtObject.__init__(self, conn, backend, backend.getName(),
@@ -344,6 +411,13 @@ class vmmDomain(vmmLibvirtObject):
 
         self.inspection = vmmInspectionData()
 
+        # maxsize -> (pixbuf, timestamp) of the latest screenshot thumbnail
+        self._thumbnails = {}
+        # maxsize -> callbacks waiting on an in progress screenshot
+        self._thumbnail_callbacks = {}
+        # maxsize -> number of screenshot failures in a row
+        self._thumbnail_failures = {}
+
     def _cleanup(self):
         for snap in self._snapshot_list or []:
             snap.cleanup()
@@ -648,7 +722,8 @@ class vmmDomain(vmmLibvirtObject):
 
     def define_cpu(self, vcpus=_SENTINEL, maxvcpus=_SENTINEL,
             model=_SENTINEL, sockets=_SENTINEL,
-            cores=_SENTINEL, threads=_SENTINEL):
+            cores=_SENTINEL, threads=_SENTINEL,
+            iothreads=_SENTINEL, assign_iothreads=_SENTINEL):
         guest = self._make_xmlobj_to_define()
 
         if vcpus != _SENTINEL:
@@ -666,15 +741,50 @@ class vmmDomain(vmmLibvirtObject):
                 guest.cpu.set_special_mode(model)
             else:
                 guest.cpu.model = model
+
+        if iothreads != _SENTINEL:
+            self._set_iothreads(guest, int(iothreads))
+        if assign_iothreads != _SENTINEL and assign_iothreads:
+            guest.assign_disk_iothreads()
         self._redefine_xmlobj(guest)
 
-    def define_memory(self, memory=_SENTINEL, maxmem=_SENTINEL):
+    def _set_iothreads(self, guest, iothreads):
+        if iothreads == len(guest.get_iothread_ids()):
+            return
+
+        # Changing the count drops any explicit IDs, and any references
+        # to iothreads that no longer exist
+        for iothreadid in guest.iothreadids[:]:
+            guest.remove_child(iothreadid)
+        guest.iothreads = iothreads or None
+
+        valid_ids = guest.get_iothread_ids()
+        for dev in (guest.get_devices("disk") +
+                    guest.get_devices("controller")):
+            if dev.driver_iothread not in valid_ids:
+                dev.driver_iothread = None
+        for pin in guest.cputune.iothreadpins[:]:
+            if pin.iothread not in valid_ids:
+                guest.cputune.remove_child(pin)
+
+    def define_memory(self, memory=_SENTINEL, maxmem=_SENTINEL,
+            hugepages=_SENTINEL):
         guest = self._make_xmlobj_to_define()
 
         if memory != _SENTINEL:
             guest.memory = int(memory)
         if maxmem != _SENTINEL:
             guest.maxmemory = int(maxmem)
+        if hugepages != _SENTINEL:
+            if not hugepages:
+                guest.memoryBacking.page_size = None
+                guest.memoryBacking.page_unit = None
+            guest.memoryBacking.hugepages = bool(hugepages) or None
+
+        if guest.memoryBacking.hugepages and not self.is_active():
+            # A running VM already holds its huge pages, so only check
+            # against the host's free pages when the VM is off
+            guest.check_hugepages()
         self._redefine_xmlobj(guest)
 
     def define_overview(self, machine=_SENTINEL, description=_SENTINEL,
@@ -782,7 +892,7 @@ class vmmDomain(vmmLibvirtObject):
             path=_SENTINEL, readonly=_SENTINEL, serial=_SENTINEL,
             shareable=_SENTINEL, removable=_SENTINEL, cache=_SENTINEL,
             io=_SENTINEL, driver_type=_SENTINEL, bus=_SENTINEL, addrstr=_SENTINEL,
-            sgio=_SENTINEL):
+            sgio=_SENTINEL, iothread=_SENTINEL):
         xmlobj = self._make_xmlobj_to_define()
         editdev = self._lookup_device_to_define(xmlobj, devobj, do_hotplug)
         if not editdev:
@@ -830,6 +940,8 @@ class vmmDomain(vmmLibvirtObject):
             editdev.driver_cache = cache or None
         if io != _SENTINEL:
             editdev.driver_io = io or None
+        if iothread != _SENTINEL:
+            editdev.driver_iothread = iothread or None
         if driver_type != _SENTINEL:
             editdev.driver_type = driver_type or None
         if serial != _SENTINEL:
@@ -1207,19 +1319,62 @@ class vmmDomain(vmmLibvirtObject):
 
         return self._backend.openGraphicsFD(0, flags)
 
+    def take_screenshot(self):
+        """
+        Take a screenshot of the VM console and return (mime, data).
+        This blocks on the libvirt stream, so call it from a thread
+        """
+        stream = None
+        try:
+            stream = self.conn.get_backend().newStream(0)
+            screen = 0
+            flags = 0
+            mime = self._backend.screenshot(stream, screen, flags)
+
+            ret = io.BytesIO()
+            def _write_cb(_stream, data, userdata):
+                ignore = _stream
+                ignore = userdata
+                ret.write(data)
+
+            stream.recvAll(_write_cb, None)
+            return mime, ret.getvalue()
+        finally:
+            try:
+                if stream:
+                    stream.finish()
+            except Exception:
+                pass
+
     def refresh_snapshots(self):
         self._snapshot_list = None
 
     def list_snapshots(self):
+        """
+        Return vmmDomainSnapshot objects for every snapshot. Only the
+        snapshot names are known up front, XML is fetched on first
+        access of each snapshot's xmlobj
+        """
         if self._snapshot_list is None:
             newlist = []
             for rawsnap in self._backend.listAllSnapshots():
-                obj = vmmDomainSnapshot(self.conn, rawsnap)
-                obj.init_libvirt_state()
-                newlist.append(obj)
+                newlist.append(vmmDomainSnapshot(self.conn, rawsnap))
             self._snapshot_list = newlist
         return self._snapshot_list[:]
 
+    def get_current_snapshot_name(self):
+        """
+        Return the name of the current snapshot, or None. This is a
+        single lookup, rather than calling is_current on every snapshot
+        """
+        try:
+            if not self._backend.hasCurrentSnapshot(0):
+                return None
+            return self._backend.snapshotCurrent(0).getName()
+        except libvirt.libvirtError as e:
+            logging.debug("Error looking up current snapshot: %s", e)
+            return None
+
     @vmmLibvirtObject.lifecycle_action
     def revert_to_snapshot(self, snap):
         self._backend.revertToSnapshot(snap.get_backend())
@@ -1291,6 +1446,11 @@ class vmmDomain(vmmLibvirtObject):
         return int(self.get_xmlobj().curvcpus or self.get_xmlobj().vcpus)
     def vcpu_max_count(self):
         return int(self.get_xmlobj().vcpus)
+    def has_hugepages(self):
+        return bool(self.get_xmlobj().memoryBacking.hugepages)
+
+    def iothread_count(self):
+        return len(self.get_xmlobj().get_iothread_ids())
 
     def get_cpu_config(self):
         return self.get_xmlobj().cpu
@@ -1850,6 +2010,111 @@ class vmmDomain(vmmLibvirtObject):
         return ret
 
 
+    #########################
+    # Screenshot thumbnails #
+    #########################
+
+    def can_screenshot(self):
+        return bool(self.is_active() and self.get_graphics_devices())
+
+    def _thumbnail_prefix(self, cachedir, maxsize):
+        return os.path.join(cachedir, "screenshot-thumb-%d-" % maxsize)
+
+    def _read_cached_thumbnail(self, maxsize):
+        prefix = self._thumbnail_prefix(self.get_cache_dir(), maxsize)
+        for filename in sorted(glob.glob(prefix + "*.png"), reverse=True):
+            try:
+                timestamp = int(filename[len(prefix):-len(".png")])
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+                return pixbuf, timestamp
+            except Exception as e:
+                logging.debug("Error reading cached thumbnail %s: %s",
+                              filename, e)
+        return None, 0
+
+    def get_screenshot_thumbnail(self, maxsize):
+        """
+        Return (pixbuf, timestamp) for the latest screenshot thumbnail
+        scaled to fit maxsize, or (None, 0) if we don't have one. The
+        timestamp is when the thumbnail was last refreshed or attempted,
+        so callers can rate limit take_screenshot_async. After failed
+        attempts it is pushed into the future, to back off. Thumbnails
+        from previous runs are loaded from the VM cache dir.
+        """
+        if maxsize not in self._thumbnails:
+            self._thumbnails[maxsize] = self._read_cached_thumbnail(maxsize)
+        return self._thumbnails[maxsize]
+
+    def take_screenshot_async(self, maxsize, callback):
+        """
+        Take a fresh screenshot from a worker thread, scale it down to
+        fit maxsize, and cache the result. When done, the main loop
+        calls callback(vm, pixbuf, mime, sdata) with the thumbnail and
+        the full size screenshot data, or pixbuf=None on error.
+        Concurrent requests for the same size share one screenshot.
+        """
+        callbacks = self._thumbnail_callbacks.get(maxsize)
+        if callbacks is not None:
+            if callback not in callbacks:
+                callbacks.append(callback)
+            return
+        self._thumbnail_callbacks[maxsize] = [callback]
+
+        _screenshot_queue.add(self._screenshot_thread,
+                              maxsize, self.get_cache_dir())
+
+    def _screenshot_thread(self, maxsize, cachedir):
+        now = int(time.time())
+        pixbuf = None
+        mime = None
+        sdata = None
+
+        try:
+            # Perform two screenshots, because qemu + qxl has a bug where
+            # screenshot generally only shows the data from the previous
+            # screenshot request:
+            # https://bugs.launchpad.net/qemu/+bug/1314293
+            self.take_screenshot()
+            mime, sdata = self.take_screenshot()
+            pixbuf = _scale_screenshot(mime, sdata, maxsize)
+        except Exception as e:
+            logging.debug("Error taking screenshot of %s: %s",
+                          self.get_name(), e)
+
+        if pixbuf:
+            prefix = self._thumbnail_prefix(cachedir, maxsize)
+            filename = prefix + "%d.png" % now
+            try:
+                oldfiles = glob.glob(prefix + "*.png")
+                pixbuf.savev(filename, "png", [], [])
+                for oldfile in oldfiles:
+                    if oldfile != filename:
+                        os.unlink(oldfile)
+            except Exception as e:
+                logging.debug("Error caching thumbnail %s: %s", filename, e)
+
+        self.idle_add(self._screenshot_finished,
+                      maxsize, now, pixbuf, mime, sdata)
+
+    def _screenshot_finished(self, maxsize, now, pixbuf, mime, sdata):
+        oldpixbuf = self.get_screenshot_thumbnail(maxsize)[0]
+        timestamp = now
+        if pixbuf:
+            self._thumbnail_failures.pop(maxsize, None)
+        else:
+            failures = self._thumbnail_failures.get(maxsize, 0) + 1
+            self._thumbnail_failures[maxsize] = failures
+            timestamp += min(_SCREENSHOT_BACKOFF * 2 ** (failures - 1),
+                             _SCREENSHOT_BACKOFF_MAX)
+        self._thumbnails[maxsize] = (pixbuf or oldpixbuf, timestamp)
+
+        for cb in self._thumbnail_callbacks.pop(maxsize, []):
+            try:
+                cb(self, pixbuf, mime, sdata)
+            except Exception:
+                logging.exception("Error in screenshot callback")
+
+
     ###################
     # Polling helpers #
     ###################
@@ -29,6 +29,7 @@ from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 
+from . import module_trace
 from . import packageutils
 from .about import vmmAbout
 from .baseclass import vmmGObject
@@ -492,6 +493,8 @@ class vmmEngine(vmmGObject):
             for name in objs:
                 logging.debug("Leaked %s", name)
 
+        logging.debug("idle_emit stats: %s", vmmGObject.get_idle_emit_stats())
+        module_trace.dump_stats()
         logging.debug("Exiting app normally.")
         self._application.quit()
 
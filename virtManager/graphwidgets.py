@@ -16,6 +16,8 @@
 # MA 02110-1301 USA.
 #
 
+import cairo
+
 from gi.repository import GObject
 from gi.repository import Gtk
 
@@ -98,6 +100,57 @@ def draw_fill(cairo_ct, x, y, w, h, points, taper=False):
     cairo_ct.fill()
 
 
+# Indent of the gray border around the graph
+_BORDER_PADDING = 2
+# Indent of graph from border
+_GRAPH_INDENT = 2
+_GRAPH_PAD = (_BORDER_PADDING + _GRAPH_INDENT)
+
+
+class _SparklineGeometry(object):
+    """
+    Helper that calculates the CellRendererSparkline layout for a cell
+    of the passed size, relative to x, y
+    """
+    def __init__(self, x, y, width, height, npoints, xalign):
+        # Set up graphing bounds
+        self.graph_x = (x + _GRAPH_PAD)
+        self.graph_y = (y + _GRAPH_PAD)
+        self.graph_height = (height - (_GRAPH_PAD * 2))
+
+        graph_width = (width - (_GRAPH_PAD * 2))
+        self.pixels_per_point = (graph_width // max(1, npoints - 1))
+
+        # Graph width needs to be some multiple of the amount of data points
+        # we have
+        self.graph_width = (self.pixels_per_point * max(1, npoints - 1))
+
+        # Recalculate border width based on the amount we are graphing
+        self.border_width = self.graph_width + (_GRAPH_INDENT * 2)
+
+        # Align the widget
+        self.border_x = x + _BORDER_PADDING
+        self.border_y = y + _BORDER_PADDING
+        self.border_height = height - (_BORDER_PADDING * 2)
+
+        empty_space = width - self.border_width - (_BORDER_PADDING * 2)
+        if empty_space:
+            xalign_space = int(empty_space * xalign)
+            self.border_x += xalign_space
+            self.graph_x += xalign_space
+
+
+class _SparklineSurface(object):
+    """
+    Rendered image of a single CellRendererSparkline row
+    """
+    def __init__(self, surface, width, height, data_array):
+        self.surface = surface
+        self.width = width
+        self.height = height
+        self.data_array = data_array
+
+
 class CellRendererSparkline(Gtk.CellRenderer):
     __gproperties__ = {
         # 'name': (GObject.TYPE_*,
@@ -110,6 +163,10 @@ class CellRendererSparkline(Gtk.CellRenderer):
         'reversed': (GObject.TYPE_BOOLEAN, "Reverse data",
                      "Process data from back to front.",
                      0, GObject.PARAM_READWRITE),
+        'cache_key': (GObject.TYPE_PYOBJECT, "Cache key",
+                      "Key identifying the row, used to cache the "
+                      "rendered graph between draws",
+                      GObject.PARAM_READWRITE),
     }
 
     def __init__(self):
@@ -121,113 +178,191 @@ class CellRendererSparkline(Gtk.CellRenderer):
         self.reversed = False
         self.rgb = None
 
-    def do_render(self, cr, widget, background_area, cell_area,
-                  flags):
-        # cr                : Cairo context
-        # widget            : GtkWidget instance
-        # background_area   : GdkRectangle: entire cell area
-        # cell_area         : GdkRectangle: area normally rendered by cell
-        # flags             : flags that affect rendering
-        # flags = Gtk.CELL_RENDERER_SELECTED, Gtk.CELL_RENDERER_PRELIT,
-        #         Gtk.CELL_RENDERER_INSENSITIVE or Gtk.CELL_RENDERER_SORTED
-        ignore = widget
-        ignore = background_area
-        ignore = flags
+        # cache_key -> _SparklineSurface. If the cell data func sets
+        # a cache_key, each row graph is only drawn when its data
+        # changes, and exposes just blit the cached image.
+        self.cache_key = None
+        self._surfaces = {}
 
-        # Indent of the gray border around the graph
-        BORDER_PADDING = 2
-        # Indent of graph from border
-        GRAPH_INDENT = 2
-        GRAPH_PAD = (BORDER_PADDING + GRAPH_INDENT)
+    def forget_cache_key(self, key):
+        """
+        Drop any cached image for the row identified by key
+        """
+        self._surfaces.pop(key, None)
 
-        # We don't use yalign, since we expand to the entire height
-        ignore = self.get_property("yalign")
-        xalign = self.get_property("xalign")
+    def clear_cache(self):
+        self._surfaces = {}
 
-        # Set up graphing bounds
-        graph_x      = (cell_area.x + GRAPH_PAD)
-        graph_y      = (cell_area.y + GRAPH_PAD)
-        graph_width  = (cell_area.width - (GRAPH_PAD * 2))
-        graph_height = (cell_area.height - (GRAPH_PAD * 2))
+    def _get_points(self, geom, data_array):
+        def get_y(index):
+            baseline_y = geom.graph_y + geom.graph_height
 
-        pixels_per_point = (graph_width // max(1, len(self.data_array) - 1))
+            if self.reversed:
+                n = (len(data_array) - index - 1)
+            else:
+                n = index
 
-        # Graph width needs to be some multiple of the amount of data points
-        # we have
-        graph_width = (pixels_per_point * max(1, len(self.data_array) - 1))
+            val = data_array[n]
+            y = baseline_y - (geom.graph_height * val)
 
-        # Recalculate border width based on the amount we are graphing
-        border_width = graph_width + (GRAPH_INDENT * 2)
+            y = max(geom.graph_y, y)
+            y = min(geom.graph_y + geom.graph_height, y)
+            return y
 
-        # Align the widget
-        empty_space = cell_area.width - border_width - (BORDER_PADDING * 2)
-        if empty_space:
-            xalign_space = int(empty_space * xalign)
-            cell_area.x += xalign_space
-            graph_x += xalign_space
+        points = []
+        for index in range(0, len(data_array)):
+            x = int(((index * geom.pixels_per_point) + geom.graph_x))
+            y = int(get_y(index))
+
+            points.append((x, y))
+        return points
 
+    def _draw_frame(self, cr, geom):
         cr.set_line_width(3)
         # 1 == LINE_CAP_ROUND
         cr.set_line_cap(1)
 
         # Draw gray graph border
         cr.set_source_rgb(0.8828125, 0.8671875, 0.8671875)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
-                     border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+        cr.rectangle(geom.border_x, geom.border_y,
+                     geom.border_width, geom.border_height)
         cr.stroke()
 
         # Fill in white box inside graph outline
         cr.set_source_rgb(1, 1, 1)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
-                     border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+        cr.rectangle(geom.border_x, geom.border_y,
+                     geom.border_width, geom.border_height)
         cr.fill()
 
-        def get_y(index):
-            baseline_y = graph_y + graph_height
-
-            if self.reversed:
-                n = (len(self.data_array) - index - 1)
-            else:
-                n = index
-
-            val = self.data_array[n]
-            y = baseline_y - (graph_height * val)
-
-            y = max(graph_y, y)
-            y = min(graph_y + graph_height, y)
-            return y
-
-        points = []
-        for index in range(0, len(self.data_array)):
-            x = int(((index * pixels_per_point) + graph_x))
-            y = int(get_y(index))
-
-            points.append((x, y))
-
-
-        cell_area.x = graph_x
-        cell_area.y = graph_y
-        cell_area.width = graph_width
-        cell_area.height = graph_height
-
+    def _draw_points(self, cr, geom, points):
         # Set color to dark blue for the actual sparkline
         cr.set_line_width(2)
+        # 1 == LINE_CAP_ROUND
+        cr.set_line_cap(1)
         cr.set_source_rgb(0.421875, 0.640625, 0.73046875)
         draw_line(cr,
-                  cell_area.x, cell_area.y,
-                  cell_area.width, cell_area.height,
+                  geom.graph_x, geom.graph_y,
+                  geom.graph_width, geom.graph_height,
                   points)
 
         # Set color to light blue for the fill
         cr.set_source_rgba(0.71484375, 0.84765625, 0.89453125, .5)
         draw_fill(cr,
-                  cell_area.x, cell_area.y,
-                  cell_area.width, cell_area.height,
+                  geom.graph_x, geom.graph_y,
+                  geom.graph_width, geom.graph_height,
                   points)
+
+    def _draw_graph(self, cr, x, y, width, height, data_array):
+        geom = _SparklineGeometry(x, y, width, height, len(data_array),
+                                  self.get_property("xalign"))
+        self._draw_frame(cr, geom)
+        self._draw_points(cr, geom, self._get_points(geom, data_array))
+
+    def _is_shifted(self, olddata, newdata):
+        """
+        Return True if newdata is olddata plus one new sample, with
+        the oldest sample dropped
+        """
+        if len(olddata) != len(newdata) or len(newdata) < 4:
+            return False
+        if self.reversed:
+            return newdata[1:] == olddata[:-1]
+        return newdata[:-1] == olddata[1:]
+
+    def _shift_surface(self, cached, data_array):
+        """
+        Build a new surface from the cached one by scrolling the
+        previous graph one sample to the left, and only drawing
+        the tail segment for the new sample.
+        """
+        geom = _SparklineGeometry(0, 0, cached.width, cached.height,
+                                  len(data_array),
+                                  self.get_property("xalign"))
+        if geom.pixels_per_point <= 0:
+            return None
+
+        surface = cached.surface.create_similar(cairo.CONTENT_COLOR_ALPHA,
+                                                cached.width, cached.height)
+        cr = cairo.Context(surface)
+        self._draw_frame(cr, geom)
+
+        # Scroll the previous graph contents inside the frame
+        cr.save()
+        cr.rectangle(geom.border_x, geom.border_y,
+                     geom.border_width, geom.border_height)
+        cr.clip()
+        cr.set_source_surface(cached.surface, -geom.pixels_per_point, 0)
+        cr.paint()
+        cr.restore()
+
+        # Clear the region touched by the new sample and redraw the last
+        # few points there. Drawing a couple of points that start outside
+        # the clip region makes the line and fill join up seamlessly.
+        points = self._get_points(geom, data_array)
+        cut_x = points[-2][0] - 2
+        cr.save()
+        cr.rectangle(cut_x, geom.border_y,
+                     geom.border_x + geom.border_width - cut_x,
+                     geom.border_height)
+        cr.clip()
+        cr.set_source_rgb(1, 1, 1)
+        cr.paint()
+        self._draw_points(cr, geom, points[-4:])
+        cr.restore()
+
+        return surface
+
+    def _get_surface(self, cr, width, height):
+        data_array = list(self.data_array)
+        cached = self._surfaces.get(self.cache_key)
+
+        if cached and (cached.width != width or cached.height != height):
+            cached = None
+
+        if cached and cached.data_array == data_array:
+            return cached.surface
+
+        surface = None
+        if cached and self._is_shifted(cached.data_array, data_array):
+            surface = self._shift_surface(cached, data_array)
+
+        if surface is None:
+            surface = cr.get_target().create_similar(
+                cairo.CONTENT_COLOR_ALPHA, width, height)
+            self._draw_graph(cairo.Context(surface),
+                             0, 0, width, height, data_array)
+
+        self._surfaces[self.cache_key] = _SparklineSurface(
+            surface, width, height, data_array)
+        return surface
+
+    def do_render(self, cr, widget, background_area, cell_area,
+                  flags):
+        # cr                : Cairo context
+        # widget            : GtkWidget instance
+        # background_area   : GdkRectangle: entire cell area
+        # cell_area         : GdkRectangle: area normally rendered by cell
+        # flags             : flags that affect rendering
+        # flags = Gtk.CELL_RENDERER_SELECTED, Gtk.CELL_RENDERER_PRELIT,
+        #         Gtk.CELL_RENDERER_INSENSITIVE or Gtk.CELL_RENDERER_SORTED
+        ignore = widget
+        ignore = background_area
+        ignore = flags
+
+        # We don't use yalign, since we expand to the entire height
+        ignore = self.get_property("yalign")
+
+        if self.cache_key is None:
+            self._draw_graph(cr, cell_area.x, cell_area.y,
+                             cell_area.width, cell_area.height,
+                             self.data_array)
+            return
+
+        surface = self._get_surface(cr, cell_area.width, cell_area.height)
+        cr.set_source_surface(surface, cell_area.x, cell_area.y)
+        cr.rectangle(cell_area.x, cell_area.y,
+                     cell_area.width, cell_area.height)
+        cr.fill()
         return
 
     def do_get_size(self, widget, cell_area=None):
@@ -18,6 +18,7 @@
 # MA 02110-1301 USA.
 #
 
+import hashlib
 import logging
 
 from gi.repository import GObject
@@ -25,6 +26,10 @@ from gi.repository import GObject
 from .baseclass import vmmGObject
 
 
+def _xml_digest(xml):
+    return hashlib.sha256(xml.encode("utf-8")).hexdigest()
+
+
 class vmmLibvirtObject(vmmGObject):
     __gsignals__ = {
         "state-changed": (GObject.SignalFlags.RUN_FIRST, None, []),
@@ -48,6 +53,7 @@ class vmmLibvirtObject(vmmGObject):
         self._xmlobj = None
         self._xmlobj_to_define = None
         self._is_xml_valid = False
+        self._xml_digest = None
 
         # These should be set by the child classes if necessary
         self._inactive_xml_flags = 0
@@ -264,29 +270,53 @@ class vmmLibvirtObject(vmmGObject):
     # Public XML API #
     ##################
 
-    def recache_from_event_loop(self):
+    def fetch_event_state(self):
         """
-        Updates the VM status and XML, because we received an event from
-        libvirt's event implementations. That's the only time this should
-        be used.
-
-        We refresh status and XML because they are tied together in subtle
+        Fetch the XML and status needed to handle an event, because we
+        received an event from libvirt's event implementations. We
+        refresh status and XML because they are tied together in subtle
         ways, like runtime XML changing when a VM is started.
+
+        This only talks to libvirt and parses XML without changing any
+        cached object state, so it's safe to call from a thread.
+
+        :returns: opaque state to pass to apply_event_state
         """
-        try:
-            self.__force_refresh_xml(nosignal=True)
-            # status = None forces a signal to be emitted
-            self.__status = None
-            self._refresh_status()
-        except Exception as e:
-            # If we hit an exception here, it's often that the object
-            # disappeared, so request the poll loop to be updated
-            logging.debug("Error refreshing %s from events: %s", self, e)
-            poll_param = self._conn_tick_poll_param()
-            if poll_param:
-                kwargs = {"force": True, poll_param: True}
-                logging.debug("Scheduling priority tick with: %s", kwargs)
-                self.conn.schedule_priority_tick(**kwargs)
+        active_xml = self._XMLDesc(self._active_xml_flags)
+        digest = _xml_digest(active_xml)
+
+        xmlobj = None
+        if self._xmlobj is None or digest != self._xml_digest:
+            xmlobj = self._parseclass(self.conn.get_backend(),
+                parsexml=active_xml)
+        status = self._get_backend_status()
+        return (active_xml, digest, xmlobj, status)
+
+    def apply_event_state(self, state):
+        """
+        Update the cached XML and status with the result of
+        fetch_event_state, signaling state-changed. Must be called from
+        the main loop.
+        """
+        active_xml, digest, xmlobj, status = state
+        self.__set_active_xml(active_xml, digest, xmlobj)
+
+        # status = None forces a signal to be emitted
+        self.__status = None
+        self._refresh_status(newstatus=status)
+
+    def event_refresh_failed(self, error):
+        """
+        Called when fetch_event_state raised an error. That's often
+        because the object disappeared, so request the poll loop to
+        be updated
+        """
+        logging.debug("Error refreshing %s from events: %s", self, error)
+        poll_param = self._conn_tick_poll_param()
+        if poll_param:
+            kwargs = {"force": True, poll_param: True}
+            logging.debug("Scheduling priority tick with: %s", kwargs)
+            self.conn.schedule_priority_tick(**kwargs)
 
     def ensure_latest_xml(self, nosignal=False):
         """
@@ -299,6 +329,19 @@ class vmmLibvirtObject(vmmGObject):
             return
         self.__force_refresh_xml(nosignal=nosignal)
 
+    def poll_xml_changes(self):
+        """
+        Refresh the XML of an object that doesn't have libvirt events
+        telling us when it changes. Only the raw XML is fetched: the
+        xmlobj is rebuilt, and 'state-changed' is signaled, only if the
+        XML differs from what we have cached.
+
+        :returns: True if the XML changed
+        """
+        if self._using_events() and self._xmlobj:
+            return False
+        return self.__force_refresh_xml()
+
     def __force_refresh_xml(self, nosignal=False):
         """
         Force an xml update. Signal 'state-changed' if domain xml has
@@ -306,19 +349,14 @@ class vmmLibvirtObject(vmmGObject):
 
         :param nosignal: If true, don't send state-changed. Used by
             callers that are going to send it anyways.
+        :returns: True if the XML changed
         """
-        origxml = None
-        if self._xmlobj:
-            origxml = self._xmlobj.get_xml_config()
-
-        self._invalidate_xml()
         active_xml = self._XMLDesc(self._active_xml_flags)
-        self._xmlobj = self._parseclass(self.conn.get_backend(),
-            parsexml=active_xml)
-        self._is_xml_valid = True
+        changed = self.__set_active_xml(active_xml, _xml_digest(active_xml))
 
-        if not nosignal and origxml != active_xml:
+        if not nosignal and changed:
             self.idle_emit("state-changed")
+        return changed
 
     def get_xmlobj(self, inactive=False, refresh_if_nec=True):
         """
@@ -357,6 +395,25 @@ class vmmLibvirtObject(vmmGObject):
     # Internal XML routines #
     #########################
 
+    def __set_active_xml(self, active_xml, digest, xmlobj=None):
+        """
+        Cache freshly fetched active XML, only reparsing it if it
+        differs from what we have. xmlobj is active_xml already parsed,
+        if the caller has it.
+
+        :returns: True if the XML changed
+        """
+        self._invalidate_xml()
+        changed = (self._xmlobj is None or digest != self._xml_digest)
+        if changed:
+            if xmlobj is None:
+                xmlobj = self._parseclass(self.conn.get_backend(),
+                    parsexml=active_xml)
+            self._xmlobj = xmlobj
+            self._xml_digest = digest
+        self._is_xml_valid = True
+        return changed
+
     def _invalidate_xml(self):
         """
         Mark cached XML as invalid. Subclasses may extend this
@@ -19,7 +19,9 @@
 #
 
 import logging
+import time
 
+from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -37,6 +39,10 @@ from .graphwidgets import CellRendererSparkline
 # Number of data points for performance graphs
 GRAPH_LEN = 40
 
+# Max width/height of screenshot thumbnails, and how often to refresh them
+SCREENSHOT_SIZE = 64
+SCREENSHOT_REFRESH = 30
+
 # fields in the tree model data set
 (ROW_HANDLE,
 ROW_SORT_KEY,
@@ -56,7 +62,8 @@ COL_GUEST_CPU,
 COL_HOST_CPU,
 COL_MEM,
 COL_DISK,
-COL_NETWORK) = range(6)
+COL_NETWORK,
+COL_SCREENSHOT) = range(7)
 
 
 def _style_get_prop(widget, propname):
@@ -120,6 +127,16 @@ class vmmManager(vmmGObjectUI):
         # allow O(1) access instead of O(n)
         self.rows = {}
 
+        # Cache of vm -> rowkey, so we don't need to query the vm UUID
+        # for every signal
+        self._vm_row_keys = {}
+
+        # rowkey -> (obj, rebuild) of rows waiting for a model update.
+        # All updates queued during one main loop iteration are applied
+        # together by _flush_row_updates
+        self._pending_rows = {}
+        self._pending_rows_id = None
+
         w, h = self.config.get_manager_window_size()
         self.topwin.set_default_size(w or 550, h or 550)
         self.prev_position = None
@@ -140,6 +157,8 @@ class vmmManager(vmmGObjectUI):
             self.toggle_stats_visible_disk,
             "on_menu_view_network_traffic_activate":
             self.toggle_stats_visible_network,
+            "on_menu_view_screenshot_activate":
+            self.toggle_stats_visible_screenshot,
 
             "on_vm_manager_delete_event": self.close,
             "on_vmm_manager_configure_event": self.window_resized,
@@ -172,7 +191,9 @@ class vmmManager(vmmGObjectUI):
         self.memcol = None
         self.guestcpucol = None
         self.hostcpucol = None
+        self.screenshotcol = None
         self.spacer_txt = None
+        self._sparklines = []
         self.init_vmlist()
 
         self.init_stats()
@@ -224,6 +245,11 @@ class vmmManager(vmmGObjectUI):
 
 
     def _cleanup(self):
+        if self._pending_rows_id is not None:
+            GLib.source_remove(self._pending_rows_id)
+            self._pending_rows_id = None
+        self._pending_rows = None
+        self._vm_row_keys = None
         self.rows = None
 
         self.diskcol = None
@@ -231,6 +257,8 @@ class vmmManager(vmmGObjectUI):
         self.memcol = None
         self.hostcpucol = None
         self.netcol = None
+        self.screenshotcol = None
+        self._sparklines = None
 
         self.vmmenu.destroy()
         self.vmmenu = None
@@ -269,6 +297,9 @@ class vmmManager(vmmGObjectUI):
         self.add_gsettings_handle(
             self.config.on_vmlist_network_traffic_visible_changed(
                                 self.toggle_network_traffic_visible_widget))
+        self.add_gsettings_handle(
+            self.config.on_vmlist_screenshot_visible_changed(
+                                self.toggle_screenshot_visible_widget))
 
         # Register callbacks with the global stats enable/disable values
         # that disable the associated vmlist widgets if reporting is disabled
@@ -290,6 +321,7 @@ class vmmManager(vmmGObjectUI):
         self.toggle_memory_usage_visible_widget()
         self.toggle_disk_io_visible_widget()
         self.toggle_network_traffic_visible_widget()
+        self.toggle_screenshot_visible_widget()
 
 
     def init_toolbar(self):
@@ -399,6 +431,7 @@ class vmmManager(vmmGObjectUI):
             img.set_property("reversed", True)
             col.pack_start(img, True)
             col.add_attribute(img, 'visible', ROW_IS_VM)
+            self._sparklines.append(img)
 
             col.set_sort_column_id(colnum)
             vmlist.append_column(col)
@@ -410,6 +443,14 @@ class vmmManager(vmmGObjectUI):
         self.diskcol = make_stats_column(_("Disk I/O"), COL_DISK)
         self.netcol = make_stats_column(_("Network I/O"), COL_NETWORK)
 
+        self.screenshotcol = Gtk.TreeViewColumn(_("Screenshot"))
+        screenshot_img = Gtk.CellRendererPixbuf()
+        screenshot_img.set_property("xpad", 6)
+        screenshot_img.set_property("ypad", 2)
+        self.screenshotcol.pack_start(screenshot_img, True)
+        self.screenshotcol.add_attribute(screenshot_img, 'visible', ROW_IS_VM)
+        vmlist.append_column(self.screenshotcol)
+
         model.set_sort_func(COL_NAME, self.vmlist_name_sorter)
         model.set_sort_func(COL_GUEST_CPU, self.vmlist_guest_cpu_usage_sorter)
         model.set_sort_func(COL_HOST_CPU, self.vmlist_host_cpu_usage_sorter)
@@ -580,7 +621,19 @@ class vmmManager(vmmGObjectUI):
     ####################################
 
     def vm_row_key(self, vm):
-        return vm.get_uuid() + ":" + vm.conn.get_uri()
+        key = self._vm_row_keys.get(vm)
+        if key is None:
+            key = vm.get_uuid() + ":" + vm.conn.get_uri()
+            self._vm_row_keys[vm] = key
+        return key
+
+    def _remove_vm_row(self, vm):
+        row_key = self.vm_row_key(vm)
+        self.rows.pop(row_key, None)
+        self._pending_rows.pop(row_key, None)
+        self._vm_row_keys.pop(vm, None)
+        for img in self._sparklines:
+            img.forget_cache_key(row_key)
 
     def vm_added(self, conn, connkey):
         vm = conn.get_vm(connkey)
@@ -614,7 +667,7 @@ class vmmManager(vmmGObjectUI):
             vm = model[model.iter_nth_child(parent, row)][ROW_HANDLE]
             if vm.get_connkey() == connkey:
                 model.remove(model.iter_nth_child(parent, row))
-                del self.rows[self.vm_row_key(vm)]
+                self._remove_vm_row(vm)
                 break
 
     def _build_conn_hint(self, conn):
@@ -712,33 +765,40 @@ class vmmManager(vmmGObjectUI):
 
         child = model.iter_children(parent)
         while child is not None:
-            del self.rows[self.vm_row_key(model[child][ROW_HANDLE])]
+            self._remove_vm_row(model[child][ROW_HANDLE])
             model.remove(child)
             child = model.iter_children(parent)
         model.remove(parent)
 
         del self.rows[uri]
+        self._pending_rows.pop(uri, None)
 
 
     #############################
     # State/UI updating methods #
     #############################
 
-    def vm_row_updated(self, vm):
-        row = self.rows.get(self.vm_row_key(vm), None)
-        if row is None:
-            return
-        self.widget("vm-list").get_model().row_changed(row.path, row.iter)
+    def _queue_row_update(self, row_key, obj, rebuild=False):
+        """
+        Queue a model update for the row matching row_key. Rows queued
+        within a single main loop iteration are flushed together, so a
+        stats tick over many VMs costs one pass over the model.
 
-    def vm_changed(self, vm):
-        row = self.rows.get(self.vm_row_key(vm), None)
-        if row is None:
+        :param rebuild: If True, regenerate the row text/icon contents
+            from the VM state, not just redraw the row
+        """
+        if row_key not in self.rows:
             return
 
-        try:
-            if vm == self.current_vm():
-                self.update_current_selection()
+        if row_key in self._pending_rows:
+            rebuild = rebuild or self._pending_rows[row_key][1]
+        self._pending_rows[row_key] = (obj, rebuild)
+
+        if self._pending_rows_id is None:
+            self._pending_rows_id = self.idle_add(self._flush_row_updates)
 
+    def _rebuild_vm_row(self, row, vm):
+        try:
             name = vm.get_name_or_title()
             status = vm.run_status()
 
@@ -751,13 +811,64 @@ class vmmManager(vmmGObjectUI):
             row[ROW_HINT] = util.xml_escape(desc)
         except libvirt.libvirtError as e:
             if util.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
-                return
+                return False
             raise
+        return True
 
-        self.vm_row_updated(vm)
+    def _flush_row_updates(self):
+        self._pending_rows_id = None
+        if not self._pending_rows:
+            return False
+
+        pending = self._pending_rows
+        self._pending_rows = {}
+
+        model = self.widget("vm-list").get_model()
+        current_vm = self.current_vm()
+        update_selection = False
+
+        # Rebuilding rows changes the sort key and markup, so detach
+        # sorting while we touch them, otherwise every column change
+        # triggers a resort through our python sort funcs. Reattaching
+        # resorts the model once. Stats only updates never change the
+        # sort order, so plain row_changed is cheaper for those.
+        sort_id, sort_order = model.get_sort_column_id()
+        rebuild_count = len([1 for ignore, rebuild in pending.values()
+                             if rebuild])
+        detach_sort = sort_id is not None and rebuild_count > 1
+        if detach_sort:
+            model.set_sort_column_id(
+                Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, sort_order)
+
+        try:
+            for row_key, (obj, rebuild) in pending.items():
+                row = self.rows.get(row_key, None)
+                if row is None:
+                    continue
+
+                if rebuild:
+                    if not self._rebuild_vm_row(row, obj):
+                        continue
+                    if obj == current_vm:
+                        update_selection = True
+
+                model.row_changed(row.path, row.iter)
+        finally:
+            if detach_sort:
+                model.set_sort_column_id(sort_id, sort_order)
+
+        if update_selection:
+            self.update_current_selection()
+        return False
+
+    def vm_row_updated(self, vm):
+        self._queue_row_update(self._vm_row_keys.get(vm), vm)
+
+    def vm_changed(self, vm):
+        self._queue_row_update(self._vm_row_keys.get(vm), vm, rebuild=True)
 
     def vm_inspection_changed(self, vm):
-        row = self.rows.get(self.vm_row_key(vm), None)
+        row = self.rows.get(self._vm_row_keys.get(vm), None)
         if row is None:
             return
 
@@ -805,7 +916,7 @@ class vmmManager(vmmGObjectUI):
                 child = model.iter_children(parent)
                 while child is not None:
                     vm = model[child][ROW_HANDLE]
-                    del self.rows[self.vm_row_key(vm)]
+                    self._remove_vm_row(vm)
                     model.remove(child)
                     child = model.iter_children(parent)
 
@@ -813,13 +924,11 @@ class vmmManager(vmmGObjectUI):
         self.update_current_selection()
 
     def conn_row_updated(self, conn):
-        row = self.rows[conn.get_uri()]
-
         self.max_disk_rate = max(self.max_disk_rate, conn.disk_io_max_rate())
         self.max_net_rate = max(self.max_net_rate,
                                 conn.network_traffic_max_rate())
 
-        self.widget("vm-list").get_model().row_changed(row.path, row.iter)
+        self._queue_row_update(conn.get_uri(), conn)
 
     def change_run_text(self, can_restore):
         if can_restore:
@@ -982,7 +1091,8 @@ class vmmManager(vmmGObjectUI):
     def _toggle_graph_helper(self, do_show, col, datafunc, menu):
         img = -1
         for child in col.get_cells():
-            if isinstance(child, CellRendererSparkline):
+            if isinstance(child, (CellRendererSparkline,
+                                  Gtk.CellRendererPixbuf)):
                 img = child
         datafunc = do_show and datafunc or None
 
@@ -992,7 +1102,7 @@ class vmmManager(vmmGObjectUI):
 
         any_visible = any([c.get_visible() for c in
             [self.netcol, self.diskcol, self.memcol,
-             self.guestcpucol, self.hostcpucol]])
+             self.guestcpucol, self.hostcpucol, self.screenshotcol]])
         self.spacer_txt.set_property("visible", not any_visible)
 
     def toggle_network_traffic_visible_widget(self):
@@ -1016,6 +1126,11 @@ class vmmManager(vmmGObjectUI):
             self.config.is_vmlist_host_cpu_usage_visible(), self.hostcpucol,
             self.host_cpu_usage_img, "menu_view_stats_host_cpu")
 
+    def toggle_screenshot_visible_widget(self):
+        self._toggle_graph_helper(
+            self.config.is_vmlist_screenshot_visible(), self.screenshotcol,
+            self.screenshot_img, "menu_view_screenshot")
+
     def toggle_stats_visible(self, src, stats_id):
         visible = src.get_active()
         set_stats = {
@@ -1024,6 +1139,7 @@ class vmmManager(vmmGObjectUI):
             COL_MEM: self.config.set_vmlist_memory_usage_visible,
             COL_DISK: self.config.set_vmlist_disk_io_visible,
             COL_NETWORK: self.config.set_vmlist_network_traffic_visible,
+            COL_SCREENSHOT: self.config.set_vmlist_screenshot_visible,
         }
         set_stats[stats_id](visible)
 
@@ -1037,6 +1153,8 @@ class vmmManager(vmmGObjectUI):
         self.toggle_stats_visible(src, COL_DISK)
     def toggle_stats_visible_network(self, src):
         self.toggle_stats_visible(src, COL_NETWORK)
+    def toggle_stats_visible_screenshot(self, src):
+        self.toggle_stats_visible(src, COL_SCREENSHOT)
 
     def guest_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
         obj = model[_iter][ROW_HANDLE]
@@ -1044,6 +1162,7 @@ class vmmManager(vmmGObjectUI):
             return
 
         data = obj.guest_cpu_time_vector(GRAPH_LEN)
+        cell.set_property('cache_key', self._vm_row_keys.get(obj))
         cell.set_property('data_array', data)
 
     def host_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
@@ -1052,6 +1171,7 @@ class vmmManager(vmmGObjectUI):
             return
 
         data = obj.host_cpu_time_vector(GRAPH_LEN)
+        cell.set_property('cache_key', self._vm_row_keys.get(obj))
         cell.set_property('data_array', data)
 
     def memory_usage_img(self, column_ignore, cell, model, _iter, data):
@@ -1060,6 +1180,7 @@ class vmmManager(vmmGObjectUI):
             return
 
         data = obj.stats_memory_vector(GRAPH_LEN)
+        cell.set_property('cache_key', self._vm_row_keys.get(obj))
         cell.set_property('data_array', data)
 
     def disk_io_img(self, column_ignore, cell, model, _iter, data):
@@ -1069,8 +1190,33 @@ class vmmManager(vmmGObjectUI):
 
         d1, d2 = obj.disk_io_vectors(GRAPH_LEN, self.max_disk_rate)
         data = [(x + y) / 2 for x, y in zip(d1, d2)]
+        cell.set_property('cache_key', self._vm_row_keys.get(obj))
         cell.set_property('data_array', data)
 
+    def _screenshot_ready_cb(self, vm, pixbuf, mime, sdata):
+        ignore = pixbuf
+        ignore = mime
+        ignore = sdata
+        row_key = self._vm_row_keys.get(vm)
+        if row_key:
+            self._queue_row_update(row_key, vm)
+
+    def screenshot_img(self, column_ignore, cell, model, _iter, data):
+        obj = model[_iter][ROW_HANDLE]
+        if obj is None or not hasattr(obj, "conn"):
+            return
+
+        # Thumbnails are taken in a worker thread and cached by the VM.
+        # Rendering just kicks off a refresh when the cached one is stale
+        pixbuf, timestamp = obj.get_screenshot_thumbnail(SCREENSHOT_SIZE)
+        if (time.time() - timestamp > SCREENSHOT_REFRESH and
+            obj.can_screenshot()):
+            obj.take_screenshot_async(SCREENSHOT_SIZE,
+                                      self._screenshot_ready_cb)
+        if not obj.is_active():
+            pixbuf = None
+        cell.set_property('pixbuf', pixbuf)
+
     def network_traffic_img(self, column_ignore, cell, model, _iter, data):
         obj = model[_iter][ROW_HANDLE]
         if obj is None or not hasattr(obj, "conn"):
@@ -1078,4 +1224,5 @@ class vmmManager(vmmGObjectUI):
 
         d1, d2 = obj.network_traffic_vectors(GRAPH_LEN, self.max_net_rate)
         data = [(x + y) / 2 for x, y in zip(d1, d2)]
+        cell.set_property('cache_key', self._vm_row_keys.get(obj))
         cell.set_property('data_array', data)
@@ -95,3 +95,230 @@ def wrap_module(module, regex=None):
             wrap_func(module, obj)
         if isinstance(obj, type):
             wrap_class(obj)
+
+
+#################################
+# Aggregated call latency stats #
+#################################
+
+# This is a lower overhead alternative to the per call logging above.
+# Rather than logging every call, we only record call counts and latency
+# histograms per connection URI and API name, which can be dumped on
+# demand. Invoke this with virt-manager --trace-stats
+
+_STATS = None
+_STATS_FORMAT = "table"
+
+
+class _LatencyStats(object):
+    """
+    Call count, total time, and a log2 latency histogram for a single
+    (uri, name) pair. Bucket N holds calls that took < 2^N microseconds
+    """
+    NBUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.NBUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+        usecs = int(duration * 1000 * 1000)
+        idx = min(usecs.bit_length(), self.NBUCKETS - 1)
+        self.buckets[idx] += 1
+
+    def percentile(self, pct):
+        """
+        Return the upper bound in seconds of the histogram bucket
+        holding the requested percentile
+        """
+        if not self.count:
+            return 0.0
+
+        rank = max(1, int(round(self.count * pct / 100.0)))
+        seen = 0
+        for idx, val in enumerate(self.buckets):
+            seen += val
+            if seen >= rank:
+                return min(self.max, (1 << idx) / (1000.0 * 1000.0))
+        return self.max
+
+
+class _TraceStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._start_time = time.time()
+
+    def record(self, uri, name, duration):
+        key = (uri or "-", name)
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = _LatencyStats()
+            self._stats[key].add(duration)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._start_time = time.time()
+
+    def get_report(self):
+        """
+        Return a list of dicts, one per (uri, name), sorted by total time
+        """
+        with self._lock:
+            items = list(self._stats.items())
+
+        ret = []
+        for (uri, name), stats in items:
+            ret.append({
+                "uri": uri,
+                "name": name,
+                "count": stats.count,
+                "total": stats.total,
+                "avg": stats.total / stats.count,
+                "p50": stats.percentile(50),
+                "p90": stats.percentile(90),
+                "p99": stats.percentile(99),
+                "max": stats.max,
+            })
+        ret.sort(key=lambda r: r["total"], reverse=True)
+        return ret
+
+    def format_json(self):
+        import json
+        return json.dumps({
+            "elapsed": time.time() - self._start_time,
+            "stats": self.get_report(),
+        }, indent=2, sort_keys=True)
+
+    def format_table(self):
+        def ms(val):
+            return "%.2f" % (val * 1000)
+
+        rows = [("URI", "NAME", "COUNT", "TOTAL(s)", "AVG(ms)",
+                 "P50(ms)", "P90(ms)", "P99(ms)", "MAX(ms)")]
+        for r in self.get_report():
+            rows.append((r["uri"], r["name"], str(r["count"]),
+                         "%.3f" % r["total"], ms(r["avg"]),
+                         ms(r["p50"]), ms(r["p90"]), ms(r["p99"]),
+                         ms(r["max"])))
+
+        widths = [max(len(row[idx]) for row in rows)
+                  for idx in range(len(rows[0]))]
+        lines = ["Call stats over the last %.1f seconds:" %
+                 (time.time() - self._start_time)]
+        for row in rows:
+            lines.append("  ".join(val.ljust(widths[idx])
+                                   for idx, val in enumerate(row)).rstrip())
+        return "\n".join(lines)
+
+
+def stats_enabled():
+    return _STATS is not None
+
+
+def enable_stats(fmt=None):
+    global _STATS
+    global _STATS_FORMAT
+    if fmt:
+        _STATS_FORMAT = fmt
+    if _STATS is None:
+        _STATS = _TraceStats()
+
+
+def record_stats(uri, name, starttime):
+    """
+    Record a call of 'name' against 'uri' that started at 'starttime',
+    as reported by time.time(). No-op unless stats are enabled, so it
+    is cheap to leave in hot paths like the connection tick.
+    """
+    if _STATS is None:
+        return
+    _STATS.record(uri, name, time.time() - starttime)
+
+
+def dump_stats(fmt=None, reset=False):
+    """
+    Log the collected stats, in either 'table' or 'json' format.
+    Defaults to the format passed to enable_stats
+    """
+    if _STATS is None:
+        return
+    if (fmt or _STATS_FORMAT) == "json":
+        output = _STATS.format_json()
+    else:
+        output = _STATS.format_table()
+    logging.debug("TRACE STATS\n%s", output)
+    if reset:
+        _STATS.reset()
+
+
+def _lookup_conn_uri(obj, is_conn, geturi):
+    conn = obj
+    if not is_conn:
+        conn = getattr(obj, "_conn", None)
+    if conn is None or geturi is None:
+        return None
+
+    uri = getattr(conn, "_trace_stats_uri", None)
+    if uri is None:
+        try:
+            uri = geturi(conn)
+        except Exception:
+            uri = "-"
+        try:
+            conn._trace_stats_uri = uri  # pylint: disable=protected-access
+        except Exception:
+            pass
+    return uri
+
+
+def _generate_stats_wrapper(origfunc, name, is_method, is_conn, geturi):
+    def newfunc(*args, **kwargs):
+        starttime = time.time()
+        try:
+            return origfunc(*args, **kwargs)
+        finally:
+            uri = None
+            if is_method and args:
+                uri = _lookup_conn_uri(args[0], is_conn, geturi)
+            elif args and isinstance(args[0], str):
+                # libvirt.open* style module functions
+                uri = args[0]
+            record_stats(uri, name, starttime)
+
+    return newfunc
+
+
+def wrap_module_stats(module, connclass, fmt=None):
+    """
+    Wrap every public class method and function of module to record
+    call stats via record_stats. connclass is the module's connection
+    class, used to attribute calls to a connection URI.
+    """
+    enable_stats(fmt)
+    geturi = connclass.__dict__.get("getURI")
+
+    for name in dir(module):
+        obj = getattr(module, name)
+        if isinstance(obj, FunctionType) and not name.startswith("_"):
+            setattr(module, name,
+                    _generate_stats_wrapper(obj, name, False, False, None))
+            continue
+        if not isinstance(obj, type) or name.startswith("libvirtError"):
+            continue
+
+        is_conn = obj is connclass
+        for methname, methobj in list(obj.__dict__.items()):
+            if (methname.startswith("_") or
+                not isinstance(methobj, FunctionType)):
+                continue
+            fullname = obj.__name__ + "." + methname
+            setattr(obj, methname, _generate_stats_wrapper(
+                methobj, fullname, True, is_conn, geturi))
@@ -72,7 +72,8 @@ class vmmNetwork(vmmLibvirtObject):
 
     def tick(self, stats_update=True):
         ignore = stats_update
-        self._refresh_status()
+        if not self._refresh_status():
+            self.poll_xml_changes()
 
     def _init_libvirt_state(self):
         self.tick()
@@ -48,7 +48,8 @@ class vmmNodeDevice(vmmLibvirtObject):
         return self.conn.using_node_device_events
 
     def tick(self, stats_update=True):
-        # Deliberately empty
         ignore = stats_update
+        self.poll_xml_changes()
+
     def _init_libvirt_state(self):
         self.ensure_latest_xml()
@@ -20,12 +20,12 @@
 
 import datetime
 import glob
-import io
 import logging
 import os
 
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
+from gi.repository import GLib
 from gi.repository import Gtk
 from gi.repository import Pango
 
@@ -43,6 +43,13 @@ mimemap = {
 }
 
 
+# Max width/height of screenshot previews
+_SCREENSHOT_SIZE = 450
+
+# How many snapshot rows to fill in with XML details per idle callback
+_SNAPSHOT_FILL_BATCH = 20
+
+
 def _mime_to_ext(val, reverse=False):
     for m, e in mimemap.items():
         if val == m and not reverse:
@@ -63,6 +70,10 @@ class vmmSnapshotPage(vmmGObjectUI):
 
         self._initial_populate = False
         self._unapplied_changes = False
+        self._fill_id = None
+        self._fill_queue = []
+        self._fill_has_internal = False
+        self._fill_has_external = False
 
         self._snapmenu = None
         self._init_ui()
@@ -102,6 +113,7 @@ class vmmSnapshotPage(vmmGObjectUI):
     ##############
 
     def _cleanup(self):
+        self._cancel_snapshot_fill()
         self.vm = None
 
         self._snapshot_new.destroy()
@@ -187,15 +199,16 @@ class vmmSnapshotPage(vmmGObjectUI):
         selection = self.widget("snapshot-list").get_selection()
         def add_snap(treemodel, path, it, snaps):
             ignore = path
-            try:
-                name = treemodel[it][0]
-                for snap in self.vm.list_snapshots():
-                    if name == snap.get_name():
-                        snaps.append(snap)
-            except Exception:
-                pass
+            name = treemodel[it][0]
+            if name in snapmap:
+                snaps.append(snapmap[name])
 
         snaps = []
+        try:
+            snapmap = dict((snap.get_name(), snap) for
+                           snap in self.vm.list_snapshots())
+        except Exception:
+            return snaps
         selection.selected_foreach(add_snap, snaps)
         return snaps
 
@@ -212,45 +225,96 @@ class vmmSnapshotPage(vmmGObjectUI):
         self.widget("snapshot-notebook").set_current_page(1)
         self.widget("snapshot-error-label").set_text(msg)
 
+    def _cancel_snapshot_fill(self):
+        if self._fill_id is not None:
+            GLib.source_remove(self._fill_id)
+            self._fill_id = None
+        self._fill_queue = []
+
+    def _fill_snapshot_row(self, model, path, snap):
+        desc = snap.get_xmlobj().description
+        name = snap.get_name()
+        state = snap.run_status()
+        if snap.is_external():
+            self._fill_has_external = True
+            sortname = "3%s" % name
+            external = " (%s)" % _("External")
+        else:
+            self._fill_has_internal = True
+            external = ""
+            sortname = "1%s" % name
+
+        label = "%s\n<span size='small'>%s: %s%s</span>" % (
+            (util.xml_escape(name), _("VM State"),
+             util.xml_escape(state), external))
+
+        row = model[path]
+        row[1] = label
+        row[2] = desc
+        row[3] = snap.run_status_icon_name()
+        row[4] = sortname
+
+    def _fill_snapshot_rows(self):
+        """
+        Idle callback that fills in a batch of rows with details from
+        the snapshot XML, so large snapshot lists don't block the UI
+        """
+        model = self.widget("snapshot-list").get_model()
+        batch = self._fill_queue[:_SNAPSHOT_FILL_BATCH]
+        self._fill_queue = self._fill_queue[_SNAPSHOT_FILL_BATCH:]
+
+        for rowref, snap in batch:
+            if not rowref.valid():
+                continue
+            try:
+                self._fill_snapshot_row(model, rowref.get_path(), snap)
+            except Exception as e:
+                logging.debug("Error fetching XML for snapshot %s: %s",
+                              snap.get_name(), e)
+
+        if self._fill_queue:
+            return True
+
+        if self._fill_has_internal and self._fill_has_external:
+            model.append([None, None, None, None, "2", False])
+        self._fill_id = None
+        return False
+
     def _populate_snapshot_list(self, select_name=None):
         cursnaps = []
         for i in self._get_selected_snapshots():
             cursnaps.append(i.get_name())
 
+        self._cancel_snapshot_fill()
+        self._fill_has_internal = False
+        self._fill_has_external = False
+
         model = self.widget("snapshot-list").get_model()
         model.clear()
 
         try:
             snapshots = self.vm.list_snapshots()
+            current = self.vm.get_current_snapshot_name()
         except Exception as e:
             logging.exception(e)
             self._set_error_page(_("Error refreshing snapshot list: %s") %
                                 str(e))
             return
 
-        has_external = False
-        has_internal = False
+        # Add a row per snapshot using just the name. Details that need
+        # the snapshot XML are filled in from an idle callback, or when
+        # the row is selected
         for snap in snapshots:
-            desc = snap.get_xmlobj().description
             name = snap.get_name()
-            state = snap.run_status()
-            if snap.is_external():
-                has_external = True
-                sortname = "3%s" % name
-                external = " (%s)" % _("External")
-            else:
-                has_internal = True
-                external = ""
-                sortname = "1%s" % name
+            label = "%s\n<span size='small'>%s</span>" % (
+                util.xml_escape(name), _("Loading..."))
+            it = model.append([name, label, None, None,
+                               "1%s" % name, name == current])
+            rowref = Gtk.TreeRowReference.new(model, model.get_path(it))
+            self._fill_queue.append((rowref, snap))
 
-            label = "%s\n<span size='small'>%s: %s%s</span>" % (
-                (util.xml_escape(name), _("VM State"),
-                 util.xml_escape(state), external))
-            model.append([name, label, desc, snap.run_status_icon_name(),
-                          sortname, snap.is_current()])
-
-        if has_internal and has_external:
-            model.append([None, None, None, None, "2", False])
+        if self._fill_queue:
+            self._fill_id = self.idle_add(self._fill_snapshot_rows)
 
 
         def check_selection(treemodel, path, it, snaps):
@@ -267,29 +331,6 @@ class vmmSnapshotPage(vmmGObjectUI):
 
         self._initial_populate = True
 
-    def _make_screenshot_pixbuf(self, mime, sdata):
-        loader = GdkPixbuf.PixbufLoader.new_with_mime_type(mime)
-        loader.write(sdata)
-        pixbuf = loader.get_pixbuf()
-        loader.close()
-
-        maxsize = 450
-        def _scale(big, small, maxsize):
-            if big <= maxsize:
-                return big, small
-            factor = float(maxsize) / float(big)
-            return maxsize, int(factor * float(small))
-
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        if width > height:
-            width, height = _scale(width, height, maxsize)
-        else:
-            height, width = _scale(height, width, maxsize)
-
-        return pixbuf.scale_simple(width, height,
-                                   GdkPixbuf.InterpType.BILINEAR)
-
     def _read_screenshot_file(self, name):
         if not name:
             return
@@ -304,7 +345,8 @@ class vmmSnapshotPage(vmmGObjectUI):
         mime = _mime_to_ext(os.path.splitext(filename)[1][1:], reverse=True)
         if not mime:
             return
-        return self._make_screenshot_pixbuf(mime, open(filename, "rb").read())
+        return GdkPixbuf.Pixbuf.new_from_file_at_scale(
+            filename, _SCREENSHOT_SIZE, _SCREENSHOT_SIZE, True)
 
     def _set_snapshot_state(self, snap=None):
         self.widget("snapshot-notebook").set_current_page(0)
@@ -386,30 +428,20 @@ class vmmSnapshotPage(vmmGObjectUI):
     # 'New' handling #
     ##################
 
-    def _take_screenshot(self):
-        stream = None
-        try:
-            stream = self.vm.conn.get_backend().newStream(0)
-            screen = 0
-            flags = 0
-            mime = self.vm.get_backend().screenshot(stream, screen, flags)
-
-            ret = io.StringIO()
-            def _write_cb(_stream, data, userdata):
-                ignore = stream
-                ignore = userdata
-                ret.write(data)
-
-            stream.recvAll(_write_cb, None)
-            return mime, ret.getvalue()
-        finally:
-            try:
-                if stream:
-                    stream.finish()
-            except Exception:
-                pass
+    def _new_screenshot_cb(self, vm, pixbuf, mime, sdata):
+        ignore = vm
+        if not self.vm or not self._snapshot_new.get_visible():
+            return
+        if not pixbuf or not _mime_to_ext(mime):
+            return
 
-    def _get_screenshot(self):
+        setattr(pixbuf, "vmm_mimetype", mime)
+        setattr(pixbuf, "vmm_sndata", sdata)
+        self.widget("snapshot-new-screenshot").set_from_pixbuf(pixbuf)
+        uiutil.set_grid_row_visible(
+            self.widget("snapshot-new-screenshot"), True)
+
+    def _request_screenshot(self):
         if not self.vm.is_active():
             logging.debug("Skipping screenshot since VM is not active")
             return
@@ -417,28 +449,11 @@ class vmmSnapshotPage(vmmGObjectUI):
             logging.debug("Skipping screenshot since VM has no graphics")
             return
 
-        try:
-            # Perform two screenshots, because qemu + qxl has a bug where
-            # screenshot generally only shows the data from the previous
-            # screenshot request:
-            # https://bugs.launchpad.net/qemu/+bug/1314293
-            self._take_screenshot()
-            mime, sdata = self._take_screenshot()
-        except Exception:
-            logging.exception("Error taking screenshot")
-            return
-
-        ext = _mime_to_ext(mime)
-        if not ext:
-            return
-
-        newpix = self._make_screenshot_pixbuf(mime, sdata)
-        setattr(newpix, "vmm_mimetype", mime)
-        setattr(newpix, "vmm_sndata", sdata)
-        return newpix
+        self.vm.take_screenshot_async(_SCREENSHOT_SIZE,
+                                      self._new_screenshot_cb)
 
     def _reset_new_state(self):
-        collidelist = [s.get_xmlobj().name for s in self.vm.list_snapshots()]
+        collidelist = [s.get_name() for s in self.vm.list_snapshots()]
         default_name = DomainSnapshot.find_free_name(
             self.vm.get_backend(), collidelist)
 
@@ -450,11 +465,11 @@ class vmmSnapshotPage(vmmGObjectUI):
         self.widget("snapshot-new-status-icon").set_from_icon_name(
             self.vm.run_status_icon_name(), Gtk.IconSize.BUTTON)
 
-        sn = self._get_screenshot()
+        # The screenshot row is shown once the async screenshot arrives
+        self.widget("snapshot-new-screenshot").clear()
         uiutil.set_grid_row_visible(
-            self.widget("snapshot-new-screenshot"), bool(sn))
-        if sn:
-            self.widget("snapshot-new-screenshot").set_from_pixbuf(sn)
+            self.widget("snapshot-new-screenshot"), False)
+        self._request_screenshot()
 
 
     def _snapshot_new_name_changed(self, src):
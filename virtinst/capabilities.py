@@ -29,8 +29,16 @@ from .xmlbuilder import XMLBuilder, XMLChildProperty, XMLProperty
 # capabilities host <cpu> parsing #
 ###################################
 
+class _CapsPages(XMLBuilder):
+    _XML_ROOT_NAME = "pages"
+    size = XMLProperty("./@size", is_int=True)
+    unit = XMLProperty("./@unit")
+    count = XMLProperty(".", is_int=True)
+
+
 class _CapsCPU(DomainCPU):
     arch = XMLProperty("./arch")
+    pages = XMLChildProperty(_CapsPages)
 
     # capabilities used to just expose these properties as bools
     _svm_bool = XMLProperty("./features/svm", is_bool=True)
@@ -60,6 +68,9 @@ class _CapsTopologyCPU(XMLBuilder):
 
 class _TopologyCell(XMLBuilder):
     _XML_ROOT_NAME = "cell"
+    id = XMLProperty("./@id", is_int=True)
+    memory = XMLProperty("./memory", is_int=True)
+    pages = XMLChildProperty(_CapsPages)
     cpus = XMLChildProperty(_CapsTopologyCPU, relative_xpath="./cpus")
 
 
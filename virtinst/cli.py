@@ -21,6 +21,7 @@
 
 import argparse
 import collections
+import difflib
 import logging
 import logging.handlers
 import os
@@ -273,7 +274,7 @@ def _in_testsuite():
 # Libvirt connection helpers #
 ##############################
 
-def getConnection(uri):
+def getConnection(uri, conn_cache=True):
     from .connection import VirtualConnection
 
     logging.debug("Requesting libvirt URI %s", (uri or "default"))
@@ -281,6 +282,9 @@ def getConnection(uri):
     conn.open(_do_creds_authname)
     logging.debug("Received libvirt URI %s", conn.uri)
 
+    if conn_cache and not _in_testsuite():
+        conn.enable_persistent_cache()
+
     return conn
 
 
@@ -514,6 +518,19 @@ def get_meter():
     return util.make_meter(quiet=quiet)
 
 
+def get_xml_diff(origxml, newxml):
+    ret = "".join(difflib.unified_diff(origxml.splitlines(1),
+                                       newxml.splitlines(1),
+                                       fromfile="Original XML",
+                                       tofile="Altered XML"))
+
+    if ret:
+        logging.debug("XML diff:\n%s", ret)
+    else:
+        logging.debug("No XML diff, didn't generate any change.")
+    return ret
+
+
 ###########################
 # Common CLI option/group #
 ###########################
@@ -525,6 +542,10 @@ def add_connect_option(parser, invoker=None):
     else:
         parser.add_argument("--connect", metavar="URI",
                 help=_("Connect to hypervisor with libvirt URI"))
+    parser.add_argument("--no-conn-cache", action="store_false",
+            dest="conn_cache", default=True,
+            help=_("Don't use or update the on disk cache of hypervisor "
+                   "capabilities"))
 
 
 def add_misc_options(grp, prompt=False, replace=False,
@@ -722,6 +743,15 @@ def add_guest_xml_options(geng):
         help=_("Tune CPU parameters for the domain process."))
     geng.add_argument("--numatune",
         help=_("Tune NUMA policy for the domain process."))
+    geng.add_argument("--iothreads",
+        help=_("Set the number of IOThreads for disk I/O. Ex:\n"
+               "--iothreads 2\n"
+               "--iothreads 4,assign=auto\n"
+               "--iothreads auto"))
+    geng.add_argument("--tune",
+        help=_("Apply a performance tuning profile. Ex:\n"
+               "--tune profile=throughput\n"
+               "--tune profile=latency,dry"))
     geng.add_argument("--memtune", action="append",
         help=_("Tune memory policy for the domain process."))
     geng.add_argument("--blkiotune", action="append",
@@ -1483,6 +1513,11 @@ class ParserCPU(VirtCLIParser):
         else:
             inst.model = val
 
+    def set_placement_cb(self, inst, val, virtarg):
+        if val != inst.NUMA_PLACEMENT_AUTO:
+            raise ValueError(_("Unknown CPU placement '%s'") % val)
+        inst.numa_placement = val
+
     def set_feature_cb(self, inst, val, virtarg):
         policy = virtarg.cliname
         for feature_name in util.listify(val):
@@ -1536,6 +1571,7 @@ ParserCPU.add_arg(None, "model", cb=ParserCPU.set_model_cb)
 ParserCPU.add_arg("mode", "mode")
 ParserCPU.add_arg("match", "match")
 ParserCPU.add_arg("vendor", "vendor")
+ParserCPU.add_arg(None, "placement", cb=ParserCPU.set_placement_cb)
 
 ParserCPU.add_arg(None, "force", is_list=True, cb=ParserCPU.set_feature_cb)
 ParserCPU.add_arg(None, "require", is_list=True, cb=ParserCPU.set_feature_cb)
@@ -1576,12 +1612,70 @@ class ParserCPUTune(VirtCLIParser):
         cb = self._make_find_inst_cb(cliarg, objpropname)
         return cb(*args, **kwargs)
 
+    def iothread_find_inst_cb(self, *args, **kwargs):
+        cliarg = "iothreadpin"  # iothreadpin[0-9]*
+        objpropname = "iothreadpins"
+        cb = self._make_find_inst_cb(cliarg, objpropname)
+        return cb(*args, **kwargs)
+
 _register_virt_parser(ParserCPUTune)
 # Options for CPU.vcpus config
 ParserCPUTune.add_arg("vcpu", "vcpupin[0-9]*.vcpu",
                   find_inst_cb=ParserCPUTune.vcpu_find_inst_cb)
 ParserCPUTune.add_arg("cpuset", "vcpupin[0-9]*.cpuset", can_comma=True,
                   find_inst_cb=ParserCPUTune.vcpu_find_inst_cb)
+ParserCPUTune.add_arg("emulatorpin_cpuset", "emulatorpin.cpuset",
+                      can_comma=True)
+# Options for CPU.iothreadpins config
+ParserCPUTune.add_arg("iothread", "iothreadpin[0-9]*.iothread",
+                  find_inst_cb=ParserCPUTune.iothread_find_inst_cb)
+ParserCPUTune.add_arg("cpuset", "iothreadpin[0-9]*.cpuset", can_comma=True,
+                  find_inst_cb=ParserCPUTune.iothread_find_inst_cb)
+
+
+#######################
+# --iothreads parsing #
+#######################
+
+class ParserIOThreads(VirtCLIParser):
+    cli_arg_name = "iothreads"
+    remove_first = "iothreads"
+
+    def set_iothreads_cb(self, inst, val, virtarg):
+        if val == "auto":
+            inst.iothreads_auto_assign = True
+            return
+        inst.iothreads = int(val)
+
+    def set_assign_cb(self, inst, val, virtarg):
+        if val not in ["auto", "none"]:
+            raise ValueError(_("Unknown iothread assignment '%s'") % val)
+        inst.iothreads_auto_assign = (val == "auto")
+
+    def iothreadid_find_inst_cb(self, *args, **kwargs):
+        cliarg = "iothreadid"  # iothreadid[0-9]*
+        objpropname = "iothreadids"
+        cb = self._make_find_inst_cb(cliarg, objpropname)
+        return cb(*args, **kwargs)
+
+    def _parse(self, inst):
+        ret = VirtCLIParser._parse(self, inst)
+
+        if inst.iothreadids and not inst.iothreads:
+            inst.iothreads = len(inst.iothreadids)
+        if inst.iothreads_auto_assign:
+            # virt-xml is editing existing devices, so assign now.
+            # For virt-install the devices don't exist yet, and the
+            # assignment happens when the guest defaults are set
+            inst.assign_disk_iothreads()
+        return ret
+
+
+_register_virt_parser(ParserIOThreads)
+ParserIOThreads.add_arg(None, "iothreads", cb=ParserIOThreads.set_iothreads_cb)
+ParserIOThreads.add_arg(None, "assign", cb=ParserIOThreads.set_assign_cb)
+ParserIOThreads.add_arg("id", "iothreadid[0-9]*.id",
+                        find_inst_cb=ParserIOThreads.iothreadid_find_inst_cb)
 
 
 ###################
@@ -2146,6 +2240,7 @@ ParserDisk.add_arg("driver_detect_zeroes", "detect_zeroes")
 ParserDisk.add_arg("driver_name", "driver_name")
 ParserDisk.add_arg("driver_type", "driver_type")
 ParserDisk.add_arg("driver_io", "io")
+ParserDisk.add_arg("driver_iothread", "iothread")
 ParserDisk.add_arg("error_policy", "error_policy")
 ParserDisk.add_arg("serial", "serial")
 ParserDisk.add_arg("target", "target")
@@ -2208,6 +2303,11 @@ class ParserNetwork(VirtCLIParser):
             val = "down"
         inst.link_state = val
 
+    def set_tuning_cb(self, inst, val, virtarg):
+        if val not in ["auto", "none"]:
+            raise ValueError(_("Unknown network tuning '%s'") % val)
+        inst.tuning_auto = (val == "auto")
+
     def _parse(self, inst):
         if self.optstr == "none":
             return
@@ -2220,7 +2320,12 @@ class ParserNetwork(VirtCLIParser):
                 self.optdict["type"] = VirtualNetworkInterface.TYPE_BRIDGE
                 self.optdict["source"] = self.optdict.pop("bridge")
 
-        return VirtCLIParser._parse(self, inst)
+        ret = VirtCLIParser._parse(self, inst)
+        if inst.tuning_auto and inst.model:
+            # virt-xml edits have a model already, for virt-install
+            # the default model is filled in with the guest defaults
+            inst.set_tuning_defaults(self.guest)
+        return ret
 
 
 _register_virt_parser(ParserNetwork)
@@ -2243,6 +2348,7 @@ ParserNetwork.add_arg("link_state", "link_state",
 
 ParserNetwork.add_arg("driver_name", "driver_name")
 ParserNetwork.add_arg("driver_queues", "driver_queues")
+ParserNetwork.add_arg(None, "tuning", cb=ParserNetwork.set_tuning_cb)
 
 ParserNetwork.add_arg("rom_file", "rom_file")
 ParserNetwork.add_arg("rom_bar", "rom_bar", is_onoff=True)
@@ -2389,6 +2495,7 @@ ParserController.add_arg("type", "type")
 ParserController.add_arg("model", "model")
 ParserController.add_arg("index", "index")
 ParserController.add_arg("master_startport", "master")
+ParserController.add_arg("driver_iothread", "iothread")
 
 ParserController.add_arg(None, "address", cb=ParserController.set_server_cb)
 
@@ -2806,6 +2913,145 @@ ParserHostdev.add_arg("boot.order", "boot_order")
 ParserHostdev.add_arg("rom_bar", "rom_bar", is_onoff=True)
 
 
+##################
+# --tune parsing #
+##################
+
+class ParserTune(VirtCLIParser):
+    """
+    Apply a performance profile by feeding option strings through the
+    other parsers. Registered last, so for virt-install anything the user
+    specified explicitly is already set and left alone. For virt-xml the
+    profile overrides the existing guest config.
+    """
+    cli_arg_name = "tune"
+    remove_first = "profile"
+
+    PROFILE_THROUGHPUT = "throughput"
+    PROFILE_LATENCY = "latency"
+    PROFILE_DENSITY = "density"
+    PROFILES = [PROFILE_THROUGHPUT, PROFILE_LATENCY, PROFILE_DENSITY]
+
+    def __init__(self, guest, optstr):
+        VirtCLIParser.__init__(self, guest, optstr)
+        self._override = False
+        self._profile = None
+
+    @staticmethod
+    def is_dry_run(optstr):
+        return "dry" in [opt[0] for opt in parse_optstr_tuples(optstr)]
+
+    def parse(self, inst, validate=True):
+        # virt-xml passes in the guest it's editing
+        self._override = inst is not None
+        self._profile = None
+        return VirtCLIParser.parse(self, inst, validate=validate)
+
+    def set_profile_cb(self, inst, val, virtarg):
+        if val not in self.PROFILES:
+            raise ValueError(_("Unknown tuning profile '%s'") % val)
+        self._profile = val
+
+    def noset_cb(self, inst, val, virtarg):
+        pass
+
+    def _get_profile_options(self, guest):
+        """
+        Return a list of (parserclass, optstr) for the profile,
+        based on what the host supports
+        """
+        conn = guest.conn
+        profile = self._profile
+        cpumode = (guest.type == "kvm" and "host-passthrough" or
+                   "host-model")
+        hugepages = len(conn.caps.host.cpu.pages) > 1
+        iothreads = conn.check_support(conn.SUPPORT_CONN_IOTHREADS)
+
+        if profile == self.PROFILE_DENSITY:
+            # Overcommit friendly: migratable CPU, no pinning, allow
+            # balloon and KSM to reclaim memory
+            return [(ParserCPU, "host-model"),
+                    (ParserMemorybacking, "hugepages=off,nosharepages=off"),
+                    (ParserMemballoon, "virtio")]
+
+        ret = [(ParserCPU, "%s,placement=auto-numa" % cpumode)]
+        if iothreads:
+            ret.append((ParserIOThreads, "auto"))
+        ret.append((ParserNetwork, "tuning=auto"))
+
+        memopts = []
+        if hugepages:
+            memopts.append("hugepages=on")
+        if profile == self.PROFILE_LATENCY:
+            # KSM page merging and ballooning both add unpredictable
+            # stalls, turn them off
+            memopts.append("nosharepages=on")
+            ret.append((ParserMemballoon, "none"))
+        if memopts:
+            ret.append((ParserMemorybacking, ",".join(memopts)))
+        return ret
+
+    def _is_user_configured(self, parserclass, obj):
+        if parserclass is ParserCPU:
+            return bool(obj.get_xml_config().strip() or
+                        obj.special_mode_was_set or obj.numa_placement)
+        if parserclass is ParserIOThreads:
+            return bool(obj.iothreads or obj.iothreadids)
+        if parserclass is ParserNetwork:
+            # set_tuning_defaults keeps explicit driver settings
+            return False
+        return bool(obj.get_xml_config().strip())
+
+    def _apply(self, guest, parserclass, optstr):
+        objclass = parserclass.objclass
+        if not objclass:
+            objs = [guest]
+        else:
+            objs = guest.list_children_for_class(objclass)
+            if not objs and parserclass is ParserMemballoon:
+                # virt-install hasn't added the default balloon yet
+                objs = [None]
+
+        for obj in objs:
+            if (obj and not self._override and
+                self._is_user_configured(parserclass, obj)):
+                logging.debug("--tune: keeping user specified --%s",
+                              parserclass.cli_arg_name)
+                continue
+            logging.debug("--tune: applying --%s %s",
+                          parserclass.cli_arg_name, optstr)
+            parserclass(guest, optstr).parse(obj)
+
+    def _check_hugepages(self, guest):
+        try:
+            guest.check_hugepages()
+        except ValueError as e:
+            logging.warning(_("Not using huge pages: %s"), e)
+            guest.memoryBacking.page_size = None
+            guest.memoryBacking.page_unit = None
+            guest.memoryBacking.hugepages = None
+
+    def _parse(self, inst):
+        VirtCLIParser._parse(self, inst)
+        if not self._profile:
+            raise ValueError(_("A tuning profile must be specified"))
+
+        for parserclass, optstr in self._get_profile_options(inst):
+            self._apply(inst, parserclass, optstr)
+
+        if inst.memoryBacking.hugepages:
+            # Fall back to regular pages rather than failing at guest start
+            self._check_hugepages(inst)
+        if self._override:
+            # virt-install does this when setting guest defaults
+            inst.apply_numa_placement()
+
+
+_register_virt_parser(ParserTune)
+ParserTune.add_arg(None, "profile", cb=ParserTune.set_profile_cb)
+ParserTune.add_arg(None, "dry", is_novalue=True, cb=ParserTune.noset_cb)
+
+
 ###########################
 # Public virt parser APIs #
 ###########################
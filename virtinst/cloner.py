@@ -66,6 +66,7 @@ class Cloner(object):
         self._clone_running = False
         self._replace = False
         self._reflink = False
+        self._linked = False
 
         # Default clone policy for back compat: don't clone readonly,
         # shareable, or empty disks
@@ -261,6 +262,15 @@ class Cloner(object):
     reflink = property(_get_reflink, _set_reflink,
             doc="If true, use COW lightweight copy")
 
+    def _get_linked(self):
+        return self._linked
+    def _set_linked(self, val):
+        self._linked = bool(val)
+    linked = property(_get_linked, _set_linked,
+            doc="If true, create qcow2 overlays backed by the original "
+                "disks instead of copying them. The original guest's "
+                "disks are marked read-only and shareable.")
+
     # Functional methods
 
     def setup_original(self):
@@ -291,16 +301,59 @@ class Cloner(object):
         logging.debug("Original sizes: %s",
                       [d.get_size() for d in self.original_disks])
 
-        # If domain has devices to clone, it must be 'off' or 'paused'
-        if (not self.clone_running and
+        # If domain has devices to clone, it must be 'off' or 'paused'.
+        # Linked clones need it 'off': marking the disks read-only only
+        # changes the persistent XML, a live VM could still write to
+        # the backing images of the overlays
+        if ((self.linked or not self.clone_running) and
             (self.original_dom and len(self.original_disks) != 0)):
             status = self.original_dom.info()[0]
 
-            if status not in [libvirt.VIR_DOMAIN_SHUTOFF,
-                              libvirt.VIR_DOMAIN_PAUSED]:
+            if self.linked:
+                if status != libvirt.VIR_DOMAIN_SHUTOFF:
+                    raise RuntimeError(_("Domain must be shutoff to "
+                                         "create linked clones."))
+            elif status not in [libvirt.VIR_DOMAIN_SHUTOFF,
+                                libvirt.VIR_DOMAIN_PAUSED]:
                 raise RuntimeError(_("Domain with devices to clone must be "
                                      "paused or shutoff."))
 
+    def copy_for_new_clone(self):
+        """
+        Return a new Cloner with the same settings and original guest
+        as this one, reusing the setup_original() results. Used to create
+        many clones of one original without looking it up every time.
+        """
+        ret = Cloner(self.conn)
+        ret._original_guest = self._original_guest
+        ret._original_xml = self._original_xml
+        ret.original_dom = self.original_dom
+        ret._original_disks = self._original_disks
+
+        ret._clone_sparse = self._clone_sparse
+        ret._force_target = self._force_target[:]
+        ret._skip_target = self._skip_target[:]
+        ret._preserve = self._preserve
+        ret._clone_running = self._clone_running
+        ret._replace = self._replace
+        ret._reflink = self._reflink
+        ret._linked = self._linked
+        ret._clone_policy = self._clone_policy[:]
+
+        # setup_clone alters the guest in place, so each clone needs
+        # its own copy
+        ret._guest = Guest(self.conn, parsexml=self._original_xml)
+        ret._guest.id = None
+        ret._guest.replace = self.replace
+        return ret
+
+    def get_interface_count(self):
+        """
+        Number of network interfaces the clone has, which is the number
+        of clone_macs it can use
+        """
+        return len(self._guest.get_devices("interface"))
+
     def _setup_disk_clone_destination(self, orig_disk, clone_disk):
         """
         Helper that validates the new path location
@@ -308,6 +361,11 @@ class Cloner(object):
         if self.preserve_dest_disks:
             return
 
+        if self.linked:
+            self._setup_linked_clone_destination(orig_disk, clone_disk)
+            clone_disk.validate()
+            return
+
         if clone_disk.get_vol_object():
             # XXX We could always do this with vol upload?
 
@@ -355,6 +413,61 @@ class Cloner(object):
 
         clone_disk.validate()
 
+    def _setup_linked_clone_destination(self, orig_disk, clone_disk):
+        """
+        Turn the clone_disk volume into a qcow2 overlay on top of orig_disk
+        """
+        vol_install = clone_disk.get_vol_install()
+        if not orig_disk.path or not vol_install:
+            raise RuntimeError(
+                _("Linked clones need a new storage volume for every "
+                  "cloned disk: '%s'") % clone_disk.path)
+        if not vol_install.supports_property("format"):
+            raise RuntimeError(
+                _("Linked clone path '%s' is not in a pool that "
+                  "supports qcow2 volumes") % clone_disk.path)
+
+        # Nothing is copied, so this is quick no matter the disk size
+        vol_install.format = "qcow2"
+        vol_install.backing_store = orig_disk.path
+        vol_install.backing_format = orig_disk.driver_type
+        vol_install.capacity = int(round(orig_disk.get_size() *
+                                         1024 * 1024 * 1024))
+        vol_install.allocation = 0
+        clone_disk.set_vol_install(vol_install)
+
+    def set_original_disks_readonly(self):
+        """
+        The original disks are now backing images for the linked clone,
+        so the original guest must not write to them anymore. Called by
+        start_duplicate, or once up front when creating many clones
+        """
+        if not self.original_dom:
+            logging.warning(_("Original guest isn't defined on this "
+                              "connection, make sure it doesn't write to "
+                              "the linked clone backing disks: %s"),
+                            ", ".join([d.path for d in self.original_disks]))
+            return
+
+        flags = (libvirt.VIR_DOMAIN_XML_INACTIVE |
+                 libvirt.VIR_DOMAIN_XML_SECURE)
+        origguest = Guest(self.conn,
+                          parsexml=self.original_dom.XMLDesc(flags))
+        paths = [d.path for d in self.original_disks]
+        changed = False
+        for disk in origguest.get_devices("disk"):
+            if disk.path not in paths:
+                continue
+            if disk.read_only and disk.shareable:
+                continue
+            disk.read_only = True
+            disk.shareable = True
+            changed = True
+
+        if changed:
+            logging.debug("Marking original disks read-only: %s", paths)
+            self.conn.defineXML(origguest.get_xml_config())
+
 
     def _prepare_nvram(self):
         if self.clone_nvram is None:
@@ -402,6 +515,14 @@ class Cloner(object):
 
         logging.debug("Clone paths: %s", [d.path for d in self.clone_disks])
 
+        if self.linked:
+            if self.preserve_dest_disks:
+                raise ValueError(_("Linked clones can't be used when "
+                                   "preserving the clone disks."))
+            if self.reflink:
+                raise ValueError(_("Linked clones can't be combined "
+                                   "with reflink copies."))
+
         self._guest.name = self._clone_name
         self._guest.uuid = self._clone_uuid
         self._clone_macs.reverse()
@@ -436,6 +557,12 @@ class Cloner(object):
             xmldisk.type = clone_disk.type
             xmldisk.driver_name = orig_disk.driver_name
             xmldisk.driver_type = orig_disk.driver_type
+            if self.linked:
+                # The source may be a previously marked golden image,
+                # the overlay is private to the clone
+                xmldisk.driver_type = "qcow2"
+                xmldisk.read_only = False
+                xmldisk.shareable = False
             xmldisk.path = clone_disk.path
 
         # For guest agent channel, remove a path to generate a new one with
@@ -451,10 +578,14 @@ class Cloner(object):
         self._clone_xml = self._guest.get_xml_config()
         logging.debug("Clone guest xml is\n%s", self._clone_xml)
 
-    def start_duplicate(self, meter=None):
+    def start_duplicate(self, meter=None, set_original_readonly=True):
         """
         Actually perform the duplication: cloning disks if needed and defining
         the new clone xml.
+
+        :param set_original_readonly: For linked clones, mark the original
+            disks read-only before creating the overlays. Pass False if
+            the caller already did set_original_disks_readonly
         """
         logging.debug("Starting duplicate.")
         meter = util.ensure_meter(meter)
@@ -468,6 +599,8 @@ class Cloner(object):
             # Define domain early to catch any xml errors before duping storage
             dom = self.conn.defineXML(self.clone_xml)
 
+            if self.linked and set_original_readonly:
+                self.set_original_disks_readonly()
             if self.preserve:
                 for dst_dev in self.clone_disks:
                     dst_dev.setup(meter=meter)
@@ -481,7 +614,8 @@ class Cloner(object):
 
         logging.debug("Duplicating finished.")
 
-    def generate_clone_disk_path(self, origpath, newname=None):
+    def generate_clone_disk_path(self, origpath, newname=None,
+                                 collidelist=None):
         origname = self.original_guest
         newname = newname or self.clone_name
         path = origpath
@@ -509,9 +643,10 @@ class Cloner(object):
                     clonebase,
                     lambda p: VirtualDisk.path_definitely_exists(self.conn, p),
                     suffix,
-                    lib_collision=False)
+                    lib_collision=False,
+                    collidelist=collidelist)
 
-    def generate_clone_name(self):
+    def generate_clone_name(self, collidelist=None, existing_names=None):
         # If the orig name is "foo-clone", we don't want the clone to be
         # "foo-clone-clone", we want "foo-clone1"
         basename = self.original_guest
@@ -525,9 +660,13 @@ class Cloner(object):
             basename = basename.replace(match.group(), "")
 
         basename = basename + "-clone"
+        if existing_names is None:
+            existing_names = self.conn.fetch_all_guest_names()
         return util.generate_name(basename,
                                   self.conn.lookupByName,
-                                  sep="", start_num=start_num)
+                                  sep="", start_num=start_num,
+                                  collidelist=collidelist,
+                                  existing_names=existing_names)
 
 
 
@@ -594,6 +733,12 @@ class Cloner(object):
             self.CLONE_POLICY_NO_EMPTYMEDIA in self.clone_policy):
             return False
 
+        # Linked clone sources are marked readonly and shareable, but
+        # further linked clones still need an overlay of their own
+        if (self.linked and disk.path and
+            disk.device == VirtualDisk.DEVICE_DISK):
+            return True
+
         # Readonly disks
         if (disk.read_only and
             self.CLONE_POLICY_NO_READONLY in self.clone_policy):
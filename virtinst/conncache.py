@@ -0,0 +1,243 @@
+#
+# Copyright 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from virtcli import CLIConfig
+
+from . import util
+
+
+class ConnectionCache(object):
+    """
+    On disk cache of connection data that is expensive to look up but
+    only changes when libvirt or the hypervisor is updated: the
+    capabilities XML, domain capabilities XML, and support check results.
+
+    There is one cache file per URI. Its contents are thrown away if the
+    libvirt, hypervisor, or virtinst version differs from the one that
+    wrote it, if any emulator binary listed in the cached capabilities,
+    or a directory containing one, was modified (local connections only),
+    or if it is older than MAX_AGE seconds. Watching the directories
+    catches newly installed emulators the cached capabilities don't list.
+
+    Changes are only written to disk by flush(), which is called when
+    the connection is closed and at exit.
+    """
+    MAX_AGE = 24 * 60 * 60
+    _FORMAT = 2
+
+    def __init__(self, conn, cachedir=None):
+        self._conn = conn
+        self._cachedir = cachedir or os.path.join(util.get_cache_dir(),
+                                                  "conncache")
+
+        urihash = hashlib.sha256(conn.uri.encode("utf-8")).hexdigest()
+        self._path = os.path.join(self._cachedir, urihash + ".json")
+
+        # The connection may be shared by several install threads
+        self._lock = threading.RLock()
+        self._key = self._build_key()
+        self._data = self._load()
+        self._dirty = False
+        atexit.register(self.flush)
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _build_key(self):
+        # Use the raw libvirt connection here: going through
+        # VirtualConnection would recurse into the support checks
+        # we are trying to cache.
+        libvirtconn = self._conn.get_conn_for_api_arg()
+
+        def _lookup(func):
+            try:
+                return func()
+            except Exception as e:
+                logging.debug("Error looking up cache key: %s", e)
+                return None
+
+        return {
+            "format": self._FORMAT,
+            "uri": self._conn.uri,
+            "virtinst": CLIConfig.version,
+            "local_libvirt": util.local_libvirt_version(),
+            "daemon_libvirt": _lookup(libvirtconn.getLibVersion),
+            "hypervisor": _lookup(libvirtconn.getVersion),
+        }
+
+    def _new_data(self):
+        return {
+            "key": self._key,
+            "timestamp": time.time(),
+            "caps": None,
+            "binaries": {},
+            "domcaps": {},
+            "support": {},
+        }
+
+    def _get_binary_mtimes(self, capsxml):
+        ret = {}
+        if self._conn.is_remote():
+            return ret
+
+        emulators = set(re.findall(r"<emulator>([^<]+)</emulator>", capsxml))
+        for path in emulators | set(os.path.dirname(e) for e in emulators):
+            try:
+                ret[path] = os.stat(path).st_mtime
+            except OSError:
+                ret[path] = None
+        return ret
+
+    def _get_stale_reason(self, data):
+        if data.get("key") != self._key:
+            return "connection or library version changed"
+
+        age = time.time() - data.get("timestamp", 0)
+        if age < 0 or age > self.MAX_AGE:
+            return "cache is %d seconds old" % age
+
+        if data.get("caps"):
+            binaries = self._get_binary_mtimes(data["caps"])
+            if binaries != data.get("binaries", {}):
+                return "emulator binaries or directories changed"
+        return None
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("unexpected content")
+        except (IOError, OSError, ValueError) as e:
+            if os.path.exists(self._path):
+                logging.debug("Ignoring unreadable connection cache %s: %s",
+                              self._path, e)
+            return self._new_data()
+
+        reason = self._get_stale_reason(data)
+        if reason:
+            logging.debug("Discarding connection cache %s: %s",
+                          self._path, reason)
+            return self._new_data()
+
+        logging.debug("Using connection cache %s", self._path)
+        return data
+
+    def _save(self):
+        # Write to a temporary file and rename it into place, so
+        # concurrent readers never see a partially written cache.
+        tmpname = None
+        try:
+            if not os.path.exists(self._cachedir):
+                os.makedirs(self._cachedir, 0o700)
+
+            fd, tmpname = tempfile.mkstemp(dir=self._cachedir,
+                                           prefix=".conncache-")
+            with os.fdopen(fd, "w") as f, self._lock:
+                json.dump(self._data, f)
+            os.rename(tmpname, self._path)
+            tmpname = None
+        except (IOError, OSError) as e:
+            logging.debug("Error writing connection cache %s: %s",
+                          self._path, e)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def get_path(self):
+        return self._path
+
+    def flush(self):
+        """
+        Write out any changes made since the last flush
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._save()
+
+    def invalidate(self):
+        """
+        Drop all cached data, in memory and on disk
+        """
+        with self._lock:
+            self._data = self._new_data()
+            self._dirty = False
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+    def get_caps_xml(self):
+        with self._lock:
+            return self._data["caps"]
+
+    def set_caps_xml(self, xml):
+        binaries = self._get_binary_mtimes(xml)
+        with self._lock:
+            self._data["caps"] = xml
+            self._data["binaries"] = binaries
+            self._dirty = True
+
+    def get_domcaps_xml(self, emulator, arch, machine, virttype):
+        key = "|".join([str(emulator), str(arch), str(machine), str(virttype)])
+        with self._lock:
+            return self._data["domcaps"].get(key)
+
+    def set_domcaps_xml(self, emulator, arch, machine, virttype, xml):
+        key = "|".join([str(emulator), str(arch), str(machine), str(virttype)])
+        with self._lock:
+            self._data["domcaps"][key] = xml
+            self._dirty = True
+
+    def get_support(self, name):
+        with self._lock:
+            return self._data["support"].get(name)
+
+    def set_support(self, name, value):
+        with self._lock:
+            self._data["support"][name] = bool(value)
+            self._dirty = True
+
+    def get_versions(self):
+        """
+        Return the (daemon libvirt, hypervisor) versions looked up when
+        building the cache key, so the connection needn't fetch them again.
+        """
+        return self._key["daemon_libvirt"], self._key["hypervisor"]
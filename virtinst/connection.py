@@ -17,12 +17,14 @@
 # MA 02110-1301 USA.
 
 import logging
+import threading
 import weakref
 
 import libvirt
 
 from virtcli import CLIConfig
 
+from . import diskbackend
 from . import pollhelpers
 from . import support
 from . import util
@@ -70,9 +72,16 @@ class VirtualConnection(object):
         self._libvirtconn = None
         self._uriobj = URI(self._uri)
         self._caps = None
+        self._domcaps_cache = {}
+        self._persistent_cache = None
 
         self._support_cache = {}
         self._fetch_cache = {}
+        self._storage_path_resolver = None
+
+        # Protects the lazily filled caches above, which virt-install
+        # --count --parallel hits from several threads at once
+        self._cache_lock = threading.RLock()
 
         # These let virt-manager register a callback which provides its
         # own cached object lists, rather than doing fresh calls
@@ -100,10 +109,17 @@ class VirtualConnection(object):
     uri = property(_get_uri)
 
     def _get_caps(self):
-        if not self._caps:
-            self._caps = Capabilities(self,
-                self._libvirtconn.getCapabilities())
-        return self._caps
+        with self._cache_lock:
+            if not self._caps:
+                xml = None
+                if self._persistent_cache:
+                    xml = self._persistent_cache.get_caps_xml()
+                if not xml:
+                    xml = self._libvirtconn.getCapabilities()
+                    if self._persistent_cache:
+                        self._persistent_cache.set_caps_xml(xml)
+                self._caps = Capabilities(self, xml)
+            return self._caps
     caps = property(_get_caps)
 
     def get_conn_for_api_arg(self):
@@ -118,15 +134,50 @@ class VirtualConnection(object):
         return not bool(self._libvirtconn)
 
     def close(self):
+        if self._persistent_cache:
+            self._persistent_cache.flush()
         self._libvirtconn = None
         self._uri = None
         self._fetch_cache = {}
+        self._storage_path_resolver = None
 
     def fake_conn_predictable(self):
         return self._fake_conn_predictable
 
+    def get_storage_path_resolver(self):
+        """
+        Return the diskbackend.StoragePathResolver for this connection
+        """
+        if not self._storage_path_resolver:
+            self._storage_path_resolver = (
+                diskbackend.StoragePathResolver(self))
+        return self._storage_path_resolver
+
     def invalidate_caps(self):
-        self._caps = None
+        with self._cache_lock:
+            self._caps = None
+            self._domcaps_cache = {}
+            if self._persistent_cache:
+                self._persistent_cache.invalidate()
+
+    def enable_persistent_cache(self, cachedir=None):
+        """
+        Cache capabilities, domain capabilities and support check results
+        on disk, so short lived CLI tools don't need to query them from
+        libvirt on every run. Not used for test or magic URIs.
+        """
+        if self._magic_uri or self.is_really_test():
+            return
+        from .conncache import ConnectionCache
+        self._persistent_cache = ConnectionCache(self, cachedir)
+        logging.debug("Connection cache file: %s",
+                      self._persistent_cache.get_path())
+
+        daemon_version, conn_version = self._persistent_cache.get_versions()
+        if self.is_remote() and daemon_version:
+            self._daemon_version = daemon_version
+        if conn_version:
+            self._conn_version = conn_version
 
     def is_open(self):
         return bool(self._libvirtconn)
@@ -179,9 +230,28 @@ class VirtualConnection(object):
             return self.cb_fetch_all_guests()  # pylint: disable=not-callable
 
         key = self._FETCH_KEY_GUESTS
-        if key not in self._fetch_cache:
-            self._fetch_cache[key] = self._fetch_all_guests_raw()
-        return self._fetch_cache[key][:]
+        with self._cache_lock:
+            if key not in self._fetch_cache:
+                self._fetch_cache[key] = self._fetch_all_guests_raw()
+            return self._fetch_cache[key][:]
+
+    def fetch_all_guest_names(self):
+        """
+        Returns a list of all guest names. Unlike fetch_all_guests, this
+        doesn't fetch or parse any guest XML if it isn't cached already.
+        """
+        if self.cb_fetch_all_guests:
+            # pylint: disable=not-callable
+            return [guest.name for guest in self.cb_fetch_all_guests()]
+
+        key = self._FETCH_KEY_GUESTS
+        with self._cache_lock:
+            if key in self._fetch_cache:
+                return [guest.name for guest in self._fetch_cache[key]]
+
+        ignore, ignore, ret = pollhelpers.fetch_vms(
+            self, {}, lambda obj, ignore: obj)
+        return [obj.name() for obj in ret]
 
     def _build_pool_raw(self, poolobj):
         return StoragePool(weakref.ref(self),
@@ -200,9 +270,10 @@ class VirtualConnection(object):
             return self.cb_fetch_all_pools()  # pylint: disable=not-callable
 
         key = self._FETCH_KEY_POOLS
-        if key not in self._fetch_cache:
-            self._fetch_cache[key] = self._fetch_all_pools_raw()
-        return self._fetch_cache[key][:]
+        with self._cache_lock:
+            if key not in self._fetch_cache:
+                self._fetch_cache[key] = self._fetch_all_pools_raw()
+            return self._fetch_cache[key][:]
 
     def _fetch_vols_raw(self, poolxmlobj):
         ret = []
@@ -235,30 +306,33 @@ class VirtualConnection(object):
             return self.cb_fetch_all_vols()  # pylint: disable=not-callable
 
         key = self._FETCH_KEY_VOLS
-        if key not in self._fetch_cache:
-            self._fetch_cache[key] = self._fetch_all_vols_raw()
-        return self._fetch_cache[key][:]
+        with self._cache_lock:
+            if key not in self._fetch_cache:
+                self._fetch_cache[key] = self._fetch_all_vols_raw()
+            return self._fetch_cache[key][:]
 
     def _cache_new_pool_raw(self, poolobj):
-        # Make sure cache is primed
-        if self._FETCH_KEY_POOLS not in self._fetch_cache:
-            # Nothing cached yet, so next poll will pull in latest bits,
-            # so there's nothing to do
-            return
-
-        poollist = self._fetch_cache[self._FETCH_KEY_POOLS]
-        poolxmlobj = self._build_pool_raw(poolobj)
-        poollist.append(poolxmlobj)
-
-        if self._FETCH_KEY_VOLS not in self._fetch_cache:
-            return
-        vollist = self._fetch_cache[self._FETCH_KEY_VOLS]
-        vollist.extend(self._fetch_vols_raw(poolxmlobj))
+        with self._cache_lock:
+            # Make sure cache is primed
+            if self._FETCH_KEY_POOLS not in self._fetch_cache:
+                # Nothing cached yet, so next poll will pull in latest bits,
+                # so there's nothing to do
+                return
+
+            poollist = self._fetch_cache[self._FETCH_KEY_POOLS]
+            poolxmlobj = self._build_pool_raw(poolobj)
+            poollist.append(poolxmlobj)
+
+            if self._FETCH_KEY_VOLS not in self._fetch_cache:
+                return
+            vollist = self._fetch_cache[self._FETCH_KEY_VOLS]
+            vollist.extend(self._fetch_vols_raw(poolxmlobj))
 
     def cache_new_pool(self, poolobj):
         """
         Insert the passed poolobj into our cache
         """
+        self.get_storage_path_resolver().invalidate()
         if self.cb_cache_new_pool:
             # pylint: disable=not-callable
             return self.cb_cache_new_pool(poolobj)
@@ -278,9 +352,10 @@ class VirtualConnection(object):
             return self.cb_fetch_all_nodedevs()  # pylint: disable=not-callable
 
         key = self._FETCH_KEY_NODEDEVS
-        if key not in self._fetch_cache:
-            self._fetch_cache[key] = self._fetch_all_nodedevs_raw()
-        return self._fetch_cache[key][:]
+        with self._cache_lock:
+            if key not in self._fetch_cache:
+                self._fetch_cache[key] = self._fetch_all_nodedevs_raw()
+            return self._fetch_cache[key][:]
 
 
     #########################
@@ -290,6 +365,27 @@ class VirtualConnection(object):
     def getURI(self):
         return self._uri
 
+    def getDomainCapabilities(self, emulator, arch, machine, virttype,
+                              flags=0):
+        key = (emulator, arch, machine, virttype)
+        if flags:
+            return self._libvirtconn.getDomainCapabilities(
+                emulator, arch, machine, virttype, flags)
+
+        with self._cache_lock:
+            if key not in self._domcaps_cache:
+                xml = None
+                if self._persistent_cache:
+                    xml = self._persistent_cache.get_domcaps_xml(*key)
+                if not xml:
+                    xml = self._libvirtconn.getDomainCapabilities(
+                        emulator, arch, machine, virttype, flags)
+                    if self._persistent_cache:
+                        self._persistent_cache.set_domcaps_xml(
+                            *(key + (xml,)))
+                self._domcaps_cache[key] = xml
+            return self._domcaps_cache[key]
+
 
     #########################
     # Public version checks #
@@ -409,13 +505,30 @@ class VirtualConnection(object):
                          _supportname.startswith("SUPPORT_")]:
         locals()[_supportname] = getattr(support, _supportname)
 
+    _support_names = dict((getattr(support, _supportname), _supportname)
+        for _supportname in dir(support) if
+        _supportname.startswith("SUPPORT_"))
+
     def check_support(self, feature, data=None):
         key = feature
         data = data or self
-        if key not in self._support_cache:
-            self._support_cache[key] = support.check_support(
-                self, feature, data)
-        return self._support_cache[key]
+        with self._cache_lock:
+            if key not in self._support_cache:
+                # Only results checked against the connection itself are
+                # stable enough to persist; object checks depend on
+                # the object
+                name = None
+                if self._persistent_cache and data is self:
+                    name = self._support_names.get(feature)
+                ret = None
+                if name:
+                    ret = self._persistent_cache.get_support(name)
+                if ret is None:
+                    ret = support.check_support(self, feature, data)
+                    if name:
+                        self._persistent_cache.set_support(name, ret)
+                self._support_cache[key] = ret
+            return self._support_cache[key]
 
     def support_remote_url_install(self):
         if self._magic_uri:
@@ -81,6 +81,10 @@ class CPU(XMLBuilder):
                        "sockets", "cores", "threads", "features"]
 
     special_mode_was_set = False
+    # Only used by virt-install, see Guest.apply_numa_placement
+    NUMA_PLACEMENT_AUTO = "auto-numa"
+    numa_placement = None
+
     # These values are exposed on the command line, so are stable API
     SPECIAL_MODE_HOST_MODEL_ONLY = "host-model-only"
     SPECIAL_MODE_HV_DEFAULT = "hv-default"
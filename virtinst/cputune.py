@@ -28,9 +28,24 @@ class _VCPUPin(XMLBuilder):
     cpuset = XMLProperty("./@cpuset")
 
 
+class _IOThreadPin(XMLBuilder):
+    """
+    Class for generating <cputune> child <iothreadpin> XML
+    """
+    _XML_ROOT_NAME = "iothreadpin"
+    _XML_PROP_ORDER = ["iothread", "cpuset"]
+
+    iothread = XMLProperty("./@iothread", is_int=True)
+    cpuset = XMLProperty("./@cpuset")
+
+
 class CPUTune(XMLBuilder):
     """
     Class for generating <cpu> XML
     """
     _XML_ROOT_NAME = "cputune"
+    _XML_PROP_ORDER = ["vcpus", "emulatorpin_cpuset", "iothreadpins"]
+
     vcpus = XMLChildProperty(_VCPUPin)
+    emulatorpin_cpuset = XMLProperty("./emulatorpin/@cpuset")
+    iothreadpins = XMLChildProperty(_IOThreadPin)
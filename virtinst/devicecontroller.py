@@ -94,13 +94,15 @@ class VirtualController(VirtualDevice):
         return ctrl
 
 
-    _XML_PROP_ORDER = ["type", "index", "model", "master_startport"]
+    _XML_PROP_ORDER = ["type", "index", "model", "master_startport",
+                       "driver_iothread"]
 
     type = XMLProperty("./@type")
     model = XMLProperty("./@model")
     vectors = XMLProperty("./@vectors", is_int=True)
     ports = XMLProperty("./@ports", is_int=True)
     master_startport = XMLProperty("./master/@startport", is_int=True)
+    driver_iothread = XMLProperty("./driver/@iothread", is_int=True)
 
     index = XMLProperty("./@index", is_int=True, default_cb=lambda s: 0)
 
@@ -29,6 +29,7 @@ import re
 from . import diskbackend
 from . import util
 from .device import VirtualDevice
+from .storage import StoragePool
 from .xmlbuilder import XMLBuilder, XMLChildProperty, XMLProperty
 
 
@@ -50,6 +51,45 @@ def _qemu_sanitize_drvtype(phystype, fmt, manual_format=False):
     return fmt
 
 
+# Filesystems where O_DIRECT + native AIO either isn't supported or
+# serializes on the server, so use qemu's thread pool instead
+_NETWORK_FS_TYPES = ["nfs", "nfs4", "cifs", "smb3", "ceph",
+                     "fuse.glusterfs"]
+
+
+def _get_mount_fstype(mounttext, path):
+    """
+    Return the filesystem type of the longest mount point in mounttext,
+    which is in /proc/mounts format, that contains path
+    """
+    ret = None
+    retlen = -1
+    for line in mounttext.splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        mnt = fields[1].replace("\\040", " ")
+        if ((path == mnt or path.startswith(mnt.rstrip("/") + "/")) and
+            len(mnt) > retlen):
+            ret = fields[2]
+            retlen = len(mnt)
+    return ret
+
+
+def _get_path_fstype(path):
+    """
+    Return the filesystem type of the local mount containing path,
+    or None if it can't be determined
+    """
+    try:
+        mounttext = open("/proc/mounts").read()
+    except Exception as e:
+        logging.debug("Error reading /proc/mounts: %s", e)
+        return None
+
+    return _get_mount_fstype(mounttext, os.path.realpath(path))
+
+
 def _is_dir_searchable(uid, username, path):
     """
     Check if passed directory is searchable by uid
@@ -143,6 +183,11 @@ class VirtualDisk(VirtualDevice):
 
     IO_MODE_NATIVE = "native"
     IO_MODE_THREADS = "threads"
+
+    # I/O tuning profiles picked by set_defaults, see _get_io_profile
+    IO_PROFILE_BLOCK = "block"
+    IO_PROFILE_THIN_BLOCK = "thin-block"
+    IO_PROFILE_NETWORK_FS = "network-fs"
     io_modes = [IO_MODE_NATIVE, IO_MODE_THREADS]
 
     error_policies = ["ignore", "stop", "enospace", "report"]
@@ -342,17 +387,21 @@ class VirtualDisk(VirtualDevice):
         if not path:
             return []
 
-        # Find all volumes that have 'path' somewhere in their backing chain
+        # Find all volumes that have 'path' somewhere in their backing chain.
+        # Many volumes can share one backing store, like linked clones
+        volmap = {}
+        for vol in conn.fetch_all_vols():
+            if vol.backing_store:
+                volmap.setdefault(vol.backing_store, []).append(
+                    vol.target_path)
+
         vols = []
-        volmap = dict((vol.backing_store, vol)
-                      for vol in conn.fetch_all_vols() if vol.backing_store)
-        backpath = path
-        while backpath in volmap:
-            vol = volmap[backpath]
-            if vol in vols:
-                break
-            backpath = vol.target_path
-            vols.append(backpath)
+        backpaths = [path]
+        while backpaths:
+            for volpath in volmap.get(backpaths.pop(), []):
+                if volpath not in vols:
+                    vols.append(volpath)
+                    backpaths.append(volpath)
 
         ret = []
         vms = conn.fetch_all_guests()
@@ -363,8 +412,10 @@ class VirtualDisk(VirtualDevice):
                     continue
 
             for disk in vm.get_devices("disk"):
-                if disk.path in vols and vm.name not in ret:
-                    # VM uses the path indirectly via backing store
+                if not read_only and disk.path in vols:
+                    # VM uses the path indirectly via backing store. Backing
+                    # images are only ever read, so that's fine for
+                    # a read_only user of the path
                     ret.append(vm.name)
                     break
 
@@ -477,7 +528,7 @@ class VirtualDisk(VirtualDevice):
         "type", "device", "snapshot_policy",
         "driver_name", "driver_type",
         "driver_cache", "driver_discard", "driver_detect_zeroes",
-        "driver_io", "error_policy",
+        "driver_io", "driver_iothread", "error_policy",
         "_source_file", "_source_dev", "_source_dir",
         "auth_username", "auth_secret_type", "auth_secret_uuid",
         "source_volume", "source_pool", "source_protocol", "source_name",
@@ -492,6 +543,7 @@ class VirtualDisk(VirtualDevice):
         self._source_volume_err = None
         self._storage_backend = None
         self.storage_was_created = False
+        self.io_profile = None
 
 
     #############################
@@ -768,6 +820,7 @@ class VirtualDisk(VirtualDevice):
     driver_discard = XMLProperty("./driver/@discard")
     driver_detect_zeroes = XMLProperty("./driver/@detect_zeroes")
     driver_io = XMLProperty("./driver/@io")
+    driver_iothread = XMLProperty("./driver/@iothread", is_int=True)
 
     error_policy = XMLProperty("./driver/@error_policy")
     serial = XMLProperty("./serial")
@@ -922,15 +975,85 @@ class VirtualDisk(VirtualDevice):
             return
         if not self.is_disk():
             return
-        if not self.type == self.TYPE_BLOCK:
+
+        self.io_profile = self._get_io_profile()
+        if not self.io_profile:
             return
 
-        # Enable cache=none and io=native for block devices. Would
-        # be nice if qemu did this for us but that time has long passed.
-        if not self.driver_cache:
-            self.driver_cache = self.CACHE_MODE_NONE
-        if not self.driver_io:
-            self.driver_io = self.IO_MODE_NATIVE
+        cache, io, discard = {
+            # Enable cache=none and io=native for block devices. Would
+            # be nice if qemu did this for us but that time has long passed.
+            self.IO_PROFILE_BLOCK: (self.CACHE_MODE_NONE,
+                                    self.IO_MODE_NATIVE, None),
+            self.IO_PROFILE_THIN_BLOCK: (self.CACHE_MODE_NONE,
+                                         self.IO_MODE_NATIVE,
+                                         self.DISCARD_MODE_UNMAP),
+            # Bypass the host page cache so the server sees guest flushes,
+            # but native AIO blocks in io_submit on network filesystems
+            self.IO_PROFILE_NETWORK_FS: (self.CACHE_MODE_NONE,
+                                         self.IO_MODE_THREADS, None),
+        }[self.io_profile]
+
+        if cache and not self.driver_cache:
+            self.driver_cache = cache
+        if io and not self.driver_io:
+            self.driver_io = io
+        if (discard and not self.driver_discard and
+            not self.read_only and
+            self.conn.check_support(self.conn.SUPPORT_CONN_DISK_DISCARD)):
+            self.driver_discard = discard
+            # Turn guest zero writes into unmaps too, keeps thin
+            # storage thin when the guest doesn't issue discards itself
+            if (not self.driver_detect_zeroes and
+                self.conn.check_support(
+                    self.conn.SUPPORT_CONN_DISK_DETECT_ZEROES)):
+                self.driver_detect_zeroes = "unmap"
+
+    def _is_thin_lvm(self):
+        backend = self._storage_backend
+        if not backend or not backend.get_parent_pool():
+            return False
+        if backend.get_parent_pool_xml().type != StoragePool.TYPE_LOGICAL:
+            return False
+        if not backend.get_vol_object() and not backend.get_vol_install():
+            return False
+
+        volxml = backend.get_vol_xml()
+        return bool(volxml.capacity and
+                    volxml.allocation < volxml.capacity)
+
+    def _is_on_network_fs(self):
+        backend = self._storage_backend
+        if backend and backend.get_parent_pool():
+            if backend.get_parent_pool_xml().type == StoragePool.TYPE_NETFS:
+                return True
+        if self.conn.is_remote() or not self.path:
+            return False
+        return _get_path_fstype(self.path) in _NETWORK_FS_TYPES
+
+    def _get_io_profile(self):
+        """
+        Pick an I/O tuning profile for the disk's backing storage, or
+        None to leave everything at the hypervisor defaults
+        """
+        if self.type == self.TYPE_BLOCK:
+            if self._is_thin_lvm():
+                return self.IO_PROFILE_THIN_BLOCK
+            return self.IO_PROFILE_BLOCK
+        if self.type == self.TYPE_FILE and self._is_on_network_fs():
+            return self.IO_PROFILE_NETWORK_FS
+        return None
+
+    def get_io_profile_desc(self):
+        """
+        Return a human readable summary of the driver I/O settings
+        """
+        settings = [("cache", self.driver_cache),
+                    ("io", self.driver_io),
+                    ("discard", self.driver_discard),
+                    ("detect_zeroes", self.driver_detect_zeroes)]
+        return ",".join(["%s=%s" % (name, val)
+                         for name, val in settings if val])
 
 
     def is_size_conflict(self):
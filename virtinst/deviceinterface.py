@@ -23,6 +23,7 @@ import random
 
 from . import util
 from .device import VirtualDevice
+from .domainnumatune import get_phy_cpus
 from .xmlbuilder import XMLBuilder, XMLChildProperty, XMLProperty
 
 
@@ -201,6 +202,7 @@ class VirtualNetworkInterface(VirtualDevice):
 
         self._random_mac = None
         self._default_bridge = None
+        self.tuning_auto = False
 
 
     ###############
@@ -330,5 +332,25 @@ class VirtualNetworkInterface(VirtualDevice):
         else:
             self.type, self.source = _default_network(self.conn)
 
+    def set_tuning_defaults(self, guest):
+        """
+        For virtio NICs of KVM guests, use the in kernel vhost backend
+        and give multi vCPU guests one queue per vCPU, capped at the
+        number of host CPUs. Explicitly set values are left alone.
+        """
+        if self.model != "virtio" or guest.type != "kvm":
+            return
+        if self.type not in [self.TYPE_VIRTUAL, self.TYPE_BRIDGE,
+                             self.TYPE_DIRECT, self.TYPE_ETHERNET]:
+            # usermode networking doesn't go through a tap device
+            return
+
+        if not self.driver_name:
+            self.driver_name = "vhost"
+
+        queues = min(guest.vcpus or 1, get_phy_cpus(self.conn))
+        if self.driver_queues is None and queues > 1:
+            self.driver_queues = queues
+
 
 VirtualNetworkInterface.register_type()
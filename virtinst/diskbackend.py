@@ -25,9 +25,109 @@ import stat
 
 import libvirt
 
+from . import pollhelpers
 from .storage import StoragePool, StorageVolume
 
 
+class StoragePathResolver(object):
+    """
+    Map storage paths to their libvirt (volume, pool) objects, using a
+    snapshot built from one listing of all pools and their volumes.
+    This saves a handful of lookups per path when resolving every disk
+    of every guest on the connection.
+
+    The snapshot is dropped by invalidate(), which the connection calls
+    when a pool is added or refreshed, or libvirt reports a pool event.
+    A path missing from the snapshot is not authoritative, callers
+    should fall back to the regular lookups.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+        self._snapshot = None
+
+    def _build_snapshot(self):
+        pools = {}
+        vols = {}
+        if not self._conn.check_support(self._conn.SUPPORT_CONN_STORAGE):
+            return pools, vols
+
+        targets = dict((p.name, p.target_path)
+                       for p in self._conn.fetch_all_pools())
+        ignore, ignore, poolobjs = pollhelpers.fetch_pools(
+            self._conn, {}, lambda obj, ignore: obj)
+
+        for pool in poolobjs:
+            target = targets.get(pool.name())
+            if target:
+                target = os.path.abspath(target)
+                pools.setdefault(target, pool)
+
+            try:
+                if not pool.isActive():
+                    continue
+            except libvirt.libvirtError as e:
+                logging.debug("Error checking pool=%s: %s", pool.name(), e)
+                continue
+
+            ignore, ignore, volobjs = pollhelpers.fetch_volumes(
+                self._conn, pool, {}, lambda obj, ignore: obj)
+            for vol in volobjs:
+                # For file and block backed pools the key is the volume
+                # path, otherwise guess it from the pool target, which
+                # is right for logical and disk pools
+                path = vol.key()
+                if not path.startswith("/"):
+                    if not target:
+                        continue
+                    path = os.path.join(target, vol.name())
+                vols.setdefault(path, (vol, pool))
+
+        return pools, vols
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            try:
+                snapshot = self._build_snapshot()
+            except Exception as e:
+                logging.debug("Error building storage path map: %s", e)
+                snapshot = ({}, {})
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def lookup_vol(self, path):
+        """
+        Return the (volume, pool) pair for the passed volume path, or
+        (None, None) if it isn't in the snapshot
+        """
+        vol, pool = self._get_snapshot()[1].get(path, (None, None))
+        if not vol:
+            return None, None
+
+        # Make sure it wasn't removed since the snapshot was built, or
+        # behind libvirt's back. Remote connections can't check the
+        # path, so ask libvirt, still cheaper than a lookup by path
+        if self._conn.is_remote():
+            try:
+                vol.info()
+            except libvirt.libvirtError as e:
+                logging.debug("Stale storage path map entry %s: %s",
+                              path, e)
+                return None, None
+        elif not os.path.exists(path):
+            return None, None
+        return vol, pool
+
+    def lookup_pool(self, path):
+        """
+        Return the pool whose target path is the passed directory, or None
+        """
+        return self._get_snapshot()[0].get(os.path.abspath(path))
+
+
 def _lookup_pool_by_dirname(conn, path):
     """
     Try to find the parent pool for the passed path.
@@ -35,7 +135,12 @@ def _lookup_pool_by_dirname(conn, path):
 
     return pool, or None if not found
     """
-    pool = StoragePool.lookup_pool_by_path(conn, os.path.dirname(path))
+    dirname = os.path.dirname(path)
+    resolver = conn.get_storage_path_resolver()
+    pool = resolver.lookup_pool(dirname)
+    if not pool:
+        # The map may predate a newly defined pool
+        pool = StoragePool.lookup_pool_by_path(conn, dirname)
     if not pool:
         return None
 
@@ -103,6 +208,11 @@ def check_if_path_managed(conn, path):
 
     Returns (volume, parent pool). Only one is returned at a time.
     """
+    resolver = conn.get_storage_path_resolver()
+    vol, pool = resolver.lookup_vol(path)
+    if vol:
+        return vol, pool
+
     vol, ignore = _lookup_vol_by_path(conn, path)
     if vol:
         return vol, vol.storagePoolLookupByVolume()
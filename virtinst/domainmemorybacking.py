@@ -34,3 +34,21 @@ class DomainMemorybacking(XMLBuilder):
     page_nodeset = XMLProperty("./hugepages/page/@nodeset")
     nosharepages = XMLProperty("./nosharepages", is_bool=True)
     locked = XMLProperty("./locked", is_bool=True)
+
+    def get_page_size_kib(self):
+        """
+        Return the requested huge page size in KiB, or None if unset
+        """
+        if not self.page_size:
+            return None
+
+        unit = (self.page_unit or "KiB").lower()
+        if unit in ["b", "bytes"]:
+            return int(self.page_size) // 1024
+        if unit[0] not in "kmgt":
+            raise ValueError(_("Unknown hugepage unit '%s'") % self.page_unit)
+
+        # 'K', 'KiB' are powers of 1024, 'KB' powers of 1000
+        base = (unit[1:] == "b") and 1000 or 1024
+        power = "kmgt".index(unit[0]) + 1
+        return int(self.page_size) * (base ** power) // 1024
@@ -31,6 +31,39 @@ def get_phy_cpus(conn):
     return pcpus
 
 
+def cpuset_to_list(cpuset):
+    """
+    Convert a cpuset string like '0-3,^2,6' to a sorted list of pCPU ids
+    """
+    cpus = set()
+    exclude = set()
+    for c in (cpuset or "").split(","):
+        if not c:
+            continue
+        if c.startswith("^"):
+            exclude.add(int(c[1:]))
+        elif "-" in c:
+            (x, y) = c.split("-", 1)
+            cpus.update(range(int(x), int(y) + 1))
+        else:
+            cpus.add(int(c))
+    return sorted(cpus - exclude)
+
+
+def list_to_cpuset(cpus):
+    """
+    Convert a list of pCPU ids to a compact cpuset string like '0-3,6'
+    """
+    ranges = []
+    for c in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ",".join([(x == y and str(x) or "%d-%d" % (x, y))
+                     for x, y in ranges])
+
+
 class DomainNumatune(XMLBuilder):
     """
     Class for generating <numatune> XML
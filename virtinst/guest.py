@@ -48,7 +48,7 @@ from .domainblkiotune import DomainBlkiotune
 from .domainfeatures import DomainFeatures
 from .domainmemorybacking import DomainMemorybacking
 from .domainmemorytune import DomainMemorytune
-from .domainnumatune import DomainNumatune
+from .domainnumatune import DomainNumatune, cpuset_to_list, list_to_cpuset
 from .domainresource import DomainResource
 from .domcapabilities import DomainCapabilities
 from .idmap import IdMap
@@ -60,6 +60,15 @@ from .xmlbuilder import XMLBuilder, XMLProperty, XMLChildProperty
 from .xmlnsqemu import XMLNSQemu
 
 
+class _IOThreadID(XMLBuilder):
+    """
+    Class for generating <iothreadids> child <iothread> XML
+    """
+    _XML_ROOT_NAME = "iothread"
+
+    id = XMLProperty("./@id", is_int=True)
+
+
 class Guest(XMLBuilder):
     @staticmethod
     def check_vm_collision(conn, name, do_remove):
@@ -109,7 +118,7 @@ class Guest(XMLBuilder):
     _XML_PROP_ORDER = ["type", "name", "uuid", "title", "description",
         "hotplugmemorymax", "hotplugmemoryslots", "maxmemory", "memory", "blkiotune",
         "memtune", "memoryBacking", "vcpus", "curvcpus", "vcpu_placement",
-        "cpuset", "numatune", "resource", "sysinfo", "bootloader", "os", "idmap",
+        "cpuset", "iothreads", "iothreadids", "numatune", "resource", "sysinfo", "bootloader", "os", "idmap",
         "features", "cpu", "clock", "on_poweroff", "on_reboot", "on_crash",
         "pm", "emulator", "_devices", "seclabels"]
 
@@ -128,6 +137,9 @@ class Guest(XMLBuilder):
         self.skip_default_usbredir = False
         self.skip_default_graphics = False
         self.skip_default_rng = False
+
+        # Spread virtio disks across iothreads in set_defaults
+        self.iothreads_auto_assign = False
         self.x86_cpu_default = self.cpu.SPECIAL_MODE_HOST_MODEL_ONLY
 
         self.__os_object = None
@@ -181,6 +193,8 @@ class Guest(XMLBuilder):
                         default_cb=lambda s: 1)
     curvcpus = XMLProperty("./vcpu/@current", is_int=True)
     vcpu_placement = XMLProperty("./vcpu/@placement")
+    iothreads = XMLProperty("./iothreads", is_int=True)
+    iothreadids = XMLChildProperty(_IOThreadID, relative_xpath="./iothreadids")
 
     def _validate_cpuset(self, val):
         DomainNumatune.validate_cpuset(self.conn, val)
@@ -323,15 +337,18 @@ class Guest(XMLBuilder):
         # any config the user explicitly requested.
         data = (self.os, self.on_reboot)
         try:
-            self._propstore["os"] = self.os.copy()
+            self._propstore["os"] = self.os.copy(share_xml=True)
         except Exception:
             self._finish_get_xml(data)
             raise
         return data
 
     def _finish_get_xml(self, data):
-        (self._propstore["os"],
-         self.on_reboot) = data
+        (self._propstore["os"], on_reboot) = data
+        # Only restore on_reboot if it was set, going through the setter
+        # otherwise marks it as changed since the XML was parsed
+        if "on_reboot" in self._propstore:
+            self.on_reboot = on_reboot
 
     def _get_install_xml(self, *args, **kwargs):
         data = self._prepare_get_xml()
@@ -589,6 +606,47 @@ class Guest(XMLBuilder):
         self.os.loader_secure = True
         self.os.machine = "q35"
 
+    def get_iothread_ids(self):
+        """
+        Return the list of iothread IDs the guest will have at runtime
+        """
+        if self.iothreadids:
+            return [iothread.id for iothread in self.iothreadids]
+        return list(range(1, (self.iothreads or 0) + 1))
+
+    def _get_iothread_targets(self):
+        # virtio-blk disks take an iothread directly, disks on a
+        # virtio-scsi bus use the iothread of their controller
+        ret = [d for d in self.get_devices("disk") if d.bus == "virtio"]
+        ret += [c for c in self.get_devices("controller")
+                if c.type == "scsi" and c.model == "virtio-scsi"]
+        return ret
+
+    def assign_disk_iothreads(self):
+        """
+        Spread virtio-blk disks and virtio-scsi controllers across the
+        guest iothreads, favoring the least used iothread. Devices that
+        already have an iothread are left alone. If the guest has no
+        iothreads configured, use one per device, capped at the vcpu
+        count.
+        """
+        targets = self._get_iothread_targets()
+        if not targets:
+            return
+
+        if not self.iothreads and not self.iothreadids:
+            self.iothreads = max(1, min(len(targets), self.vcpus or 1))
+        ids = self.get_iothread_ids()
+
+        used = [t.driver_iothread for t in targets
+                if t.driver_iothread in ids]
+        for target in targets:
+            if target.driver_iothread:
+                continue
+            iothread = min(ids, key=used.count)
+            target.driver_iothread = iothread
+            used.append(iothread)
+
     ###################
     # Device defaults #
     ###################
@@ -785,6 +843,8 @@ class Guest(XMLBuilder):
         self._set_clock_defaults()
         self._set_emulator_defaults()
         self._set_cpu_defaults()
+        self.apply_numa_placement()
+        self.check_hugepages()
         self._set_feature_defaults()
         self._set_pm_defaults()
 
@@ -793,6 +853,7 @@ class Guest(XMLBuilder):
         self._check_address_multi()
         self._set_disk_defaults()
         self._add_implied_controllers()
+        self._set_iothread_defaults()
         self._set_net_defaults()
         self._set_video_defaults()
         self._set_sound_defaults()
@@ -905,6 +966,228 @@ class Guest(XMLBuilder):
                 self.cpu.add_feature("x2apic", policy="disable")
 
 
+    def _get_host_cpu_load(self):
+        """
+        Return a dict of pCPU id -> number of vCPUs of other guests
+        pinned to it. Unpinned vCPUs can float anywhere so don't count.
+        """
+        load = {}
+        def _add(cpuset, count):
+            cpus = cpuset_to_list(cpuset)
+            for cpu in cpus:
+                load[cpu] = load.get(cpu, 0) + (float(count) / len(cpus))
+
+        for guest in self.conn.fetch_all_guests():
+            if guest.name == self.name:
+                continue
+            pinned = 0
+            for pin in guest.cputune.vcpus:
+                if pin.cpuset:
+                    _add(pin.cpuset, 1)
+                    pinned += 1
+            if guest.cpuset and (guest.vcpus or 1) > pinned:
+                _add(guest.cpuset, (guest.vcpus or 1) - pinned)
+        return load
+
+    def _get_host_cells_free_memory(self, cells):
+        """
+        Return a dict of NUMA cell id -> free memory in KiB, falling
+        back to the cell's total memory if libvirt can't tell us
+        """
+        ret = dict((cell.id, cell.memory or 0) for cell in cells)
+        start = min(ret)
+        try:
+            freemem = self.conn.getCellsFreeMemory(start,
+                                                   max(ret) - start + 1)
+        except Exception as e:
+            logging.debug("Error fetching per cell free memory: %s", e)
+            return ret
+
+        for idx, val in enumerate(freemem):
+            if (start + idx) in ret:
+                ret[start + idx] = val // 1024
+        return ret
+
+    def apply_numa_placement(self):
+        """
+        Implement --cpu placement=auto-numa: pick the smallest set of
+        host NUMA cells that fits the guest's memory and vCPUs, then pin
+        vCPUs, the emulator and guest memory to it. If a numatune nodeset
+        is already set, only cells from that nodeset are considered.
+        """
+        if self.cpu.numa_placement != self.cpu.NUMA_PLACEMENT_AUTO:
+            return
+        if self.vcpu_placement == "auto" or self.cpuset:
+            logging.warning("vcpu placement/cpuset already specified, "
+                            "skipping auto-numa placement.")
+            return
+
+        cells = [cell for cell in self.conn.caps.host.topology.cells
+                 if cell.cpus and cell.id is not None]
+        if len(cells) < 2:
+            logging.debug("Host has less than 2 NUMA cells, "
+                          "skipping auto-numa placement.")
+            return
+        if self.numatune.memory_nodeset:
+            nodes = cpuset_to_list(self.numatune.memory_nodeset)
+            cells = [cell for cell in cells if cell.id in nodes]
+            if not cells:
+                return
+
+        need_mem = self.maxmemory or self.memory or 0
+        need_cpus = self.vcpus or 1
+        load = self._get_host_cpu_load()
+        freemem = self._get_host_cells_free_memory(cells)
+
+        cellinfo = []
+        for cell in cells:
+            cpus = [int(cpu.id) for cpu in cell.cpus]
+            cpuload = sum([load.get(cpu, 0) for cpu in cpus])
+            cellinfo.append((cpuload / len(cpus), -freemem[cell.id],
+                             cell.id, cpus))
+        # Least loaded cells first, then the ones with the most free memory
+        cellinfo.sort()
+
+        def _fits(mem, cpus):
+            return mem >= need_mem and len(cpus) >= need_cpus
+
+        chosen = []
+        for info in cellinfo:
+            if _fits(-info[1], info[3]):
+                chosen = [info]
+                break
+        else:
+            for info in cellinfo:
+                chosen.append(info)
+                if _fits(sum([-i[1] for i in chosen]),
+                         sum([i[3] for i in chosen], [])):
+                    break
+
+        nodeset = list_to_cpuset([info[2] for info in chosen])
+        allcpus = sum([info[3] for info in chosen], [])
+        memfits = sum([-info[1] for info in chosen]) >= need_mem
+        logging.debug("auto-numa placement: nodeset=%s cpus=%s memfits=%s",
+                      nodeset, list_to_cpuset(allcpus), memfits)
+
+        if not self.cputune.vcpus:
+            # Fill each cell up to its pCPU count, overcommitted vCPUs
+            # are spread round robin. Pin to the whole cell so the host
+            # scheduler can still balance within the node.
+            slots = []
+            for info in chosen:
+                slots += [list_to_cpuset(info[3])] * len(info[3])
+            for vcpu in range(need_cpus):
+                pin = self.cputune.vcpus.add_new()
+                pin.vcpu = vcpu
+                pin.cpuset = slots[vcpu % len(slots)]
+        if not self.cputune.emulatorpin_cpuset:
+            self.cputune.emulatorpin_cpuset = list_to_cpuset(allcpus)
+        if not self.numatune.memory_nodeset:
+            self.numatune.memory_nodeset = nodeset
+            self.numatune.memory_mode = (memfits and "strict" or
+                                         "interleave")
+
+    def _get_host_free_pages(self, sizes, cells):
+        """
+        Return a dict of NUMA cell id -> {page size KiB: free count}
+        for the passed cells, or None if libvirt can't tell us
+        """
+        if not self.conn.check_support(self.conn.SUPPORT_CONN_FREE_PAGES):
+            return None
+
+        start = min(cells)
+        try:
+            ret = self.conn.getFreePages(sizes, start,
+                                         max(cells) - start + 1)
+        except Exception as e:
+            logging.debug("Error fetching free hugepages: %s", e)
+            return None
+        return dict((cell, ret.get(cell, {})) for cell in cells)
+
+    def check_hugepages(self):
+        """
+        If the guest requests hugepage backed memory, check the host has
+        enough free huge pages on the guest's host NUMA nodes. If no page
+        size is set, pick the largest one that fits, and if no numatune
+        nodeset is set, prefer a single host node that fits.
+
+        Raises ValueError if no page size and node set fit. This is a
+        best effort check, if the host doesn't report free page info
+        we don't complain.
+        """
+        mb = self.memoryBacking
+        if not mb.hugepages:
+            return
+        if mb.page_nodeset:
+            # Per guest NUMA node page config, too complicated to check
+            return
+
+        host_sizes = sorted([p.size for p in self.conn.caps.host.cpu.pages
+                             if p.size])
+        # The smallest size is the regular system page size
+        sizes = host_sizes[1:]
+        cells = [cell.id for cell in self.conn.caps.host.topology.cells
+                 if cell.id is not None]
+        if not sizes or not cells:
+            logging.debug("Host doesn't report huge page sizes or NUMA "
+                          "cells, skipping hugepage check")
+            return
+
+        need = self.maxmemory or self.memory or 0
+        want_size = mb.get_page_size_kib()
+        if want_size:
+            if want_size not in sizes:
+                raise ValueError(
+                    _("Host does not support %(size)d KiB huge pages. "
+                      "Supported sizes: %(sizes)s KiB") %
+                    {"size": want_size,
+                     "sizes": ", ".join([str(s) for s in sizes])})
+            if need % want_size:
+                raise ValueError(
+                    _("Guest memory %(mem)d KiB is not a multiple of the "
+                      "%(size)d KiB huge page size") %
+                    {"mem": need, "size": want_size})
+            sizes = [want_size]
+
+        fixed_nodeset = bool(self.numatune.memory_nodeset)
+        if fixed_nodeset:
+            cells = [c for c in cpuset_to_list(self.numatune.memory_nodeset)
+                     if c in cells]
+        freepages = cells and self._get_host_free_pages(sizes, cells)
+        if not freepages:
+            return
+
+        for size in reversed(sizes):
+            if need % size:
+                continue
+            npages = need // size
+            percell = [(freepages[cell].get(size, 0), cell)
+                       for cell in cells]
+
+            if not fixed_nodeset:
+                # Best fit, leave the bigger pools for bigger guests
+                single = [cell for (count, cell) in sorted(percell)
+                          if count >= npages]
+                if single:
+                    logging.debug("Using %d KiB hugepages from host node %d",
+                                  size, single[0])
+                    self.numatune.memory_nodeset = str(single[0])
+                    break
+            if sum([count for (count, cell) in percell]) >= npages:
+                logging.debug("Using %d KiB hugepages from host nodes %s",
+                              size, list_to_cpuset(cells))
+                break
+        else:
+            raise ValueError(
+                _("Host does not have enough free huge pages to back "
+                  "%(mem)s of guest memory on host NUMA nodes %(nodes)s") %
+                {"mem": util.pretty_mem(need),
+                 "nodes": list_to_cpuset(cells)})
+
+        if not mb.page_size:
+            mb.page_size = str(size)
+            mb.page_unit = "KiB"
+
     def _hyperv_supported(self):
         if (self.os.loader_type == "pflash" and
             self.os_variant in ("win2k8r2", "win7")):
@@ -1118,6 +1401,15 @@ class Guest(XMLBuilder):
                 disk.cli_generated_target = False
                 used_targets.append(disk.generate_target(used_targets))
 
+    def _set_iothread_defaults(self):
+        if not self.iothreads_auto_assign:
+            return
+        if not self.conn.check_support(self.conn.SUPPORT_CONN_IOTHREADS):
+            logging.warning("iothreads not supported, skipping "
+                            "automatic disk assignment.")
+            return
+        self.assign_disk_iothreads()
+
     def _set_net_defaults(self):
         net_model = None
         if not self.os.is_hvm():
@@ -1127,10 +1419,11 @@ class Guest(XMLBuilder):
         else:
             net_model = self._os_object.default_netmodel()
 
-        if net_model:
-            for net in self.get_devices("interface"):
-                if not net.model:
-                    net.model = net_model
+        for net in self.get_devices("interface"):
+            if net_model and not net.model:
+                net.model = net_model
+            if net.tuning_auto:
+                net.set_tuning_defaults(self)
 
     def _set_sound_defaults(self):
         if self.conn.check_support(
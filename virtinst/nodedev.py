@@ -19,6 +19,7 @@
 
 import logging
 import os
+import re
 
 from .xmlbuilder import XMLBuilder, XMLProperty, XMLChildProperty
 
@@ -92,8 +93,12 @@ class NodeDevice(XMLBuilder):
 
     @staticmethod
     def parse(conn, xml):
-        tmpdev = NodeDevice(conn, parsexml=xml, allow_node_instantiate=True)
-        cls = _typeToDeviceClass(tmpdev.device_type)
+        devtype = _sniffDeviceType(xml)
+        if devtype is None:
+            tmpdev = NodeDevice(conn, parsexml=xml,
+                                allow_node_instantiate=True)
+            devtype = tmpdev.device_type
+        cls = _typeToDeviceClass(devtype)
         return cls(conn, parsexml=xml, allow_node_instantiate=True)
 
     def __init__(self, *args, **kwargs):
@@ -403,24 +408,40 @@ def _AddressStringToNodedev(conn, addrstr):
                          addrstr)
 
 
+# Matches the type of the first <capability> element in nodedev XML.
+# Nested <capability> elements are always inside the top level one,
+# so the first match is the top level device type.
+_CAPABILITY_TYPE_RE = re.compile(
+    r"<capability\s[^>]*?\btype\s*=\s*(['\"])(.*?)\1")
+
+
+def _sniffDeviceType(xml):
+    """
+    Pull the top level capability type out of the raw nodedev XML,
+    so NodeDevice.parse doesn't need to parse the document twice.
+
+    :returns: type string, or None if it couldn't be determined
+    """
+    if hasattr(xml, "decode"):
+        xml = xml.decode("utf-8", "ignore")
+    match = _CAPABILITY_TYPE_RE.search(xml or "")
+    if not match:
+        return None
+    return match.group(2)
+
+
+_DEVICE_CLASS_MAP = {
+    NodeDevice.CAPABILITY_TYPE_SYSTEM: SystemDevice,
+    NodeDevice.CAPABILITY_TYPE_NET: NetDevice,
+    NodeDevice.CAPABILITY_TYPE_PCI: PCIDevice,
+    NodeDevice.CAPABILITY_TYPE_USBDEV: USBDevice,
+    NodeDevice.CAPABILITY_TYPE_USBBUS: USBBus,
+    NodeDevice.CAPABILITY_TYPE_STORAGE: StorageDevice,
+    NodeDevice.CAPABILITY_TYPE_SCSIBUS: SCSIBus,
+    NodeDevice.CAPABILITY_TYPE_SCSIDEV: SCSIDevice,
+    NodeDevice.CAPABILITY_TYPE_DRM: DRMDevice,
+}
+
+
 def _typeToDeviceClass(t):
-    if t == NodeDevice.CAPABILITY_TYPE_SYSTEM:
-        return SystemDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_NET:
-        return NetDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_PCI:
-        return PCIDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_USBDEV:
-        return USBDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_USBBUS:
-        return USBBus
-    elif t == NodeDevice.CAPABILITY_TYPE_STORAGE:
-        return StorageDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_SCSIBUS:
-        return SCSIBus
-    elif t == NodeDevice.CAPABILITY_TYPE_SCSIDEV:
-        return SCSIDevice
-    elif t == NodeDevice.CAPABILITY_TYPE_DRM:
-        return DRMDevice
-    else:
-        return NodeDevice
+    return _DEVICE_CLASS_MAP.get(t, NodeDevice)
@@ -294,14 +294,10 @@ class StoragePool(_StorageObject):
         Finds a name similar (or equal) to passed 'basename' that is not
         in use by another pool. Extra params are passed to generate_name
         """
-        def cb(name):
-            for pool in conn.fetch_all_pools():
-                if pool.name == name:
-                    return True
-            return False
-
-        kwargs["lib_collision"] = False
-        return util.generate_name(basename, cb, **kwargs)
+        kwargs["existing_names"] = [pool.name for pool in
+                                    conn.fetch_all_pools()]
+        return util.generate_name(basename, conn.storagePoolLookupByName,
+                                  **kwargs)
 
 
     ######################
@@ -577,6 +573,7 @@ class StorageVolume(_StorageObject):
         in use by another volume. Extra params are passed to generate_name
         """
         pool_object.refresh(0)
+        kwargs["existing_names"] = pool_object.listVolumes()
         return util.generate_name(basename,
                                   pool_object.storageVolLookupByName,
                                   **kwargs)
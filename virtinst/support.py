@@ -326,6 +326,19 @@ SUPPORT_CONN_USB3_PORTS = _make(version="1.3.5")
 SUPPORT_CONN_MACHVIRT_PCI_DEFAULT = _make(version="3.0.0")
 SUPPORT_CONN_QEMU_XHCI = _make(version="3.3.0")
 SUPPORT_CONN_VNC_NONE_AUTH = _make(hv_version={"qemu": "2.9.0"})
+SUPPORT_CONN_IOTHREADS = _make(
+    version="1.2.15", hv_version={"qemu": "2.1.0", "test": 0})
+SUPPORT_CONN_NODE_CPU_STATS = _make(
+    function="virConnect.getCPUStats", run_args=(-1, 0))
+SUPPORT_CONN_NODE_MEMORY_STATS = _make(
+    function="virConnect.getMemoryStats", run_args=(-1, 0))
+SUPPORT_CONN_DISK_DISCARD = _make(
+    version="1.0.6", hv_version={"qemu": "1.5.0", "test": 0})
+SUPPORT_CONN_DISK_DETECT_ZEROES = _make(
+    version="2.0.0", hv_version={"qemu": "2.1.0", "test": 0})
+SUPPORT_CONN_FREE_PAGES = _make(
+    function="virConnect.getFreePages", version="1.2.6",
+    hv_version={"qemu": 0})
 
 
 # This is for disk <driver name=qemu>. xen supports this, but it's
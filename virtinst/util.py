@@ -109,7 +109,8 @@ def validate_macaddr(val):
 
 
 def generate_name(base, collision_cb, suffix="", lib_collision=True,
-                  start_num=1, sep="-", force_num=False, collidelist=None):
+                  start_num=1, sep="-", force_num=False, collidelist=None,
+                  existing_names=None):
     """
     Generate a new name from the passed base string, verifying it doesn't
     collide with the collision callback.
@@ -133,20 +134,25 @@ def generate_name(base, collision_cb, suffix="", lib_collision=True,
         generated number (default is "-")
     :param force_num: Force the generated name to always end with a number
     :param collidelist: An extra list of names to check for collision
+    :param existing_names: Optional list of every name currently in use,
+        fetched up front by the caller. Candidates are checked against it
+        locally, so collision_cb is only called to verify the chosen
+        name, rather than once per candidate.
     """
-    collidelist = collidelist or []
+    collidelist = set(collidelist or [])
+    collidelist.update(existing_names or [])
 
     def collide(n):
         if n in collidelist:
             return True
         if lib_collision:
-            return libvirt_collision(collision_cb, tryname)
+            return libvirt_collision(collision_cb, n)
         else:
-            return collision_cb(tryname)
+            return collision_cb(n)
 
-    numrange = list(range(start_num, start_num + 100000))
+    numrange = range(start_num, start_num + 100000)
     if not force_num:
-        numrange = [None] + numrange
+        numrange = [None] + list(numrange)
 
     for i in numrange:
         tryname = base
@@ -302,7 +308,11 @@ def register_libvirt_error_handler():
         ignore = userdata
         logging.debug("libxml2 callback error: %s", err)
     libvirt.registerErrorHandler(f=libvirt_callback, ctx=None)
-    import libxml2
+    try:
+        import libxml2
+    except ImportError:
+        # The lxml XML backend doesn't need this
+        return
     libxml2.registerErrorHandler(f=libxml2_callback, ctx=None)
 
 
@@ -20,12 +20,22 @@
 # MA 02110-1301 USA.
 
 import copy
+import itertools
 import logging
 import os
 import re
 import string  # pylint: disable=deprecated-module
+import threading
 
-import libxml2
+try:
+    import libxml2
+except ImportError:
+    libxml2 = None
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 from . import util
 
@@ -46,6 +56,12 @@ _namespaces = {
     "qemu": "http://libvirt.org/schemas/domain/qemu/1.0",
 }
 
+# Source of _XMLDocument generation numbers. Values are handed out
+# from a single counter so a freshly parsed document can never reuse
+# a generation that a stale get_xml_config cache entry still holds.
+_xml_generation_counter = itertools.count(1)
+_xml_generation_local = threading.local()
+
 
 
 def _sanitize_libxml_xml(xml):
@@ -102,9 +118,80 @@ class _XPath(object):
 
 class _XMLAPI(object):
     """
-    Class that encapsulates all our libxml2 API usage, so it doesn't
-    bleed into other parts of the app
+    Interface for the XML library backends. All XML library usage is
+    hidden behind this, so it doesn't bleed into other parts of the app.
+    Nodes returned by find() are opaque to callers; everything else
+    works on xpaths relative to the document root.
+    """
+    @classmethod
+    def parse(cls, parsexml):
+        """
+        Build an instance from the passed XML string
+        """
+        raise NotImplementedError()
+
+    def copy_api(self):
+        """
+        Return an independent copy of the document
+        """
+        raise NotImplementedError()
+
+    def find(self, xpath):
+        raise NotImplementedError()
+
+    def count(self, xpath):
+        raise NotImplementedError()
+
+    def get_xml(self, xpath):
+        raise NotImplementedError()
+
+    def get_xpath_content(self, xpath, is_bool):
+        """
+        Return the text content at xpath, or None if the node doesn't
+        exist. For is_bool, return True if the node exists.
+        """
+        raise NotImplementedError()
+
+    def set_xpath_content(self, xpath, setval):
+        """
+        Set the content at xpath to setval, creating any missing nodes.
+        True just creates the node, None or False removes it.
+        """
+        raise NotImplementedError()
+
+    def node_set_text(self, xpath, text):
+        """
+        Replace all content of the node at xpath with the raw text
+        """
+        raise NotImplementedError()
+
+    def node_add_xml(self, xpath, xml):
+        """
+        Parse xml and add it as the last child of the node at xpath,
+        creating that node if needed
+        """
+        raise NotImplementedError()
+
+    def node_remove(self, xpath, dofree=True):
+        """
+        Remove all XML content at the passed xpath, along with any
+        parent elements that are left empty
+
+        :param dofree: Actually don't free it. Used when removing
+            say a VirtualDevice, we really are just transferring the XMl
+            to a new independent object
+        """
+        raise NotImplementedError()
+
+
+class _Libxml2API(_XMLAPI):
+    """
+    _XMLAPI implementation using the libxml2 python bindings
     """
+    @classmethod
+    def parse(cls, parsexml):
+        return cls(libxml2.parseDoc(parsexml))
+
     def __init__(self, doc):
         self._doc = doc
         self._ctx = doc.xpathNewContext()
@@ -124,14 +211,14 @@ class _XMLAPI(object):
 
     def copy_api(self):
         newdoc = self._ctx.contextNode().doc.copyDoc(True)
-        return _XMLAPI(newdoc)
+        return _Libxml2API(newdoc)
 
     def find(self, xpath):
         node = self._ctx.xpathEval(xpath)
         return (node and node[0] or None)
 
-    def findall(self, xpath):
-        return self._ctx.xpathEval(xpath)
+    def count(self, xpath):
+        return len(self._ctx.xpathEval(xpath))
 
     def get_xml(self, xpath):
         node = self.find(xpath)
@@ -139,11 +226,45 @@ class _XMLAPI(object):
             return ""
         return _sanitize_libxml_xml(node.serialize())
 
+    def get_xpath_content(self, xpath, is_bool):
+        node = self.find(xpath)
+        if not node:
+            return None
+        if is_bool:
+            return True
+        return node.content
+
 
     #####################
     # XML editting APIs #
     #####################
 
+    def set_xpath_content(self, xpath, setval):
+        if setval is None or setval is False:
+            self.node_remove(xpath)
+            return
+
+        node = self.find(xpath)
+        if not node:
+            node = self.node_make_stub(xpath)
+
+        if setval is True:
+            # Boolean property, creating the node is enough
+            return
+
+        node.setContent(util.xml_escape(str(setval)))
+
+    def node_set_text(self, xpath, text):
+        node = self.find(xpath)
+        if node:
+            node.setContent(text)
+
+    def node_add_xml(self, xpath, xml):
+        newnode = libxml2.parseDoc(xml).children
+        parentnode = self.node_make_stub(xpath)
+        # Tack newnode on the end
+        self.node_add_child(parentnode, newnode)
+
     def _node_new(self, nodename, nsname):
         newnode = libxml2.newNode(nodename)
         if not nsname:
@@ -270,13 +391,6 @@ class _XMLAPI(object):
         return parentnode
 
     def node_remove(self, xpath, dofree=True):
-        """
-        Remove all XML content at the passed xpath, and free it
-
-        :param dofree: Actually don't free it. Used when removing
-            say a VirtualDevice, we really are just transferring the XMl
-            to a new independent object
-        """
         nextxpath = xpath
         root_node = self._ctx.contextNode()
 
@@ -317,6 +431,302 @@ class _XMLAPI(object):
                 node.freeNode()
 
 
+# Compiled lxml XPath objects, shared by all documents. They aren't
+# safe to share between threads, so keep one cache per thread
+_lxml_xpath_cache = threading.local()
+
+
+def _lxml_xpath(xpath):
+    cache = getattr(_lxml_xpath_cache, "xpaths", None)
+    if cache is None:
+        cache = _lxml_xpath_cache.xpaths = {}
+    ret = cache.get(xpath)
+    if ret is None:
+        ret = lxml_etree.XPath(xpath, namespaces=_namespaces)
+        cache[xpath] = ret
+    return ret
+
+
+class _LxmlAPI(_XMLAPI):
+    """
+    _XMLAPI implementation using lxml. XPaths are compiled once and
+    cached, and documents are copied with a plain subtree deepcopy.
+
+    lxml stores whitespace as element text/tail rather than separate
+    text nodes, so the formatting logic is reimplemented to match what
+    the libxml2 backend generates.
+    """
+    @classmethod
+    def parse(cls, parsexml):
+        parser = lxml_etree.XMLParser(resolve_entities=False)
+        return cls(lxml_etree.fromstring(parsexml.encode("utf-8"), parser))
+
+    def __init__(self, root):
+        self._root = root
+
+
+    ###############
+    # Simple APIs #
+    ###############
+
+    def copy_api(self):
+        return _LxmlAPI(copy.deepcopy(self._root))
+
+    def find(self, xpath):
+        # Don't test results for truth: childless elements and empty
+        # attribute values are both False
+        ret = _lxml_xpath(xpath)(self._root)
+        if not len(ret):
+            return None
+        return ret[0]
+
+    def count(self, xpath):
+        return len(_lxml_xpath(xpath)(self._root))
+
+    def get_xml(self, xpath):
+        node = self.find(xpath)
+        if node is None or isinstance(node, str):
+            return ""
+        xml = lxml_etree.tostring(node, encoding="unicode", with_tail=False)
+
+        parent = node.getparent()
+        if parent is not None:
+            # lxml redeclares namespaces inherited from the node's
+            # ancestors, libxml2 doesn't. Strip them from the start tag
+            tagend = xml.index(">")
+            starttag = xml[:tagend]
+            for prefix, uri in parent.nsmap.items():
+                if prefix and node.nsmap.get(prefix) == uri:
+                    starttag = starttag.replace(
+                        ' xmlns:%s="%s"' % (prefix, uri), "", 1)
+            xml = starttag + xml[tagend:]
+        return _sanitize_libxml_xml(xml)
+
+    def get_xpath_content(self, xpath, is_bool):
+        node = self.find(xpath)
+        if node is None:
+            return None
+        if is_bool:
+            return True
+        if isinstance(node, str):
+            # Attribute value
+            return str(node)
+        return _lxml_xpath("string()")(node)
+
+
+    ##########################
+    # Whitespace/text helpers #
+    ##########################
+
+    @staticmethod
+    def _get_text_before(node):
+        prev = node.getprevious()
+        if prev is not None:
+            return prev.tail
+        parent = node.getparent()
+        if parent is not None:
+            return parent.text
+        return None
+
+    @staticmethod
+    def _set_text_before(node, text):
+        prev = node.getprevious()
+        if prev is not None:
+            prev.tail = text
+        else:
+            node.getparent().text = text
+
+    @staticmethod
+    def _get_last_text(node):
+        if len(node):
+            return node[-1].tail
+        return node.text
+
+    @staticmethod
+    def _set_text(node, text):
+        for child in list(node):
+            node.remove(child)
+        node.text = text
+
+
+    #####################
+    # XML editting APIs #
+    #####################
+
+    def set_xpath_content(self, xpath, setval):
+        if setval is None or setval is False:
+            self.node_remove(xpath)
+            return
+
+        node = self.find(xpath)
+        if node is None:
+            node = self.node_make_stub(xpath)
+
+        if setval is True:
+            # Boolean property, creating the node is enough
+            return
+
+        if isinstance(node, str):
+            node.getparent().set(node.attrname, str(setval))
+        else:
+            self._set_text(node, str(setval))
+
+    def node_set_text(self, xpath, text):
+        node = self.find(xpath)
+        if node is not None:
+            self._set_text(node, text)
+
+    def node_add_xml(self, xpath, xml):
+        newnode = self.parse(xml)._root
+        parentnode = self.node_make_stub(xpath)
+        # Tack newnode on the end
+        self.node_add_child(parentnode, newnode)
+
+    def _node_new(self, nodename, nsname):
+        if not nsname:
+            return lxml_etree.Element(nodename)
+
+        # Declare the namespace on the root element, like libxml2 does
+        nsuri = _namespaces[nsname]
+        lxml_etree.cleanup_namespaces(self._root,
+                                      top_nsmap={nsname: nsuri})
+        return lxml_etree.Element("{%s}%s" % (nsuri, nodename))
+
+    def node_add_child(self, parentnode, newnode):
+        """
+        Add 'newnode' as a child of 'parentnode', but try to preserve
+        whitespace and nicely format the result. See the libxml2 version
+        for examples.
+        """
+        content = self._get_last_text(parentnode)
+        if not content:
+            # First child element, copy the parent's indentation
+            content = self._get_text_before(parentnode) or "\n"
+
+        if len(parentnode):
+            parentnode[-1].tail = content + "  "
+        else:
+            parentnode.text = content + "  "
+        parentnode.append(newnode)
+        newnode.tail = content
+        return newnode
+
+    def node_make_stub(self, fullxpath):
+        """
+        Build all nodes for the passed xpath. See the libxml2 version
+        for details. If the xpath ends with a property, an empty
+        property is set and its xpath result is returned.
+        """
+        xpathobj = _XPath(fullxpath)
+        parentpath = "."
+        parentnode = self.find(parentpath)
+        if parentnode is None:
+            raise RuntimeError("programming error: "
+                "Did not find XML root node for xpath=%s" % fullxpath)
+
+        for xpathseg in xpathobj.segments[1:]:
+            parentpath += "/%s" % xpathseg.fullsegment
+
+            # If xpath ends with a property, set a stub value and exit
+            if xpathseg.is_prop:
+                name = xpathseg.nodename
+                if xpathseg.nsname:
+                    name = "{%s}%s" % (_namespaces[xpathseg.nsname], name)
+                parentnode.set(name, "")
+                return self.find(parentpath)
+
+            tmpnode = self.find(parentpath)
+            if tmpnode is not None:
+                # xpath node already exists, nothing to create yet
+                parentnode = tmpnode
+                continue
+
+            newnode = self._node_new(xpathseg.nodename, xpathseg.nsname)
+            parentnode = self.node_add_child(parentnode, newnode)
+
+            # For a conditional xpath like ./foo[@bar='baz'],
+            # we also want to implicitly set <foo bar='baz'/>
+            if xpathseg.condition_prop:
+                parentnode.set(xpathseg.condition_prop,
+                               xpathseg.condition_val)
+
+        return parentnode
+
+    def node_remove(self, xpath, dofree=True):
+        ignore = dofree
+        nextxpath = xpath
+
+        while nextxpath:
+            curxpath = nextxpath
+            is_orig = (curxpath == xpath)
+            node = self.find(curxpath)
+
+            if "/" in curxpath:
+                nextxpath, ignore = curxpath.rsplit("/", 1)
+            else:
+                nextxpath = None
+
+            if node is None:
+                continue
+
+            if isinstance(node, str):
+                if node.is_attribute:
+                    del node.getparent().attrib[node.attrname]
+                continue
+
+            if not isinstance(node.tag, str):
+                # Comment or processing instruction
+                continue
+
+            if len(node) or node.text or node.attrib:
+                # Only do a deep unlink if it was the original requested path
+                if not is_orig:
+                    continue
+
+            if node is self._root or node is _top_node:
+                # Don't unlink the root node, since it's spread out to all
+                # child objects and it ends up wreaking havoc.
+                break
+
+            # Drop preceding whitespace, keeping whatever followed the node
+            self._set_text_before(node, node.tail)
+            node.getparent().remove(node)
+
+
+_xml_backends = {
+    "libxml2": (_Libxml2API, lambda: libxml2),
+    "lxml": (_LxmlAPI, lambda: lxml_etree),
+}
+_xml_backend = None
+
+
+def set_xml_backend(name=None):
+    """
+    Select the XML library used for newly parsed XMLBuilder objects,
+    either 'libxml2' or 'lxml'. If name is None, $VIRTINST_XML_BACKEND
+    is used if set, otherwise the first available library.
+    """
+    global _xml_backend
+    name = name or os.environ.get("VIRTINST_XML_BACKEND")
+    if not name:
+        name = libxml2 and "libxml2" or "lxml"
+
+    if name not in _xml_backends:
+        raise ValueError(_("Unknown XML backend '%s'") % name)
+    apiclass, get_module = _xml_backends[name]
+    if not get_module():
+        raise RuntimeError(_("XML backend '%s' is not installed") % name)
+
+    logging.debug("Using XML backend %s", name)
+    _xml_backend = apiclass
+
+
+def _get_xml_backend():
+    if not _xml_backend:
+        set_xml_backend()
+    return _xml_backend
+
+
 class _XMLChildList(list):
     """
     Little wrapper for a list containing XMLChildProperty output.
@@ -406,6 +816,7 @@ class XMLChildProperty(property):
 
     def append(self, xmlbuilder, newobj):
         # Keep the list ordered by the order of passed in child classes
+        xmlbuilder._xmlstate.doc.bump_generation()
         objlist = self._get(xmlbuilder)
         if len(self.child_classes) == 1:
             objlist.append(newobj)
@@ -422,8 +833,10 @@ class XMLChildProperty(property):
 
         objlist.insert(idx, newobj)
     def remove(self, xmlbuilder, obj):
+        xmlbuilder._xmlstate.doc.bump_generation()
         self._get(xmlbuilder).remove(obj)
     def set(self, xmlbuilder, obj):
+        xmlbuilder._xmlstate.doc.bump_generation()
         xmlbuilder._propstore[self._findpropname(xmlbuilder)] = obj
 
     def get_prop_xpath(self, xmlbuilder, obj):
@@ -621,6 +1034,7 @@ class XMLProperty(property):
 
         propname = self._findpropname(xmlbuilder)
         propstore[propname] = val
+        xmlbuilder._xmlstate.doc.bump_generation()
 
         if propname in proporder:
             proporder.remove(propname)
@@ -675,14 +1089,8 @@ class XMLProperty(property):
         Actually fetch the associated value from the backing XML
         """
         xpath = self._make_xpath(xmlbuilder)
-        node = xmlbuilder._xmlstate.xmlapi.find(xpath)
-        if not node:
-            return None
-
-        content = node.content
-        if self._is_bool:
-            content = True
-        return content
+        return xmlbuilder._xmlstate.xmlapi.get_xpath_content(xpath,
+            self._is_bool)
 
     def setter(self, xmlbuilder, val, validate=True):
         """
@@ -703,22 +1111,50 @@ class XMLProperty(property):
         """
         Actually set the passed value in the XML document
         """
-        xmlapi = xmlbuilder._xmlstate.xmlapi
         xpath = self._make_xpath(xmlbuilder)
+        xmlapi = xmlbuilder._xmlstate.get_writable_xmlapi()
+        xmlapi.set_xpath_content(xpath, setval)
 
-        if setval is None or setval is False:
-            xmlapi.node_remove(xpath)
-            return
 
-        node = xmlapi.find(xpath)
-        if not node:
-            node = xmlapi.node_make_stub(xpath)
+class _XMLDocument(object):
+    """
+    Reference to a parsed XML document. XMLBuilder.copy hands out
+    extra references to the same document rather than copying it up
+    front: the first write through a shared reference gives that
+    reference its own private copy of the document.
+
+    generation changes whenever the document, or the property state of
+    any XMLBuilder backed by it, is altered. get_xml_config caches its
+    output against it.
+    """
+    def __init__(self, xmlapi, refcount=None):
+        self.xmlapi = xmlapi
+        self.generation = next(_xml_generation_counter)
 
-        if setval is True:
-            # Boolean property, creating the node is enough
+        # Single item list shared by every reference to the same xmlapi
+        self._refcount = refcount or [0]
+        self._refcount[0] += 1
+
+    def __del__(self):
+        self._refcount[0] -= 1
+
+    def copy(self):
+        return _XMLDocument(self.xmlapi, self._refcount)
+
+    def bump_generation(self):
+        # Altering the XML while generating it in get_xml_config is an
+        # implementation detail, it doesn't change the object's content
+        if getattr(_xml_generation_local, "getxml_depth", 0):
             return
+        self.generation = next(_xml_generation_counter)
 
-        node.setContent(util.xml_escape(str(setval)))
+    def get_writable_xmlapi(self):
+        self.bump_generation()
+        if self._refcount[0] > 1:
+            self._refcount[0] -= 1
+            self._refcount = [1]
+            self.xmlapi = self.xmlapi.copy_api()
+        return self.xmlapi
 
 
 class _XMLState(object):
@@ -738,29 +1174,55 @@ class _XMLState(object):
         self._parent_xpath = (
             parentxmlstate and parentxmlstate.get_root_xpath()) or ""
 
-        self.xmlapi = None
+        # _XMLDocument, shared with the parent state if we have one
+        self.doc = None
+        # Set by _add_parse_bits, to write to a scratch copy of the XML
+        self.xmlapi_override = None
+
         self.is_build = False
         if not parsexml and not parentxmlstate:
             self.is_build = True
         self.parse(parsexml, parentxmlstate)
 
+    def _get_xmlapi(self):
+        if self.xmlapi_override is not None:
+            return self.xmlapi_override
+        return self.doc.xmlapi
+    xmlapi = property(_get_xmlapi)
+
+    def get_writable_xmlapi(self):
+        """
+        Return the xmlapi to use for altering the document, unsharing it
+        from any XMLBuilder.copy if needed
+        """
+        if self.xmlapi_override is not None:
+            return self.xmlapi_override
+        return self.doc.get_writable_xmlapi()
+
+    def copy(self, doc):
+        """
+        Return a copy of this state backed by the passed _XMLDocument
+        """
+        ret = copy.copy(self)
+        ret.doc = doc
+        ret.xmlapi_override = None
+        return ret
+
     def parse(self, parsexml, parentxmlstate):
         if parentxmlstate:
             self.is_build = parentxmlstate.is_build or self.is_build
-            self.xmlapi = parentxmlstate.xmlapi
+            self.doc = parentxmlstate.doc
             return
 
         if not parsexml:
             parsexml = self.make_xml_stub()
 
         try:
-            doc = libxml2.parseDoc(parsexml)
+            self.doc = _XMLDocument(_get_xml_backend().parse(parsexml))
         except Exception:
             logging.debug("Error parsing xml=\n%s", parsexml)
             raise
 
-        self.xmlapi = _XMLAPI(doc)
-
 
     def make_xml_stub(self):
         ret = "<%s" % self._root_name
@@ -813,6 +1275,10 @@ class XMLBuilder(object):
     # https://bugzilla.redhat.com/show_bug.cgi?id=1184131
     _XML_SANITIZE = False
 
+    # ((document generation, root xpath), xml) of the last
+    # get_xml_config call
+    _xml_cache = None
+
 
     @staticmethod
     def xml_indent(xmlstr, level):
@@ -874,8 +1340,8 @@ class XMLBuilder(object):
             for child_class in xmlprop.child_classes:
                 prop_path = xmlprop.get_prop_xpath(self, child_class)
 
-                nodecount = int(len(self._xmlstate.xmlapi.findall(
-                    self.fix_relative_xpath(prop_path))))
+                nodecount = self._xmlstate.xmlapi.count(
+                    self.fix_relative_xpath(prop_path))
                 for idx in range(nodecount):
                     idxstr = "[%d]" % (idx + 1)
                     obj = child_class(self.conn,
@@ -890,20 +1356,38 @@ class XMLBuilder(object):
     # Public XML Internals #
     ########################
 
-    def copy(self):
+    def copy(self, share_xml=False):
         """
         Do a shallow copy of the device
+
+        :param share_xml: By default the copy gets a copy-on-write
+            reference to the backing XML document, so XML changes to
+            either object don't show up in the other. If True, the copy
+            and its singleton children keep using the same document and
+            child objects as the original
         """
+        doc = None
+        if not share_xml:
+            doc = self._xmlstate.doc.copy()
+        return self._copy_with_doc(doc)
+
+    def _copy_with_doc(self, doc):
         ret = copy.copy(self)
         ret._propstore = ret._propstore.copy()
         ret._proporder = ret._proporder[:]
+        ret._xml_cache = None
+        if doc:
+            ret._xmlstate = self._xmlstate.copy(doc)
 
         # XMLChildProperty stores a list in propstore, which dict shallow
         # copy won't fix for us.
-        for name, value in ret._propstore.items():
-            if not isinstance(value, list):
-                continue
-            ret._propstore[name] = [obj.copy() for obj in ret._propstore[name]]
+        for name, xmlprop in self._all_child_props().items():
+            value = ret._propstore.get(name)
+            if isinstance(value, list):
+                ret._propstore[name] = [obj._copy_with_doc(doc)
+                                        for obj in value]
+            elif value is not None and doc:
+                ret._propstore[name] = value._copy_with_doc(doc)
 
         return ret
 
@@ -920,13 +1404,28 @@ class XMLBuilder(object):
 
     def get_xml_config(self):
         """
-        Return XML string of the object
+        Return XML string of the object. The result is cached until
+        the backing XML document, or any object sharing it, is altered.
         """
-        data = self._prepare_get_xml()
+        cachekey = (self._xmlstate.doc.generation, self.get_root_xpath())
+        use_cache = self._can_cache_xml()
+        if use_cache and self._xml_cache and self._xml_cache[0] == cachekey:
+            return self._xml_cache[1]
+
+        depth = getattr(_xml_generation_local, "getxml_depth", 0)
+        _xml_generation_local.getxml_depth = depth + 1
         try:
-            return self._do_get_xml_config()
+            data = self._prepare_get_xml()
+            try:
+                ret = self._do_get_xml_config()
+            finally:
+                self._finish_get_xml(data)
+
+            if use_cache:
+                self._xml_cache = (cachekey, ret)
         finally:
-            self._finish_get_xml(data)
+            _xml_generation_local.getxml_depth = depth
+        return ret
 
     def clear(self, leave_stub=False):
         """
@@ -939,7 +1438,8 @@ class XMLBuilder(object):
         old_top_node = _top_node
         try:
             if leave_stub:
-                _top_node = self._xmlstate.xmlapi.find(self.get_root_xpath())
+                _top_node = self._xmlstate.get_writable_xmlapi().find(
+                    self.get_root_xpath())
             props = list(self._all_xml_props().values())
             props += list(self._all_child_props().values())
             for prop in props:
@@ -954,12 +1454,12 @@ class XMLBuilder(object):
             # the node in that case, since then the xmlbuilder object is
             # no longer valid, and all the other child xpaths will be
             # pointing to the wrong node. So just stub out the content
-            node = self._xmlstate.xmlapi.find(self.get_root_xpath())
             indent = 2 * self.get_root_xpath().count("/")
-            if node:
-                node.setContent("\n" + (indent * " "))
+            self._xmlstate.get_writable_xmlapi().node_set_text(
+                self.get_root_xpath(), "\n" + (indent * " "))
         else:
-            self._xmlstate.xmlapi.node_remove(self.get_root_xpath())
+            self._xmlstate.get_writable_xmlapi().node_remove(
+                self.get_root_xpath())
 
     def validate(self):
         """
@@ -998,6 +1498,20 @@ class XMLBuilder(object):
     # Internal API #
     ################
 
+    def _can_cache_xml(self):
+        """
+        Objects that are being built from scratch fill in defaults at
+        get_xml_config time, which can depend on host state, so only
+        cache output that comes entirely from parsed XML
+        """
+        if self._xmlstate.is_build:
+            return False
+        for propname in self._all_child_props():
+            for obj in util.listify(self._propstore.get(propname)):
+                if not obj._can_cache_xml():
+                    return False
+        return True
+
     def __get_prop_cache(self, cachename, checkclass):
         if not hasattr(self.__class__, cachename):
             ret = {}
@@ -1069,10 +1583,8 @@ class XMLBuilder(object):
         if not obj._xmlstate.is_build:
             use_xpath = obj.get_root_xpath().rsplit("/", 1)[0]
             indent = 2 * obj.get_root_xpath().count("/")
-            newnode = libxml2.parseDoc(self.xml_indent(xml, indent)).children
-            parentnode = self._xmlstate.xmlapi.node_make_stub(use_xpath)
-            # Tack newnode on the end
-            self._xmlstate.xmlapi.node_add_child(parentnode, newnode)
+            self._xmlstate.get_writable_xmlapi().node_add_xml(use_xpath,
+                self.xml_indent(xml, indent))
         obj._parse_with_children(None, self._xmlstate)
 
     def remove_child(self, obj):
@@ -1088,7 +1600,7 @@ class XMLBuilder(object):
         obj._set_parent_xpath(None)
         obj._set_relative_object_xpath(None)
         obj._parse_with_children(xml, None)
-        self._xmlstate.xmlapi.node_remove(xpath, dofree=False)
+        self._xmlstate.get_writable_xmlapi().node_remove(xpath, dofree=False)
         self._set_child_xpaths()
 
     def list_children_for_class(self, klass):
@@ -1136,9 +1648,14 @@ class XMLBuilder(object):
     def _do_get_xml_config(self):
         xmlstub = self._xmlstate.make_xml_stub()
 
-        xmlapi = self._xmlstate.xmlapi
         if self._xmlstate.is_build:
-            xmlapi = xmlapi.copy_api()
+            xmlapi = self._xmlstate.xmlapi.copy_api()
+        elif self._has_parse_bits():
+            xmlapi = self._xmlstate.get_writable_xmlapi()
+        else:
+            # Nothing to write, so don't unshare a copy-on-write
+            # document just to read it back
+            xmlapi = self._xmlstate.xmlapi
 
         self._add_parse_bits(xmlapi)
         ret = xmlapi.get_xml(self.fix_relative_xpath("."))
@@ -1152,6 +1669,19 @@ class XMLBuilder(object):
             ret += "\n"
         return ret
 
+    def _has_parse_bits(self):
+        """
+        Return True if _add_parse_bits would write anything to the XML:
+        a property set since parsing, or a built child needing defaults
+        """
+        if self._xmlstate.is_build or self._proporder:
+            return True
+        for propname in self._all_child_props():
+            for obj in util.listify(self._propstore.get(propname)):
+                if obj._has_parse_bits():
+                    return True
+        return False
+
     def _add_parse_bits(self, xmlapi):
         """
         Callback that adds the implicitly tracked XML properties to
@@ -1159,12 +1689,12 @@ class XMLBuilder(object):
         """
         origproporder = self._proporder[:]
         origpropstore = self._propstore.copy()
-        origapi = self._xmlstate.xmlapi
+        origapi = self._xmlstate.xmlapi_override
         try:
-            self._xmlstate.xmlapi = xmlapi
+            self._xmlstate.xmlapi_override = xmlapi
             return self._do_add_parse_bits()
         finally:
-            self._xmlstate.xmlapi = origapi
+            self._xmlstate.xmlapi_override = origapi
             self._proporder = origproporder
             self._propstore = origpropstore
 